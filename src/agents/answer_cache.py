@@ -0,0 +1,105 @@
+# agents/answer_cache.py
+#
+# Semantic cache of full pipeline answers. A cached answer is reused when a new
+# query is close enough in embedding space AND retrieval returned the same set
+# of patient records with the same summaries, so an answer never outlives the
+# context it was generated from (a re-embedded summary changes the key).
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# State fields that make up a stored answer
+CACHED_FIELDS = ("ranked_chunks", "prompt", "response", "guardrails", "validation")
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype="float32").ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def summary_hash(summary):
+    return hashlib.sha256(str(summary).encode("utf-8")).hexdigest()
+
+def doc_key_set(chunks):
+    """(patient id, summary hash) of each chunk: the context an answer was generated from."""
+    return frozenset((str(chunk["patient_id"]), summary_hash(chunk["summary"])) for chunk in chunks)
+
+
+class SemanticAnswerCache:
+    """
+    LRU cache of pipeline answers matched by cosine similarity of query vectors.
+    A max_size of 0 disables the cache; ttl_seconds of 0/None keeps entries until evicted.
+    """
+
+    def __init__(self, threshold=0.95, max_size=256, ttl_seconds=3600):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds or None
+        self._entries = OrderedDict()  # key -> (unit vector, doc key set, payload, stored_at)
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _drop_expired(self, now):
+        if self.ttl_seconds is None:
+            return
+        expired = [key for key, entry in self._entries.items() if now - entry[3] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+        self.expirations += len(expired)
+
+    def lookup(self, query_vector, chunks):
+        """Returns (payload, similarity) for the best matching entry, or None on a miss."""
+        if not self.max_size:
+            return None
+        query = _unit(query_vector)
+        docs = doc_key_set(chunks)
+        with self._lock:
+            self._drop_expired(time.time())
+            candidates = [(key, entry) for key, entry in self._entries.items() if entry[1] == docs]
+            if candidates:
+                sims = np.stack([entry[0] for _, entry in candidates]) @ query
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    key, entry = candidates[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(entry[2]), float(sims[best])
+            self.misses += 1
+            return None
+
+    def store(self, query_vector, chunks, state):
+        if not self.max_size:
+            return
+        payload = {field: state[field] for field in CACHED_FIELDS if field in state}
+        with self._lock:
+            self._entries[self._next_key] = (_unit(query_vector), doc_key_set(chunks), payload, time.time())
+            self._next_key += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
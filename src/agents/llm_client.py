@@ -0,0 +1,294 @@
+# agents/llm_client.py
+#
+# Single factory for the chat model used by the graph, the ranker and the validator.
+# Every caller shares one client (and its HTTP connection pool) per model, and every
+# call goes through the same rate limiter, concurrency limit and retry policy.
+
+import os
+import time
+import random
+import asyncio
+import threading
+import weakref
+from collections import deque
+
+import httpx
+from dotenv import load_dotenv
+
+from utils.metrics import STAGE_SECONDS, LLM_CALLS, LLM_RETRIES, LLM_TOKENS
+
+load_dotenv()
+
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.3-70b-versatile")
+# Point at a local fake server (see misc/fake_llm_server.py) for load tests
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL")
+
+# Provider budgets and client limits
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "30"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "12000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "16"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+# Retries with full-jitter exponential backoff
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+
+# Completion tokens reserved up front, before the real usage is known
+COMPLETION_TOKEN_ESTIMATE = 256
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `rate_per_minute`.
+    Callers reserve capacity up front (the balance may go negative) and are told
+    how long to wait, so sync and async callers share one bucket.
+    """
+
+    def __init__(self, rate_per_minute):
+        self.capacity = max(1.0, rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        if self.rate <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+    def refund(self, amount):
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def acquire(self, amount=1):
+        wait = self.reserve(amount)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self, amount=1):
+        wait = self.reserve(amount)
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+
+def estimate_tokens(value):
+    """Rough prompt size (~4 characters per token) for budgeting before the call."""
+    if isinstance(value, str):
+        return max(1, len(value) // 4)
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_tokens(item) for item in value)
+    content = getattr(value, "content", None)
+    return estimate_tokens(content) if content is not None else 1
+
+def _status_code(exc):
+    status = getattr(exc, "status_code", None)
+    if status is None and getattr(exc, "response", None) is not None:
+        status = getattr(exc.response, "status_code", None)
+    return status
+
+def is_retryable(exc):
+    if isinstance(exc, (httpx.TransportError, TimeoutError, ConnectionError)):
+        return True
+    if type(exc).__name__ in ("APIConnectionError", "APITimeoutError"):
+        return True
+    return _status_code(exc) in RETRYABLE_STATUS
+
+def _retry_after(exc):
+    response = getattr(exc, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, exc=None):
+    hinted = _retry_after(exc) if exc is not None else None
+    if hinted is not None:
+        return min(hinted, LLM_BACKOFF_MAX)
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+
+class PooledChatModel:
+    """
+    Wraps a LangChain chat model with a shared request/token budget, bounded
+    concurrency, retries with jittered backoff, and per-call accounting.
+    Exposes invoke / ainvoke / stream like the wrapped model.
+    """
+
+    def __init__(self, model, requests_per_minute=LLM_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=LLM_TOKENS_PER_MINUTE, max_concurrency=LLM_MAX_CONCURRENCY,
+                 max_retries=LLM_MAX_RETRIES):
+        self.model = model
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._async_slots = weakref.WeakKeyDictionary()
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self.recent_calls = deque(maxlen=256)
+        self.totals = {"calls": 0, "errors": 0, "retries": 0, "latency_seconds": 0.0,
+                       "input_tokens": 0, "output_tokens": 0, "rate_limit_wait_seconds": 0.0}
+
+    def _async_semaphore(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_slots:
+            self._async_slots[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._async_slots[loop]
+
+    def _budget(self, value):
+        return estimate_tokens(value) + COMPLETION_TOKEN_ESTIMATE
+
+    def _record(self, started, attempts, waited, response=None, error=None):
+        latency = time.perf_counter() - started
+        usage = getattr(response, "usage_metadata", None) or {}
+        call = {
+            "latency_seconds": latency,
+            "attempts": attempts,
+            "rate_limit_wait_seconds": waited,
+            "input_tokens": usage.get("input_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0),
+            "error": type(error).__name__ if error else None,
+        }
+        with self._stats_lock:
+            self.recent_calls.append(call)
+            self.totals["calls"] += 1
+            self.totals["errors"] += 1 if error else 0
+            self.totals["retries"] += attempts - 1
+            self.totals["latency_seconds"] += latency
+            self.totals["input_tokens"] += call["input_tokens"]
+            self.totals["output_tokens"] += call["output_tokens"]
+            self.totals["rate_limit_wait_seconds"] += waited
+        STAGE_SECONDS.observe(latency, stage="llm_call")
+        STAGE_SECONDS.observe(waited, stage="llm_rate_limit_wait")
+        LLM_CALLS.inc(outcome="error" if error else "ok")
+        LLM_RETRIES.inc(attempts - 1)
+        LLM_TOKENS.inc(call["input_tokens"], kind="prompt")
+        LLM_TOKENS.inc(call["output_tokens"], kind="completion")
+        return call
+
+    def _settle_tokens(self, budget, response):
+        # Give back what was reserved but not used (or charge the overrun)
+        usage = getattr(response, "usage_metadata", None)
+        if usage:
+            self.tokens.refund(budget - usage.get("total_tokens", budget))
+
+    def invoke(self, input, config=None, **kwargs):
+        budget = self._budget(input)
+        started = time.perf_counter()
+        waited = 0.0
+        for attempt in range(self.max_retries + 1):
+            waited += self.requests.acquire(1) + self.tokens.acquire(budget)
+            with self._slots:
+                try:
+                    response = self.model.invoke(input, config, **kwargs)
+                except Exception as exc:
+                    if attempt == self.max_retries or not is_retryable(exc):
+                        self._record(started, attempt + 1, waited, error=exc)
+                        raise
+                    delay = backoff_delay(attempt, exc)
+                else:
+                    self._settle_tokens(budget, response)
+                    self._record(started, attempt + 1, waited, response)
+                    return response
+            time.sleep(delay)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        budget = self._budget(input)
+        started = time.perf_counter()
+        waited = 0.0
+        for attempt in range(self.max_retries + 1):
+            waited += await self.requests.aacquire(1) + await self.tokens.aacquire(budget)
+            async with self._async_semaphore():
+                try:
+                    response = await self.model.ainvoke(input, config, **kwargs)
+                except Exception as exc:
+                    if attempt == self.max_retries or not is_retryable(exc):
+                        self._record(started, attempt + 1, waited, error=exc)
+                        raise
+                    delay = backoff_delay(attempt, exc)
+                else:
+                    self._settle_tokens(budget, response)
+                    self._record(started, attempt + 1, waited, response)
+                    return response
+            await asyncio.sleep(delay)
+
+    def stream(self, input, config=None, **kwargs):
+        """Streams chunks; retries only happen before the first chunk has been yielded."""
+        budget = self._budget(input)
+        started = time.perf_counter()
+        waited = 0.0
+        for attempt in range(self.max_retries + 1):
+            waited += self.requests.acquire(1) + self.tokens.acquire(budget)
+            emitted = False
+            final = None
+            with self._slots:
+                try:
+                    for chunk in self.model.stream(input, config, **kwargs):
+                        emitted = True
+                        final = chunk if final is None else final + chunk
+                        yield chunk
+                except Exception as exc:
+                    if emitted or attempt == self.max_retries or not is_retryable(exc):
+                        self._record(started, attempt + 1, waited, error=exc)
+                        raise
+                    delay = backoff_delay(attempt, exc)
+                else:
+                    self._settle_tokens(budget, final)
+                    self._record(started, attempt + 1, waited, final)
+                    return
+            time.sleep(delay)
+
+    def stats(self):
+        with self._stats_lock:
+            calls = self.totals["calls"]
+            return {
+                **self.totals,
+                "avg_latency_seconds": self.totals["latency_seconds"] / calls if calls else None,
+                "recent_calls": list(self.recent_calls)[-10:],
+            }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _build_chat_model(model):
+    from langchain_groq import ChatGroq
+
+    limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+    return ChatGroq(
+        model=model,
+        api_key=os.getenv("GROQ_API_KEY"),
+        base_url=GROQ_BASE_URL,
+        max_retries=0,  # retries are handled by PooledChatModel
+        timeout=LLM_TIMEOUT,
+        http_client=httpx.Client(limits=limits, timeout=LLM_TIMEOUT),
+        http_async_client=httpx.AsyncClient(limits=limits, timeout=LLM_TIMEOUT),
+    )
+
+def get_llm(model=None):
+    """Process-wide pooled client for `model` (LLM_MODEL by default), created on first use."""
+    model = model or LLM_MODEL
+    if model not in _clients:
+        with _clients_lock:
+            if model not in _clients:
+                _clients[model] = PooledChatModel(_build_chat_model(model))
+    return _clients[model]
+
+def set_llm(chat_model, model=None, **limits):
+    """Installs `chat_model` (e.g. a fake model in benchmarks) behind the shared limiter for `model`."""
+    client = PooledChatModel(chat_model, **limits)
+    with _clients_lock:
+        _clients[model or LLM_MODEL] = client
+    return client
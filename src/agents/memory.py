@@ -0,0 +1,149 @@
+# agents/memory.py
+#
+# Conversation memory for the RAG graph. The last few turns stay verbatim; older
+# turns are folded into a running summary as they age out (only the new turns are
+# summarized, the existing summary is carried forward), and the history section
+# of the prompt is held to a hard token budget.
+
+import re
+
+from langchain_core.messages import HumanMessage
+
+from agents.llm_client import get_llm, estimate_tokens
+
+SUMMARY_HEADER = "Earlier in this conversation:"
+SECTION_SEPARATOR = "\n\n"
+
+# Longest answer excerpt the extractive summarizer keeps per folded turn
+ANSWER_EXCERPT_TOKENS = 48
+
+# estimate_tokens counts ~4 characters per token, so budgets are enforced in characters
+def _token_chars(tokens):
+    return max(0, tokens) * 4 + 3
+
+def clip_to_tokens(text, max_tokens, keep="head"):
+    """Cuts `text` so that estimate_tokens(text) <= max_tokens, keeping its start (or its end)."""
+    limit = _token_chars(max_tokens)
+    if len(text) <= limit:
+        return text
+    if limit <= 3:
+        return ""
+    if keep == "head":
+        return text[:limit - 3].rstrip() + "..."
+    return "..." + text[-(limit - 3):].lstrip()
+
+def clip_lines_to_tokens(text, max_tokens):
+    """Drops whole leading lines until `text` fits max_tokens, then clips what is left."""
+    lines = text.splitlines()
+    while len(lines) > 1 and len("\n".join(lines)) > _token_chars(max_tokens):
+        lines.pop(0)
+    return clip_to_tokens("\n".join(lines), max_tokens, keep="tail")
+
+def format_turn(turn):
+    return f"Q: {turn['query']}\nA: {turn['response']}"
+
+def _first_sentence(text):
+    text = " ".join(str(text).split())
+    match = re.match(r"(.+?[.!?])(\s|$)", text)
+    return match.group(1) if match else text
+
+def summary_line(turn):
+    """One line per folded turn: the question and the opening of its answer."""
+    answer = clip_to_tokens(_first_sentence(turn["response"]).lstrip("- "), ANSWER_EXCERPT_TOKENS)
+    return f"- {' '.join(turn['query'].split())} -> {answer}"
+
+def _summary_prompt(summary, turns, max_tokens):
+    return (
+        "You maintain a running summary of a conversation with a clinical assistant.\n\n"
+        f"Current summary:\n{summary or '(empty)'}\n\n"
+        "New turns:\n{}\n\n"
+        f"Rewrite the summary so it also covers the new turns, in at most {max_tokens * 3 // 4} words. "
+        "Keep patient names, identifiers, conditions and medications. Return only the summary."
+    ).format("\n\n".join(format_turn(turn) for turn in turns))
+
+
+class ConversationMemory:
+    """
+    Keeps `recent_turns` turns verbatim and folds older ones into a summary of at
+    most `summary_tokens` tokens, either extractively (one line per turn, oldest
+    lines dropped first, no LLM call) or by asking the LLM to extend the summary.
+    render() builds the prompt's history section within `history_tokens`.
+    """
+
+    def __init__(self, recent_turns=3, history_tokens=1024, summary_tokens=384, summarizer="extractive"):
+        if summarizer not in ("extractive", "llm"):
+            raise ValueError(f"Unknown memory summarizer '{summarizer}', expected 'extractive' or 'llm'")
+        self.recent_turns = max(0, recent_turns)
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self.summarizer = summarizer
+
+    def _split(self, history):
+        cut = max(0, len(history) - self.recent_turns)
+        return history[:cut], history[cut:]
+
+    def _fold_extractive(self, summary, turns):
+        lines = [line for line in summary.splitlines() if line.strip()]
+        lines += [summary_line(turn) for turn in turns]
+        return clip_lines_to_tokens("\n".join(lines), self.summary_tokens)
+
+    def _llm_summary(self, response):
+        text = response.content if hasattr(response, "content") else str(response)
+        return clip_to_tokens(text.strip(), self.summary_tokens)
+
+    def update(self, history, summary, turn):
+        """Appends `turn`; returns (verbatim turns, summary) with aged-out turns folded in."""
+        folded, recent = self._split(list(history) + [turn])
+        if not folded:
+            return recent, summary or ""
+        if self.summarizer == "llm":
+            prompt = _summary_prompt(summary, folded, self.summary_tokens)
+            return recent, self._llm_summary(get_llm().invoke([HumanMessage(content=prompt)]))
+        return recent, self._fold_extractive(summary or "", folded)
+
+    async def aupdate(self, history, summary, turn):
+        """Async variant of update."""
+        folded, recent = self._split(list(history) + [turn])
+        if not folded:
+            return recent, summary or ""
+        if self.summarizer == "llm":
+            prompt = _summary_prompt(summary, folded, self.summary_tokens)
+            return recent, self._llm_summary(await get_llm().ainvoke([HumanMessage(content=prompt)]))
+        return recent, self._fold_extractive(summary or "", folded)
+
+    def render(self, history, summary=""):
+        """
+        History section of the prompt, newest turns first in priority: verbatim
+        turns are added from the newest back until the budget runs out (the newest
+        one is clipped rather than dropped), then the summary fills what is left.
+        """
+        remaining = _token_chars(self.history_tokens)
+        blocks = []
+        for turn in reversed(history):
+            text = format_turn(turn)
+            cost = len(text) + (len(SECTION_SEPARATOR) if blocks else 0)
+            if cost > remaining:
+                if not blocks:
+                    blocks.append(clip_to_tokens(text, (remaining - 3) // 4))
+                    remaining -= len(blocks[0])
+                break
+            blocks.append(text)
+            remaining -= cost
+
+        header = SUMMARY_HEADER + "\n"
+        summary_room = remaining - len(header) - (len(SECTION_SEPARATOR) if blocks else 0)
+        if summary and summary_room > 3:
+            # The newest summary lines are the ones kept when it has to be cut
+            body = clip_lines_to_tokens(summary, (summary_room - 3) // 4)
+            if body:
+                blocks.append(header + body)
+
+        return SECTION_SEPARATOR.join(reversed(blocks))
+
+
+def prompt_token_counts(history_section, records, prompt):
+    return {
+        "history": estimate_tokens(history_section) if history_section else 0,
+        "records": estimate_tokens(records) if records else 0,
+        "total": estimate_tokens(prompt),
+    }
@@ -1,21 +1,82 @@
 import os
-from typing import TypedDict, List, Dict, Union
+import time
+import asyncio
+import threading
+import weakref
+from contextlib import nullcontext
+from typing import TypedDict, List, Dict, Union, Iterator, Tuple
 from langgraph.graph import StateGraph, END
 from langchain_core.runnables import RunnableLambda
-from langchain_groq import ChatGroq
 from langchain_core.prompts import PromptTemplate
 from langchain_core.messages import AIMessage
 from dotenv import load_dotenv
-import mlflow
 
-from core.retrieval import retrieve_relevant_docs
-from agents.ranker import llm_rerank_chunks
-from agents.validator import validate_response_with_criteria
+from core.retrieval import retrieve_relevant_docs, lookup_patient, get_retriever
+from agents.ranker import rerank_chunks, arerank_chunks
+from agents.validator import validate_response_with_criteria, avalidate_response_with_criteria
+from agents.answer_cache import SemanticAnswerCache
+from agents.memory import ConversationMemory, prompt_token_counts
+from agents.llm_client import get_llm
+from utils.guardrails import get_guardrail_engine
+from utils.metrics import timer, CACHE_EVENTS, STAGE_SECONDS
+from utils.mlflow_logger import configure_mlflow, MLFLOW_EXPERIMENT_ID
 
 load_dotenv()
 
-mlflow.set_experiment(experiment_id="0")
-mlflow.langchain.autolog()
+# Semantic answer cache (size 0 disables it). Keyed on the query alone, so it only
+# serves turns without conversation memory and only stores answers that passed
+# both the guardrails and the validator
+answer_cache = SemanticAnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    max_size=int(os.getenv("ANSWER_CACHE_SIZE", "256")),
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+)
+# Answers generated from a previous index must not survive a reload of the retriever
+get_retriever().add_reload_listener(answer_cache.clear)
+
+# Conversation memory: recent turns verbatim, older ones folded into a running summary
+# (extractive | llm), with a hard token budget for the history section of the prompt
+conversation_memory = ConversationMemory(
+    recent_turns=int(os.getenv("MEMORY_RECENT_TURNS", "3")),
+    history_tokens=int(os.getenv("MEMORY_HISTORY_TOKENS", "1024")),
+    summary_tokens=int(os.getenv("MEMORY_SUMMARY_TOKENS", "384")),
+    summarizer=os.getenv("MEMORY_SUMMARIZER", "extractive"),
+)
+
+# Validation policy: always | on_safe (skip the remote validator when the guardrails
+# already flag the answer as unsafe) | never
+VALIDATION_POLICY = os.getenv("VALIDATION_POLICY", "on_safe")
+
+# Upper bound on concurrently running sessions per event loop for arun_rag_pipeline
+MAX_CONCURRENT_SESSIONS = int(os.getenv("MAX_CONCURRENT_SESSIONS", "32"))
+
+# LangChain autologging and the per-turn MLflow run around the graph. Both call the
+# tracking server on the request path, so they are opt-in; by default turn telemetry
+# only goes through the background queue in utils/mlflow_logger.py
+MLFLOW_AUTOLOG = os.getenv("MLFLOW_AUTOLOG", "false").lower() == "true"
+
+_tracking_ready = False
+_graph = None
+_init_lock = threading.Lock()
+
+# MLflow is imported and configured on the first turn, not at import time
+def init_tracking():
+    global _tracking_ready
+    if MLFLOW_AUTOLOG and not _tracking_ready:
+        with _init_lock:
+            if not _tracking_ready:
+                with timer("mlflow_init"):
+                    mlflow = configure_mlflow()
+                    mlflow.set_experiment(experiment_id=MLFLOW_EXPERIMENT_ID)
+                    mlflow.langchain.autolog()
+                _tracking_ready = True
+
+def _start_run():
+    if not MLFLOW_AUTOLOG:
+        return nullcontext()
+    import mlflow
+    init_tracking()
+    return mlflow.start_run()
 
 # Define state type for LangGraph
 class RAGState(TypedDict):
@@ -26,7 +87,11 @@ class RAGState(TypedDict):
     response: Union[str, AIMessage]
     guardrails: Dict[str, Union[str, bool]]
     validation: Dict[str, Union[str, bool]]
-    history: List[Dict[str, str]]  # For multi-turn memory
+    history: List[Dict[str, str]]  # Recent turns, kept verbatim
+    memory_summary: str  # Running summary of older turns
+    prompt_tokens: Dict[str, int]  # history / records / total for this turn's prompt
+    answer_cache: Dict[str, Union[bool, float]]
+    retrieval_path: str  # patient_lookup | lexical | hybrid | vector
 
 
 # Prompt generation with memory
@@ -46,99 +111,285 @@ def build_prompt_node():
     prompt = PromptTemplate.from_template(template)
 
     def combine(inputs: RAGState):
-        history = inputs.get("history", [])
-        history_str = "\n\n".join([
-            f"Q: {turn['query']}\nA: {turn['response']}" for turn in history
-        ])
+        history_str = conversation_memory.render(inputs.get("history", []), inputs.get("memory_summary", ""))
         summaries = "\n\n".join([chunk['summary'] for chunk in inputs['ranked_chunks']])
         full_context = f"{history_str}\n\nRecent Records:\n{summaries}" if history_str else summaries
         inputs["prompt"] = prompt.format(context=full_context, query=inputs['query'])
+        inputs["prompt_tokens"] = prompt_token_counts(history_str, summaries, inputs["prompt"])
         return inputs
 
     return RunnableLambda(combine)
 
 
-# Enhanced guardrail logic
+# Enhanced guardrail logic: hedging or speculative phrases, and admitted inconsistencies,
+# matched as whole words by the shared guardrail engine (see utils/guardrail_rules.json)
 
 def revised_guardrail_check(text: str) -> Dict[str, Union[str, bool]]:
-    speculative_terms = ["might", "could", "possibly", "likely", "may"]
-    speculation_flag = any(term in text.lower() for term in speculative_terms)
-    hallucination_flag = any(term in text.lower() for term in ["clearly not true", "doesn't match", "not in patient record"])
+    matches = get_guardrail_engine().scan(text)
+    speculation_flag = any({"hedging", "speculation"} & set(m["categories"]) for m in matches)
+    hallucination_flag = any("hallucination" in m["categories"] for m in matches)
 
     return {
         "speculation_flag": speculation_flag,
         "speculation_msg": "Speculative language found." if speculation_flag else "Clear of speculation.",
         "hallucination_flag": hallucination_flag,
         "hallucination_msg": "Possible inconsistency detected." if hallucination_flag else "Consistent with context.",
-        "safe_to_use": not speculation_flag and not hallucination_flag
+        "safe_to_use": not speculation_flag and not hallucination_flag,
+        "matches": [{"term": m["term"], "start": m["start"], "end": m["end"]} for m in matches],
     }
 
 
-# LangChain wrapper for Groq LLM
-llm = ChatGroq(
-    model="llama-3.3-70b-versatile",
-    api_key=os.getenv("GROQ_API_KEY")
-)
+def _response_text(response):
+    return response.content if hasattr(response, "content") else response
+
+def _turn(query, response):
+    return {"query": query, "response": _response_text(response)}
+
+
+# Validation gating: the guardrail check is a few regex scans, so it runs once right
+# after the llm node and its result decides whether the remote validator is worth a
+# round trip
+
+def should_validate(state: RAGState, policy: str = None) -> bool:
+    policy = policy or VALIDATION_POLICY
+    if policy == "never":
+        return False
+    if policy == "always":
+        return True
+    guardrails = state.get("guardrails") or revised_guardrail_check(_response_text(state["response"]))
+    return guardrails["safe_to_use"]
+
+def route_after_guardrails(state: RAGState) -> str:
+    return "validator_check" if should_validate(state) else "history_updater"
+
+def skipped_validation() -> Dict[str, Union[str, bool]]:
+    reason = "disabled by policy" if VALIDATION_POLICY == "never" else "guardrails flagged the answer as unsafe"
+    return {"approved": False, "skipped": True, "message": f"Validation skipped: {reason}."}
+
+
+# Retrieval: queries naming a known patient id or name are served by a direct key lookup
+
+def retrieve_for_query(query: str) -> List[Dict[str, Union[str, float]]]:
+    return lookup_patient(query) or retrieve_relevant_docs(query)
+
+def retrieval_path(chunks) -> str:
+    return chunks[0].get("source", "vector") if chunks else "none"
 
 
 # Graph Definition
 
+# Every node is timed into the stage_seconds histogram under its node name
+def _timed_node(name, func, afunc=None):
+    def run(state):
+        with timer(name):
+            return func(state)
+
+    async def arun(state):
+        with timer(name):
+            return await afunc(state)
+
+    return RunnableLambda(run, afunc=arun if afunc else None)
+
 def build_rag_graph():
     graph = StateGraph(RAGState)
 
-    graph.add_node("retriever", RunnableLambda(lambda state: {
-        **state,
-        "chunks": retrieve_relevant_docs(state["query"])
-    }))
+    # Chunks may already be present when run_rag_pipeline retrieved them for the answer cache
+    def retrieve(state: RAGState):
+        chunks = state.get("chunks") or retrieve_for_query(state["query"])
+        return {**state, "chunks": chunks, "retrieval_path": retrieval_path(chunks)}
 
-    graph.add_node("ranker", RunnableLambda(lambda state: {
-        **state,
-        "ranked_chunks": llm_rerank_chunks(state["query"], state["chunks"])
-    }))
+    async def aretrieve(state: RAGState):
+        chunks = state.get("chunks") or await asyncio.to_thread(retrieve_for_query, state["query"])
+        return {**state, "chunks": chunks, "retrieval_path": retrieval_path(chunks)}
 
-    graph.add_node("prompt_builder", build_prompt_node())
+    async def arank(state: RAGState):
+        return {**state, "ranked_chunks": await arerank_chunks(state["query"], state["chunks"])}
 
-    graph.add_node("llm", RunnableLambda(lambda state: {
-        **state,
-        "response": llm.invoke(state["prompt"])
-    }))
+    async def agenerate(state: RAGState):
+        return {**state, "response": await get_llm().ainvoke(state["prompt"])}
 
-    graph.add_node("guardrails_check", RunnableLambda(lambda state: {
-        **state,
-        "guardrails": revised_guardrail_check(
-            state["response"].content if hasattr(state["response"], "content") else state["response"]
+    async def avalidate(state: RAGState):
+        return {"validation": await avalidate_response_with_criteria(state["response"], state["query"])}
+
+    def update_history(state: RAGState):
+        history, summary = conversation_memory.update(
+            state.get("history", []), state.get("memory_summary", ""), _turn(state["query"], state["response"])
         )
-    }))
+        return {**state, "validation": state.get("validation") or skipped_validation(),
+                "history": history, "memory_summary": summary}
+
+    async def aupdate_history(state: RAGState):
+        history, summary = await conversation_memory.aupdate(
+            state.get("history", []), state.get("memory_summary", ""), _turn(state["query"], state["response"])
+        )
+        return {**state, "validation": state.get("validation") or skipped_validation(),
+                "history": history, "memory_summary": summary}
+
+    # Nodes with remote calls carry an async twin used by rag_graph.ainvoke
+    graph.add_node("retriever", _timed_node("retriever", retrieve, aretrieve))
 
-    graph.add_node("validator_check", RunnableLambda(lambda state: {
+    graph.add_node("ranker", _timed_node("ranker", lambda state: {
         **state,
-        "validation": validate_response_with_criteria(state["response"], state["query"])
-    }))
+        "ranked_chunks": rerank_chunks(state["query"], state["chunks"])
+    }, arank))
+
+    graph.add_node("prompt_builder", _timed_node("prompt_builder", build_prompt_node().invoke))
 
-    graph.add_node("history_updater", RunnableLambda(lambda state: {
+    graph.add_node("llm", _timed_node("llm", lambda state: {
         **state,
-        "history": state.get("history", []) + [{
-            "query": state["query"],
-            "response": state["response"].content if hasattr(state["response"], "content") else state["response"]
-        }]
+        "response": get_llm().invoke(state["prompt"])
+    }, agenerate))
+
+    # The guardrail result is computed here once and reused by route_after_guardrails
+    graph.add_node("guardrails_check", _timed_node("guardrails_check", lambda state: {
+        "guardrails": revised_guardrail_check(_response_text(state["response"]))
     }))
 
+    graph.add_node("validator_check", _timed_node("validator_check", lambda state: {
+        "validation": validate_response_with_criteria(state["response"], state["query"])
+    }, avalidate))
+
+    graph.add_node("history_updater", _timed_node("history_updater", update_history, aupdate_history))
+
     # Flow
     graph.set_entry_point("retriever")
     graph.add_edge("retriever", "ranker")
     graph.add_edge("ranker", "prompt_builder")
     graph.add_edge("prompt_builder", "llm")
     graph.add_edge("llm", "guardrails_check")
-    graph.add_edge("guardrails_check", "validator_check")
+    graph.add_conditional_edges("guardrails_check", route_after_guardrails, ["validator_check", "history_updater"])
     graph.add_edge("validator_check", "history_updater")
     graph.add_edge("history_updater", END)
 
     return graph.compile()
 
 
-rag_graph = build_rag_graph()
+# Compiled graph, built on first use
+def get_rag_graph():
+    global _graph
+    if _graph is None:
+        with _init_lock:
+            if _graph is None:
+                _graph = build_rag_graph()
+    return _graph
+
+# Keeps `from agents.rag_graph import rag_graph` working without compiling at import
+def __getattr__(name):
+    if name == "rag_graph":
+        return get_rag_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Shared turn set-up: retrieval plus the answer-cache check. Returns
+# (memory, chunks, query_vector, cached_state) where memory holds the history and
+# memory_summary carried over from prev_state; cached_state is None on a miss.
+def _prepare_turn(user_query: str, prev_state: RAGState = None):
+    memory = {
+        "history": prev_state.get("history", []) if prev_state else [],
+        "memory_summary": prev_state.get("memory_summary", "") if prev_state else "",
+    }
+
+    # Retrieval is cheap and needed to validate a cache hit against the current index
+    chunks = retrieve_for_query(user_query)
+    # A follow-up's answer depends on the conversation, which the cache key does not cover
+    if memory["history"] or memory["memory_summary"]:
+        CACHE_EVENTS.inc(cache="answer", result="bypass")
+        return memory, chunks, None, None
+
+    query_vector = get_retriever().encode([user_query])[0]
+    cached = answer_cache.lookup(query_vector, chunks)
+    CACHE_EVENTS.inc(cache="answer", result="hit" if cached else "miss")
+    if not cached:
+        return memory, chunks, query_vector, None
+
+    payload, similarity = cached
+    history, summary = conversation_memory.update(
+        memory["history"], memory["memory_summary"], _turn(user_query, payload["response"])
+    )
+    return memory, chunks, query_vector, {
+        **payload,
+        "query": user_query,
+        "chunks": chunks,
+        "history": history,
+        "memory_summary": summary,
+        "answer_cache": {"hit": True, "similarity": similarity},
+        "retrieval_path": retrieval_path(chunks),
+    }
+
+def is_cacheable(state: RAGState) -> bool:
+    return bool((state.get("guardrails") or {}).get("safe_to_use")) and bool((state.get("validation") or {}).get("approved"))
+
+def _finish_turn(query_vector, chunks, state: RAGState) -> RAGState:
+    if query_vector is not None and is_cacheable(state):
+        answer_cache.store(query_vector, chunks, state)
+    return {**state, "answer_cache": {"hit": False}}
 
 def run_rag_pipeline(user_query: str, prev_state: RAGState = None) -> RAGState:
-    with mlflow.start_run():
-        initial_state = {"query": user_query, "history": prev_state.get("history", []) if prev_state else []}
-        return rag_graph.invoke(initial_state)
\ No newline at end of file
+    with timer("turn"):
+        memory, chunks, query_vector, cached = _prepare_turn(user_query, prev_state)
+        if cached:
+            return cached
+
+        with _start_run():
+            initial_state = {"query": user_query, **memory, "chunks": chunks}
+            state = get_rag_graph().invoke(initial_state)
+
+        return _finish_turn(query_vector, chunks, state)
+
+def stream_rag_pipeline(user_query: str, prev_state: RAGState = None) -> Iterator[Tuple[str, Union[str, RAGState]]]:
+    """
+    Streaming variant of run_rag_pipeline. Yields ("token", text) pieces of the
+    answer as the llm node generates them, then a single ("state", RAGState)
+    with the final state; guardrails, validation and history run on the full text.
+    """
+    # Timed up to the final state; time the caller spends on each token is included
+    start = time.perf_counter()
+    memory, chunks, query_vector, cached = _prepare_turn(user_query, prev_state)
+    if cached:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="turn_stream")
+        yield "token", _response_text(cached["response"])
+        yield "state", cached
+        return
+
+    state = None
+    with _start_run():
+        initial_state = {"query": user_query, **memory, "chunks": chunks}
+        for mode, payload in get_rag_graph().stream(initial_state, stream_mode=["messages", "values"]):
+            if mode == "values":
+                state = payload
+                continue
+            message, metadata = payload
+            # The ranker and validator also call the LLM; only the answer is streamed
+            if metadata.get("langgraph_node") == "llm" and message.content:
+                yield "token", message.content
+
+    state = _finish_turn(query_vector, chunks, state)
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="turn_stream")
+    yield "state", state
+
+
+_session_semaphores = weakref.WeakKeyDictionary()
+
+def _session_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    if loop not in _session_semaphores:
+        _session_semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENT_SESSIONS)
+    return _session_semaphores[loop]
+
+async def arun_rag_pipeline(user_query: str, prev_state: RAGState = None) -> RAGState:
+    """
+    Async counterpart of run_rag_pipeline: LLM calls are awaited and CPU-bound
+    retrieval runs in worker threads, so one event loop can multiplex many
+    sessions (at most MAX_CONCURRENT_SESSIONS at a time). No explicit MLflow run
+    is opened here because the active-run stack is not safe to share between
+    interleaved coroutines; autologged traces are still recorded.
+    """
+    async with _session_semaphore():
+        with timer("turn"):
+            await asyncio.to_thread(init_tracking)
+            memory, chunks, query_vector, cached = await asyncio.to_thread(_prepare_turn, user_query, prev_state)
+            if cached:
+                return cached
+
+            initial_state = {"query": user_query, **memory, "chunks": chunks}
+            state = await get_rag_graph().ainvoke(initial_state)
+            return _finish_turn(query_vector, chunks, state)
@@ -1,27 +1,35 @@
 # utils/ranker.py
 
 from langchain_core.messages import HumanMessage
-from langchain_groq import ChatGroq
 import os
+import asyncio
+import numpy as np
 from dotenv import load_dotenv
 
+from agents.llm_client import get_llm
+from core.retrieval import get_retriever
+from core.lexical import tokenize
+from utils.metrics import registry, timer
+
 load_dotenv()
 
-llm = ChatGroq(model="llama-3.3-70b-versatile", api_key=os.getenv("GROQ_API_KEY"))
 
-def llm_rerank_chunks(query, chunks, top_k=5):
-    """
-    Uses LLM to rank context chunks based on relevance to the query.
-    Returns the top-k most relevant chunks.
-    """
-    prompt = "Given the clinical query:\n\"{}\"\n\nRank the following summaries by their relevance:\n\n{}\n\nReturn the top relevant summaries.".format(
+# Reranker selection: llm | local | none
+RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "llm")
+# Skip reranking when the best candidate beats the runner-up by this L2 distance (0 disables)
+RERANK_SKIP_MARGIN = float(os.getenv("RERANK_SKIP_MARGIN", "0"))
+# Weight of lexical overlap vs. embedding similarity in the local scorer
+RERANK_LEXICAL_WEIGHT = float(os.getenv("RERANK_LEXICAL_WEIGHT", "0.3"))
+
+RERANK_SKIPPED = registry.counter("rerank_skipped_total", "Reranks skipped, by reason", ["reason"])
+
+def _ranking_prompt(query, chunks):
+    return "Given the clinical query:\n\"{}\"\n\nRank the following summaries by their relevance:\n\n{}\n\nReturn the top relevant summaries.".format(
         query,
         "\n\n".join([f"[{i+1}] {chunk['summary']}" for i, chunk in enumerate(chunks)])
     )
 
-    message = HumanMessage(content=prompt)
-    response = llm.invoke([message])
-
+def _parse_ranking(response, chunks, top_k):
     if isinstance(response, str):
         response_text = response
     else:
@@ -37,5 +45,116 @@ def llm_rerank_chunks(query, chunks, top_k=5):
             except:
                 continue
 
+    if not top_indices:
+        print("[WARN] Could not parse a ranking from the LLM response, keeping retrieval order.")
     top_chunks = [chunks[i] for i in top_indices[:top_k]] if top_indices else chunks[:top_k]
     return top_chunks
+
+def llm_rerank_chunks(query, chunks, top_k=5):
+    """
+    Uses LLM to rank context chunks based on relevance to the query.
+    Returns the top-k most relevant chunks.
+    """
+    message = HumanMessage(content=_ranking_prompt(query, chunks))
+    response = get_llm().invoke([message])
+    return _parse_ranking(response, chunks, top_k)
+
+async def allm_rerank_chunks(query, chunks, top_k=5):
+    """Async variant of llm_rerank_chunks."""
+    message = HumanMessage(content=_ranking_prompt(query, chunks))
+    response = await get_llm().ainvoke([message])
+    return _parse_ranking(response, chunks, top_k)
+
+def local_rerank_chunks(query, chunks, top_k=5):
+    """
+    Scores chunks without an LLM call: cosine similarity between the (cached) query
+    vector and the stored document vectors, blended with query-term overlap.
+    """
+    retriever = get_retriever()
+    query_vector = retriever.encode([query])[0]
+    if all("row" in chunk for chunk in chunks):
+        doc_vectors = retriever.reconstruct([chunk["row"] for chunk in chunks])
+    else:
+        doc_vectors = retriever.model.encode([chunk["summary"] for chunk in chunks])
+
+    query_vector = query_vector / (np.linalg.norm(query_vector) or 1.0)
+    doc_vectors = doc_vectors / np.maximum(np.linalg.norm(doc_vectors, axis=1, keepdims=True), 1e-12)
+    semantic = doc_vectors @ query_vector
+
+    query_terms = set(tokenize(query))
+    lexical = np.asarray([
+        len(query_terms & set(tokenize(chunk["summary"]))) / len(query_terms) if query_terms else 0.0
+        for chunk in chunks
+    ])
+
+    scores = (1 - RERANK_LEXICAL_WEIGHT) * semantic + RERANK_LEXICAL_WEIGHT * lexical
+    order = np.argsort(-scores, kind="stable")
+    return [chunks[i] for i in order[:top_k]]
+
+def passthrough_rerank_chunks(query, chunks, top_k=5):
+    """Keeps the retrieval order."""
+    return chunks[:top_k]
+
+RERANKERS = {
+    "llm": llm_rerank_chunks,
+    "local": local_rerank_chunks,
+    "none": passthrough_rerank_chunks,
+}
+
+def _distance(chunk):
+    if chunk.get("distance") is not None:
+        return chunk["distance"]
+    return chunk["score"] if chunk.get("source", "vector") == "vector" else None
+
+def distance_margin_is_decisive(chunks, margin=RERANK_SKIP_MARGIN):
+    """
+    True when the top chunk is ahead of every other chunk by at least `margin` (L2
+    distance). Vector and hybrid (fused) results both carry the distance of each vector
+    hit; a fused chunk found only by BM25 lies beyond every fetched vector, so it cannot
+    be closer than the other vector hits and is left out of the comparison.
+    """
+    if not margin or len(chunks) < 2:
+        return False
+    top = _distance(chunks[0])
+    others = [d for d in map(_distance, chunks[1:]) if d is not None]
+    if top is None or not others:
+        return False
+    return min(others) - top >= margin
+
+def _select_backend(backend):
+    backend = backend or RERANKER_BACKEND
+    if backend not in RERANKERS:
+        raise ValueError(f"Unknown reranker backend '{backend}', expected one of {list(RERANKERS)}")
+    return backend
+
+def _skip_reason(chunks):
+    if len(chunks) <= 1:
+        return "too_few_chunks"
+    if distance_margin_is_decisive(chunks):
+        return "decisive_margin"
+    return None
+
+def rerank_chunks(query, chunks, top_k=5, backend=None):
+    """
+    Reranks with the configured backend (RERANKER_BACKEND unless overridden).
+    Nothing to rank, or a decisive FAISS distance margin, keeps the retrieval order.
+    """
+    backend = _select_backend(backend)
+    reason = _skip_reason(chunks)
+    if reason:
+        RERANK_SKIPPED.inc(reason=reason)
+        return chunks[:top_k]
+    with timer(f"rerank_{backend}"):
+        return RERANKERS[backend](query, chunks, top_k)
+
+async def arerank_chunks(query, chunks, top_k=5, backend=None):
+    """Async variant of rerank_chunks; local scoring runs in a worker thread."""
+    backend = _select_backend(backend)
+    reason = _skip_reason(chunks)
+    if reason:
+        RERANK_SKIPPED.inc(reason=reason)
+        return chunks[:top_k]
+    with timer(f"rerank_{backend}"):
+        if backend == "llm":
+            return await allm_rerank_chunks(query, chunks, top_k)
+        return await asyncio.to_thread(RERANKERS[backend], query, chunks, top_k)
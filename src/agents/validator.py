@@ -1,22 +1,16 @@
 # utils/validator.py
 
 from langchain_core.messages import HumanMessage
-from langchain_groq import ChatGroq
-import os
 from dotenv import load_dotenv
 
-load_dotenv()
-
-llm = ChatGroq(model="llama-3.3-70b-versatile", api_key=os.getenv("GROQ_API_KEY"))
+from agents.llm_client import get_llm
 
-def validate_response_with_criteria(response, query):
-    """
-    Uses the LLM to validate if the response is medically consistent with known information.
-    """
+load_dotenv()
 
+def _validation_prompt(response, query):
     response_text = response.content if hasattr(response, "content") else response
 
-    prompt = f"""
+    return f"""
 You are a medical reviewer with access to general medical knowledge.
 
 Given the user query:
@@ -33,9 +27,7 @@ Assess if the response is:
 Return a short summary and mark it as Approved or Rejected.
 """
 
-    message = HumanMessage(content=prompt)
-    result = llm.invoke([message])
-
+def _parse_validation(result):
     final_text = result.content if hasattr(result, "content") else str(result)
 
     approved = "approved" in final_text.lower()
@@ -43,3 +35,17 @@ Return a short summary and mark it as Approved or Rejected.
         "approved": approved,
         "message": final_text.strip()
     }
+
+def validate_response_with_criteria(response, query):
+    """
+    Uses the LLM to validate if the response is medically consistent with known information.
+    """
+    message = HumanMessage(content=_validation_prompt(response, query))
+    result = get_llm().invoke([message])
+    return _parse_validation(result)
+
+async def avalidate_response_with_criteria(response, query):
+    """Async variant of validate_response_with_criteria."""
+    message = HumanMessage(content=_validation_prompt(response, query))
+    result = await get_llm().ainvoke([message])
+    return _parse_validation(result)
@@ -1,11 +1,12 @@
 # app.py – Streamlit UI for MedChatGuard with multi-turn conversation
 
 import streamlit as st
-from agents.rag_graph import run_rag_pipeline, RAGState
+from agents.rag_graph import stream_rag_pipeline, RAGState
 import asyncio
 import sys
 import os
-from utils.mlflow_logger import log_rag_state_to_mlflow
+from utils.mlflow_logger import log_rag_state_to_mlflow, get_telemetry
+from utils.metrics import serve_metrics
 
 os.environ["STREAMLIT_WATCH_USE_POLLING"] = "true"
 os.environ["STREAMLIT_DISABLE_WATCHDOG_WARNINGS"] = "true"
@@ -13,6 +14,9 @@ os.environ["STREAMLIT_DISABLE_WATCHDOG_WARNINGS"] = "true"
 if sys.platform.startswith("win"):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
+# Prometheus/JSON metrics endpoint (METRICS_PORT=0 disables it); started once per process
+serve_metrics()
+
 st.set_page_config(page_title="MedChatGuard", layout="wide")
 st.title("🩺 MedChatGuard - LangGraph RAG Assistant (Multi-turn)")
 
@@ -26,19 +30,30 @@ if "history_display" not in st.session_state:
 # User query input
 user_query = st.text_input("Enter your question:", key="query")
 if st.button("Send") and user_query:
+    # Stream the answer as it is generated; the final state arrives after the last token
+    st.subheader("🧠 Assistant Response")
+    final = {}
+
+    def answer_tokens():
+        for kind, payload in stream_rag_pipeline(user_query, st.session_state.conversation_state):
+            if kind == "token":
+                yield payload
+            else:
+                final["state"] = payload
+
     with st.spinner("Processing..."):
-        result = run_rag_pipeline(user_query, st.session_state.conversation_state)
-        st.session_state.conversation_state = result
+        st.write_stream(answer_tokens())
 
-        # Display response
-        st.subheader("🧠 Assistant Response")
+        result = final["state"]
+        st.session_state.conversation_state = result
         response_text = result["response"].content if hasattr(result["response"], "content") else result["response"]
-        st.markdown(f'''
-{response_text}
-''')
 
         # Display retrieved records
         st.subheader("📋 Retrieved Records")
+        st.caption(f"Retrieval path: {result.get('retrieval_path', 'vector')}")
+        if result.get("prompt_tokens"):
+            tokens = result["prompt_tokens"]
+            st.caption(f"Prompt tokens: {tokens['total']} (history {tokens['history']}, records {tokens['records']})")
         for i, chunk in enumerate(result.get("ranked_chunks", [])):
             with st.expander(f"Record #{i+1} - Score: {chunk.get('score', 0):.4f}"):
                 st.markdown(chunk.get("summary", ""))
@@ -62,7 +77,11 @@ if st.button("Send") and user_query:
                 st.markdown(f"**A:** {a}")
 
         # Log full state to MLflow
+        # Queued for a background thread; never blocks the UI
         log_rag_state_to_mlflow(result)
+        telemetry = get_telemetry().stats()
+        if telemetry["dropped_turns"] or telemetry["dropped_payloads"]:
+            st.caption(f"Telemetry dropped {telemetry['dropped_turns']} turns and {telemetry['dropped_payloads']} state payloads.")
 
 elif user_query:
     st.info("Click 'Send' to run the query.")
\ No newline at end of file
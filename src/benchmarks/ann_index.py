@@ -0,0 +1,96 @@
+# benchmarks/ann_index.py
+#
+# Builds every supported FAISS index type over the same vectors and reports
+# recall@k against the exact flat index, p50/p99 single-query latency,
+# build time and serialized index size.
+# Run from the repository root:
+#   PYTHONPATH=src python -m benchmarks.ann_index --k 5 --num-queries 200
+#   PYTHONPATH=src python -m benchmarks.ann_index --synthetic-size 200000
+
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from core.retrieval import get_retriever, apply_search_params
+from utils.embedding import INDEX_TYPES, build_faiss_index
+from benchmarks.retrieval_throughput import build_queries
+
+# Vectors of the current index (reconstructed, or re-encoded if the index cannot reconstruct)
+def load_corpus_vectors(retriever):
+    index = retriever.index
+    try:
+        return index.reconstruct_n(0, index.ntotal)
+    except RuntimeError:
+        print("[INFO] Index cannot reconstruct vectors, re-encoding summaries...")
+        return retriever.model.encode(list(retriever.summaries), show_progress_bar=True)
+
+def synthetic_vectors(num_vectors, dim, seed=42):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((num_vectors, dim)).astype("float32")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def percentile_ms(samples, pct):
+    return float(np.percentile(samples, pct) * 1000.0)
+
+def benchmark_index(index, queries, k, ground_truth):
+    latencies = []
+    hits = 0
+    for row in range(len(queries)):
+        start = time.perf_counter()
+        _, indices = index.search(queries[row:row + 1], k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(indices[0]) & set(ground_truth[row]))
+    return {
+        "recall_at_k": hits / (len(queries) * k),
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99),
+        "index_bytes": int(faiss.serialize_index(index).nbytes),
+    }
+
+def run_benchmark(k=5, num_queries=200, synthetic_size=0, nprobe=16, ef_search=64, index_types=INDEX_TYPES):
+    retriever = get_retriever().load()
+
+    if synthetic_size:
+        corpus = synthetic_vectors(synthetic_size, retriever.index.d)
+        queries = synthetic_vectors(num_queries, retriever.index.d, seed=7)
+    else:
+        corpus = load_corpus_vectors(retriever)
+        query_text = build_queries(retriever.summaries, num_queries)
+        queries = retriever.model.encode(query_text, batch_size=64)
+    corpus = np.ascontiguousarray(corpus, dtype="float32")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+
+    exact = build_faiss_index(corpus, "flat")
+    _, ground_truth = exact.search(queries, k)
+
+    report = {}
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = build_faiss_index(corpus, index_type)
+        build_seconds = time.perf_counter() - start
+        apply_search_params(index, nprobe, ef_search)
+
+        report[index_type] = {"build_seconds": build_seconds, **benchmark_index(index, queries, k, ground_truth)}
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall/latency/memory comparison of FAISS index types")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--synthetic-size", type=int, default=0, help="Benchmark on N random vectors instead of the real corpus")
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--index-types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES))
+    args = parser.parse_args()
+
+    report = run_benchmark(args.k, args.num_queries, args.synthetic_size, args.nprobe, args.ef_search, args.index_types)
+
+    print(f"\n{'index':<10}{'recall@' + str(args.k):>10}{'p50 ms':>10}{'p99 ms':>10}{'MiB':>10}{'build s':>10}")
+    for index_type, row in report.items():
+        print(
+            f"{index_type:<10}{row['recall_at_k']:>10.3f}{row['p50_ms']:>10.3f}{row['p99_ms']:>10.3f}"
+            f"{row['index_bytes'] / 2**20:>10.2f}{row['build_seconds']:>10.2f}"
+        )
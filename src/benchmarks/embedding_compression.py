@@ -0,0 +1,110 @@
+# benchmarks/embedding_compression.py
+#
+# Ranking check for the compressed embedding path. Every encoder backend (torch,
+# onnx, onnx_int8) encodes the same corpus sample and queries, and every storage
+# type (float32, float16, int8) holds the corpus vectors. Exact top-k rankings are
+# compared with the reference torch + float32 path (recall@k and top-1 agreement)
+# next to corpus encode throughput and stored bytes.
+# Run from the repository root:
+#   PYTHONPATH=src python -m benchmarks.embedding_compression --corpus-size 2000 --num-queries 200
+#   PYTHONPATH=src python -m benchmarks.embedding_compression --backends torch onnx_int8 --min-recall 0.95
+# Exits non-zero when a configuration's recall@k falls below --min-recall.
+
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from benchmarks.retrieval_throughput import build_queries
+from core.encoder import ENCODER_BACKENDS, load_encoder
+from core.retrieval import get_retriever, MODEL_NAME
+from core.vector_store import STORAGE_TYPES, quantize, dequantize
+
+
+def exact_top_k(corpus, queries, k):
+    # Squared L2, as the flat FAISS index ranks
+    distances = (queries ** 2).sum(1)[:, None] - 2 * queries @ corpus.T + (corpus ** 2).sum(1)[None, :]
+    top = np.argpartition(distances, min(k, corpus.shape[0] - 1), axis=1)[:, :k]
+    order = np.take_along_axis(distances, top, axis=1).argsort(axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+def compare_rankings(results, reference):
+    recall = np.mean([len(set(r) & set(ref)) / len(ref) for r, ref in zip(results, reference)])
+    top1 = np.mean(results[:, 0] == reference[:, 0])
+    return float(recall), float(top1)
+
+def encode(backend, corpus, queries, batch_size):
+    model = load_encoder(MODEL_NAME, backend)
+    model.encode(corpus[:batch_size], batch_size=batch_size)  # warm-up
+    start = time.perf_counter()
+    corpus_vectors = np.asarray(model.encode(corpus, batch_size=batch_size), dtype="float32")
+    seconds = time.perf_counter() - start
+    query_vectors = np.asarray(model.encode(queries, batch_size=batch_size), dtype="float32")
+    return corpus_vectors, query_vectors, len(corpus) / seconds
+
+def run_benchmark(backends=ENCODER_BACKENDS, storages=STORAGE_TYPES, corpus_size=2000, num_queries=200,
+                  k=5, batch_size=64, seed=42):
+    retriever = get_retriever().load()
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(retriever.summaries), min(corpus_size, len(retriever.summaries)), replace=False)
+    corpus = [retriever.summaries[int(row)] for row in rows]
+    queries = build_queries(retriever.summaries, num_queries, seed)
+
+    encoded = {}
+    for backend in backends:
+        print(f"[INFO] Encoding {len(corpus)} summaries with the {backend} backend...")
+        encoded[backend] = encode(backend, corpus, queries, batch_size)
+
+    # The reference is the stock path: torch encoder, float32 vectors
+    reference_backend = "torch" if "torch" in encoded else backends[0]
+    ref_corpus, ref_queries, ref_throughput = encoded[reference_backend]
+    reference = exact_top_k(ref_corpus, ref_queries, k)
+
+    results = []
+    for backend, (corpus_vectors, query_vectors, throughput) in encoded.items():
+        for storage in storages:
+            stored, scale = quantize(corpus_vectors, storage)
+            ranking = exact_top_k(dequantize(stored, scale), query_vectors, k)
+            recall, top1 = compare_rankings(ranking, reference)
+            results.append({
+                "backend": backend,
+                "storage": storage,
+                "encode_docs_per_second": throughput,
+                "encode_speedup": throughput / ref_throughput,
+                "stored_bytes": int(stored.nbytes + (scale.nbytes if scale is not None else 0)),
+                "bytes_ratio": (stored.nbytes + (scale.nbytes if scale is not None else 0)) / ref_corpus.nbytes,
+                f"recall@{k}": recall,
+                "top1_agreement": top1,
+            })
+    return {"reference": f"{reference_backend}/float32", "k": k, "corpus_size": len(corpus),
+            "num_queries": len(queries), "results": results}
+
+def print_report(report):
+    k = report["k"]
+    print(f"\nreference: {report['reference']}, {report['corpus_size']} docs, {report['num_queries']} queries")
+    print(f"{'backend':<11}{'storage':<9}{'docs/s':>9}{'speedup':>9}{'MiB':>8}{'size':>7}{f'recall@{k}':>11}{'top1':>7}")
+    for r in report["results"]:
+        print(f"{r['backend']:<11}{r['storage']:<9}{r['encode_docs_per_second']:>9.0f}{r['encode_speedup']:>8.2f}x"
+              f"{r['stored_bytes'] / 2**20:>8.2f}{r['bytes_ratio']:>7.2f}{r[f'recall@{k}']:>11.3f}{r['top1_agreement']:>7.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ranking agreement, encode throughput and size of compressed embeddings")
+    parser.add_argument("--backends", nargs="+", choices=ENCODER_BACKENDS, default=ENCODER_BACKENDS)
+    parser.add_argument("--storages", nargs="+", choices=STORAGE_TYPES, default=list(STORAGE_TYPES))
+    parser.add_argument("--corpus-size", type=int, default=2000)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--min-recall", type=float, default=0.95, help="Lowest acceptable recall@k vs the reference")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.backends, args.storages, args.corpus_size, args.num_queries,
+                           args.k, args.batch_size, args.seed)
+    print_report(report)
+
+    failures = [r for r in report["results"] if r[f"recall@{args.k}"] < args.min_recall]
+    for r in failures:
+        print(f"[REGRESSION] {r['backend']}/{r['storage']}: recall@{args.k} {r[f'recall@{args.k}']:.3f} < {args.min_recall}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,130 @@
+# benchmarks/micro_batching.py
+#
+# Throughput of a local generation pipeline under concurrent load, one prompt per
+# generate call versus the micro-batcher in core/batching.py. Client threads send
+# RAG prompts built from the indexed records; the report gives prompts per second,
+# per-request latency and the batch-size distribution the batcher produced.
+# Run from the repository root (needs the model under the pipeline's model_path):
+#   PYTHONPATH=src python -m benchmarks.micro_batching --pipeline seq2seq --clients 8 --requests 64
+#   PYTHONPATH=src python -m benchmarks.micro_batching --pipeline llm --max-wait-ms 20 --baseline log/micro_batching_baseline.json
+
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.retrieval_throughput import build_queries
+from core.batching import MicroBatcher, BATCH_MAX_WAIT_MS
+from core.retrieval import get_retriever, retrieve_relevant_docs_batch
+
+PIPELINES = {
+    "seq2seq": "core.pipeline_seq2seq",
+    "llm": "core.pipeline_llm",
+}
+
+
+def build_prompts(module, num_prompts, seed=42):
+    retriever = get_retriever().load()
+    queries = build_queries(retriever.summaries, num_prompts, seed)
+    chunk_lists = retrieve_relevant_docs_batch(queries, k=3)
+    return [module.build_prompt(chunks, query) for chunks, query in zip(chunk_lists, queries)]
+
+def run_load(batcher, prompts, clients):
+    """Sends every prompt through `batcher` from `clients` threads; returns (seconds, latencies)."""
+    def request(prompt):
+        start = time.perf_counter()
+        batcher.generate(prompt)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        latencies = list(pool.map(request, prompts))
+    return time.perf_counter() - start, latencies
+
+def summarize(seconds, latencies, batcher):
+    ms = np.asarray(latencies) * 1000.0
+    stats = batcher.stats()
+    return {
+        "prompts_per_second": len(latencies) / seconds,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "mean_batch_size": stats["mean_batch_size"],
+        "generate_calls": stats["generate_calls"],
+        # JSON object keys are strings
+        "batch_size_distribution": {str(size): count for size, count in stats["batch_size_distribution"].items()},
+    }
+
+def run_benchmark(pipeline="seq2seq", requests=64, clients=8, max_batch_size=8,
+                  max_wait_ms=BATCH_MAX_WAIT_MS, seed=42):
+    module = importlib.import_module(PIPELINES[pipeline])
+    prompts = build_prompts(module, requests, seed)
+
+    # Load the model and run one forward pass outside the timed window
+    module.generate_batch(prompts[:1])
+
+    modes = {
+        "unbatched": MicroBatcher(module.generate_batch, 1, 0, name=f"{pipeline}_unbatched"),
+        "batched": MicroBatcher(module.generate_batch, max_batch_size, max_wait_ms, name=f"{pipeline}_batched"),
+    }
+    report = {
+        "config": {"pipeline": pipeline, "requests": requests, "clients": clients,
+                   "max_batch_size": max_batch_size, "max_wait_ms": max_wait_ms, "seed": seed},
+    }
+    for mode, batcher in modes.items():
+        seconds, latencies = run_load(batcher, prompts, clients)
+        batcher.close()
+        report[mode] = summarize(seconds, latencies, batcher)
+    report["speedup"] = report["batched"]["prompts_per_second"] / report["unbatched"]["prompts_per_second"]
+    return report
+
+# Batched throughput is what the batcher is for; it may not drop more than `tolerance`
+def compare_to_baseline(report, baseline, tolerance=0.2):
+    before = baseline["batched"]["prompts_per_second"]
+    current = report["batched"]["prompts_per_second"]
+    if current < before * (1 - tolerance):
+        return [f"batched prompts_per_second: {current:.2f} vs baseline {before:.2f} ({current / before - 1:.0%})"]
+    return []
+
+def print_report(report):
+    print(f"\n{'mode':<12}{'prompts/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'mean batch':>12}{'calls':>8}")
+    for mode in ("unbatched", "batched"):
+        r = report[mode]
+        print(f"{mode:<12}{r['prompts_per_second']:>12.2f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}"
+              f"{r['mean_batch_size']:>12.2f}{r['generate_calls']:>8}")
+    print(f"\nbatch sizes (size: calls): {report['batched']['batch_size_distribution']}")
+    print(f"speedup: {report['speedup']:.2f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent-load throughput with and without micro-batching")
+    parser.add_argument("--pipeline", choices=list(PIPELINES), default="seq2seq")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent client threads")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=BATCH_MAX_WAIT_MS)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save-baseline", help="Write the report to this JSON file")
+    parser.add_argument("--baseline", help="Compare against a report saved with --save-baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed throughput drop vs the baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.pipeline, args.requests, args.clients, args.max_batch_size,
+                           args.max_wait_ms, args.seed)
+    print_report(report)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n[INFO] Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare_to_baseline(report, json.load(f), args.tolerance)
+        for failure in failures:
+            print(f"[REGRESSION] {failure}")
+        sys.exit(1 if failures else 0)
@@ -0,0 +1,177 @@
+# benchmarks/quantized_inference.py
+#
+# fp32 vs int8 vs ONNX Runtime for a local generation pipeline: generated tokens per
+# second, model load time, peak RSS, and how often each backend's greedy answers
+# agree with fp32 (exact match and token F1 after SQuAD normalization). Each backend
+# runs in its own interpreter so peak memory is not shared between them.
+# Run from the repository root (needs the checkpoint under the pipeline's model_path):
+#   PYTHONPATH=src python -m benchmarks.quantized_inference --pipeline seq2seq --prompts 32
+#   PYTHONPATH=src python -m benchmarks.quantized_inference --pipeline llm --backends fp32 int8 --max-new-tokens 64
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import importlib
+import subprocess
+
+PIPELINES = {
+    "seq2seq": ("core.pipeline_seq2seq", "seq2seq"),
+    "llm": ("core.pipeline_llm", "causal"),
+}
+BACKENDS = ["fp32", "int8", "onnx"]
+
+
+def _env():
+    src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [src, env.get("PYTHONPATH")]))
+    return env
+
+def _max_rss_kib():
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def build_prompts(pipeline, num_prompts, seed=42):
+    from benchmarks.retrieval_throughput import build_queries
+    from core.retrieval import get_retriever, retrieve_relevant_docs_batch
+
+    module = importlib.import_module(PIPELINES[pipeline][0])
+    retriever = get_retriever().load()
+    queries = build_queries(retriever.summaries, num_prompts, seed)
+    chunk_lists = retrieve_relevant_docs_batch(queries, k=3)
+    return [module.build_prompt(chunks, query) for chunks, query in zip(chunk_lists, queries)]
+
+# === WORKER (one backend per interpreter) ===
+
+def run_worker(pipeline, backend, prompts, max_new_tokens=64, batch_size=1):
+    from transformers import AutoTokenizer
+    from core.inference_backend import load_model
+
+    module_name, kind = PIPELINES[pipeline]
+    module = importlib.import_module(module_name)
+    rss_before = _max_rss_kib()
+
+    start = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(module.model_path)
+    model = load_model(module.model_path, kind, backend)
+    load_seconds = time.perf_counter() - start
+    if kind == "causal":
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        tokenizer.padding_side = "left"
+
+    # Greedy decoding so answers are comparable across backends
+    generate_kwargs = {"max_new_tokens": max_new_tokens, "do_sample": False, "use_cache": True,
+                       "pad_token_id": tokenizer.pad_token_id}
+    model.generate(**tokenizer(prompts[:1], return_tensors="pt"), **generate_kwargs)
+
+    answers, new_tokens = [], 0
+    start = time.perf_counter()
+    for i in range(0, len(prompts), batch_size):
+        inputs = tokenizer(prompts[i:i + batch_size], return_tensors="pt", padding=True, truncation=True)
+        output = model.generate(**inputs, **generate_kwargs)
+        # Causal outputs repeat the (left-padded) prompt; seq2seq outputs are only the answer
+        generated = output[:, inputs["input_ids"].shape[1]:] if kind == "causal" else output[:, 1:]
+        new_tokens += int((generated != tokenizer.pad_token_id).sum())
+        answers.extend(tokenizer.batch_decode(generated, skip_special_tokens=True))
+    generation_seconds = time.perf_counter() - start
+
+    return {
+        "backend": backend,
+        "load_seconds": load_seconds,
+        "generation_seconds": generation_seconds,
+        "new_tokens": new_tokens,
+        "tokens_per_second": new_tokens / generation_seconds if generation_seconds else 0.0,
+        "seconds_per_prompt": generation_seconds / len(prompts),
+        "model_rss_kib": (_max_rss_kib() - rss_before) if rss_before is not None else None,
+        "max_rss_kib": _max_rss_kib(),
+        "answers": [answer.strip() for answer in answers],
+    }
+
+def run_backend(pipeline, backend, prompts_file, max_new_tokens, batch_size, timeout=3600):
+    cmd = [sys.executable, "-m", "benchmarks.quantized_inference", "--worker", "--pipeline", pipeline,
+           "--backends", backend, "--prompts-file", prompts_file,
+           "--max-new-tokens", str(max_new_tokens), "--batch-size", str(batch_size)]
+    proc = subprocess.run(cmd, capture_output=True, text=True, env=_env(), timeout=timeout)
+    if proc.returncode != 0:
+        print(f"[WARN] {backend} failed: {proc.stderr.strip().splitlines()[-1:]}")
+        return None
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+# === REPORT ===
+
+def agreement(answers, reference):
+    from evaluate import normalize_answer, token_f1
+
+    pairs = list(zip(answers, reference))
+    return {
+        "exact_match": sum(normalize_answer(a) == normalize_answer(r) for a, r in pairs) / len(pairs),
+        "token_f1": sum(token_f1(a, [r]) for a, r in pairs) / len(pairs),
+    }
+
+def run_benchmark(pipeline="seq2seq", backends=BACKENDS, num_prompts=32, max_new_tokens=64, batch_size=1, seed=42):
+    prompts = build_prompts(pipeline, num_prompts, seed)
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(prompts, f)
+    try:
+        results = {backend: run_backend(pipeline, backend, f.name, max_new_tokens, batch_size) for backend in backends}
+    finally:
+        os.remove(f.name)
+
+    report = {"config": {"pipeline": pipeline, "prompts": num_prompts, "max_new_tokens": max_new_tokens,
+                         "batch_size": batch_size, "seed": seed}, "backends": {}}
+    reference = results.get("fp32")
+    for backend, result in results.items():
+        if result is None:
+            continue
+        answers = result.pop("answers")
+        if reference is not None:
+            result["agreement_with_fp32"] = agreement(answers, reference["answers"]) if backend != "fp32" else None
+            result["speedup_vs_fp32"] = result["tokens_per_second"] / reference["tokens_per_second"] if reference["tokens_per_second"] else None
+        report["backends"][backend] = result
+    return report
+
+def print_report(report):
+    print(f"\n{'backend':<10}{'tokens/s':>10}{'s/prompt':>10}{'load s':>9}{'model MiB':>11}{'speedup':>9}{'EM':>7}{'F1':>7}")
+    for backend, r in report["backends"].items():
+        agree = r.get("agreement_with_fp32") or {}
+        model_mib = f"{r['model_rss_kib'] / 1024:.0f}" if r["model_rss_kib"] is not None else "-"
+        speedup = f"{r['speedup_vs_fp32']:.2f}x" if r.get("speedup_vs_fp32") else "-"
+        em = f"{agree['exact_match']:.2f}" if agree else "-"
+        f1 = f"{agree['token_f1']:.2f}" if agree else "-"
+        print(f"{backend:<10}{r['tokens_per_second']:>10.1f}{r['seconds_per_prompt']:>10.3f}{r['load_seconds']:>9.1f}"
+              f"{model_mib:>11}{speedup:>9}{em:>7}{f1:>7}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tokens/sec, memory and answer agreement of fp32, int8 and ONNX backends")
+    parser.add_argument("--pipeline", choices=list(PIPELINES), default="seq2seq")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+    parser.add_argument("--prompts", type=int, default=32)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=1, help="Prompts per generate call")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--prompts-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        with open(args.prompts_file) as f:
+            prompts = json.load(f)
+        print(json.dumps(run_worker(args.pipeline, args.backends[0], prompts, args.max_new_tokens, args.batch_size)))
+        sys.exit(0)
+
+    report = run_benchmark(args.pipeline, args.backends, args.prompts, args.max_new_tokens, args.batch_size, args.seed)
+    print_report(report)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n[INFO] Report written to {args.output}")
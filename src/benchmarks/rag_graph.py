@@ -0,0 +1,250 @@
+# benchmarks/rag_graph.py
+#
+# Latency and memory of the LangGraph pipeline, end to end and per node, against
+# the real FAISS index in embeddings/ and a deterministic in-process fake chat
+# model (replies from misc/fake_llm_server.py, seeded latency distribution).
+# Each turn is timed through the compiled graph, then every node the graph would
+# run is re-run on its own from the state the previous node produced (validation
+# is routed by route_after_guardrails, as in the graph). A second pass under tracemalloc
+# records the memory high-water mark per turn and, from snapshot diffs, the
+# blocks and bytes a turn leaves allocated.
+# Run from the repository root:
+#   PYTHONPATH=src python -m benchmarks.rag_graph --turns 50 --llm-latency-ms 200 --save-baseline log/rag_graph_baseline.json
+#   PYTHONPATH=src python -m benchmarks.rag_graph --turns 50 --llm-latency-ms 200 --baseline log/rag_graph_baseline.json
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import tracemalloc
+
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+from agents.llm_client import set_llm
+from agents.rag_graph import build_rag_graph, route_after_guardrails
+from benchmarks.retrieval_throughput import build_queries
+from core.retrieval import get_retriever
+from misc.fake_llm_server import fake_reply
+
+NODES = ["retriever", "ranker", "prompt_builder", "llm", "guardrails_check", "validator_check", "history_updater"]
+NODES_BEFORE_ROUTING = ["retriever", "ranker", "prompt_builder", "llm", "guardrails_check"]
+DISTRIBUTIONS = ["fixed", "gaussian", "lognormal"]
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic chat model: fixed replies per prompt kind, seeded latency, token usage."""
+
+    latency_ms: float = 300.0
+    jitter: float = 0.2
+    distribution: str = "gaussian"
+    seed: int = 42
+    _rng: random.Random = PrivateAttr(default=None)
+
+    def model_post_init(self, __context):
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self):
+        return "fake-benchmark"
+
+    def _delay(self):
+        mean = self.latency_ms / 1000.0
+        if mean <= 0 or self.distribution == "fixed":
+            return max(0.0, mean)
+        if self.distribution == "lognormal":
+            # Same mean as the other distributions, with a long right tail
+            sigma = max(self.jitter, 1e-6)
+            return self._rng.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+        return max(0.0, self._rng.gauss(mean, mean * self.jitter))
+
+    def _result(self, messages):
+        prompt = "\n".join(str(message.content) for message in messages)
+        reply = fake_reply(prompt)
+        usage = {"input_tokens": max(1, len(prompt) // 4), "output_tokens": max(1, len(reply) // 4)}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=reply, usage_metadata=usage))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self._delay())
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._delay())
+        return self._result(messages)
+
+
+def install_fake_llm(latency_ms, jitter, distribution, seed):
+    # No rate limits: the benchmark measures the pipeline, not the provider budget
+    model = FakeChatModel(latency_ms=latency_ms, jitter=jitter, distribution=distribution, seed=seed)
+    return set_llm(model, requests_per_minute=0, tokens_per_minute=0, max_concurrency=64, max_retries=0)
+
+def summarize(samples):
+    ms = np.asarray(samples, dtype="float64") * 1000.0
+    return {
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+    }
+
+def _run_node(node_runnables, name, state, timings):
+    start = time.perf_counter()
+    update = node_runnables[name].invoke(state)
+    timings[name].append(time.perf_counter() - start)
+    return {**state, **update}
+
+def run_turn_nodes(node_runnables, state, timings):
+    """
+    Runs each node on its own, in graph order, feeding it the state built so far.
+    validator_check only runs when route_after_guardrails picks it.
+    """
+    for name in NODES_BEFORE_ROUTING:
+        state = _run_node(node_runnables, name, state, timings)
+    if route_after_guardrails(state) == "validator_check":
+        state = _run_node(node_runnables, "validator_check", state, timings)
+    return _run_node(node_runnables, "history_updater", state, timings)
+
+def run_benchmark(turns=50, turns_per_session=5, warmup=3, latency_ms=200.0, jitter=0.2,
+                  distribution="gaussian", seed=42, memory_turns=None):
+    install_fake_llm(latency_ms, jitter, distribution, seed)
+    retriever = get_retriever().load()
+    queries = build_queries(retriever.summaries, warmup + turns, seed)
+    graph = build_rag_graph()
+    node_runnables = {name: graph.builder.nodes[name].runnable for name in NODES}
+
+    # Warm-up turns load models and fill caches outside the measured window
+    for query in queries[:warmup]:
+        graph.invoke({"query": query, "history": [], "memory_summary": ""})
+    retriever.query_cache.clear()
+
+    end_to_end = []
+    node_timings = {name: [] for name in NODES}
+    turn_states = []
+    state = None
+    for i, query in enumerate(queries[warmup:]):
+        if i % turns_per_session == 0:
+            state = None  # start a new conversation
+        initial = {
+            "query": query,
+            "history": state["history"] if state else [],
+            "memory_summary": state.get("memory_summary", "") if state else "",
+        }
+        start = time.perf_counter()
+        state = graph.invoke(initial)
+        end_to_end.append(time.perf_counter() - start)
+        run_turn_nodes(node_runnables, dict(initial), node_timings)
+        turn_states.append(initial)
+
+    # Memory pass (tracemalloc slows Python code, so latencies are not taken here)
+    peaks, blocks, retained = [], [], []
+    retriever.query_cache.clear()
+    tracemalloc.start()
+    for initial in turn_states[:memory_turns or len(turn_states)]:
+        before = _snapshot()
+        tracemalloc.reset_peak()
+        before_bytes = tracemalloc.get_traced_memory()[0]
+        graph.invoke(initial)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before_bytes)
+        grown = [stat for stat in _snapshot().compare_to(before, "traceback") if stat.count_diff > 0]
+        blocks.append(sum(stat.count_diff for stat in grown))
+        retained.append(sum(stat.size_diff for stat in grown if stat.size_diff > 0))
+    tracemalloc.stop()
+
+    return {
+        "config": {
+            "turns": turns, "turns_per_session": turns_per_session, "llm_latency_ms": latency_ms,
+            "llm_jitter": jitter, "llm_distribution": distribution, "seed": seed,
+            "index_vectors": int(retriever.index.ntotal),
+        },
+        "end_to_end": summarize(end_to_end),
+        # Nodes the router skipped on every turn (e.g. validator_check with VALIDATION_POLICY=never) are left out
+        "nodes": {name: {**summarize(samples), "runs": len(samples)} for name, samples in node_timings.items() if samples},
+        "memory": {
+            "peak_bytes_p50": float(np.percentile(peaks, 50)),
+            "peak_bytes_max": float(max(peaks)),
+            "retained_blocks_p50": float(np.percentile(blocks, 50)),
+            "retained_blocks_max": float(max(blocks)),
+            "retained_bytes_p50": float(np.percentile(retained, 50)),
+            "retained_bytes_max": float(max(retained)),
+            "max_rss_kib": _max_rss_kib(),
+        },
+    }
+
+def _snapshot():
+    # The snapshots themselves are allocated by tracemalloc; leave them out of the diff
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+def _max_rss_kib():
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# Latency percentiles and per-turn peak memory are compared; RSS and retained
+# blocks/bytes are informational. Differences under the absolute floors are timer and allocator noise.
+def compare_to_baseline(report, baseline, tolerance=0.2, min_delta_ms=1.0, min_delta_bytes=64 * 1024):
+    failures = []
+
+    def check(label, current, before, floor):
+        if before and current > before * (1 + tolerance) and current - before > floor:
+            failures.append(f"{label}: {current:.2f} vs baseline {before:.2f} (+{current / before - 1:.0%})")
+
+    for key in ("p50_ms", "p95_ms", "p99_ms"):
+        check(f"end_to_end {key}", report["end_to_end"][key], baseline["end_to_end"].get(key), min_delta_ms)
+        for name, stats in report["nodes"].items():
+            check(f"{name} {key}", stats[key], baseline["nodes"].get(name, {}).get(key), min_delta_ms)
+    check("memory peak_bytes_p50", report["memory"]["peak_bytes_p50"], baseline["memory"].get("peak_bytes_p50"), min_delta_bytes)
+    return failures
+
+def print_report(report):
+    print(f"\n{'stage':<18}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}{'runs':>7}")
+    for name, stats in [("end_to_end", report["end_to_end"]), *report["nodes"].items()]:
+        runs = stats.get("runs", report["config"]["turns"])
+        print(f"{name:<18}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['mean_ms']:>10.2f}{runs:>7}")
+    memory = report["memory"]
+    print(f"\npeak traced memory per turn: p50 {memory['peak_bytes_p50'] / 2**20:.2f} MiB, max {memory['peak_bytes_max'] / 2**20:.2f} MiB")
+    print(f"blocks left allocated per turn: p50 {memory['retained_blocks_p50']:.0f}, max {memory['retained_blocks_max']:.0f} "
+          f"({memory['retained_bytes_p50'] / 2**10:.1f} KiB p50, {memory['retained_bytes_max'] / 2**10:.1f} KiB max)")
+    if memory["max_rss_kib"]:
+        print(f"process max RSS: {memory['max_rss_kib'] / 1024:.1f} MiB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-node latency and memory benchmark of the RAG graph")
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--turns-per-session", type=int, default=5, help="Turns sharing one conversation history")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--memory-turns", type=int, help="Turns re-run under tracemalloc (default: all)")
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    parser.add_argument("--llm-jitter", type=float, default=0.2, help="Spread as a fraction of the mean (lognormal: sigma)")
+    parser.add_argument("--llm-distribution", choices=DISTRIBUTIONS, default="gaussian")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save-baseline", help="Write the report to this JSON file")
+    parser.add_argument("--baseline", help="Compare against a report saved with --save-baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown vs the baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.turns, args.turns_per_session, args.warmup, args.llm_latency_ms,
+                           args.llm_jitter, args.llm_distribution, args.seed, args.memory_turns)
+    print_report(report)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n[INFO] Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare_to_baseline(report, json.load(f), args.tolerance)
+        for failure in failures:
+            print(f"[REGRESSION] {failure}")
+        sys.exit(1 if failures else 0)
@@ -0,0 +1,70 @@
+# benchmarks/retrieval_throughput.py
+#
+# Compares the per-query retrieval path with the batched one.
+# Run from the repository root:
+#   PYTHONPATH=src python -m benchmarks.retrieval_throughput --num-queries 500 --batch-size 64
+
+import argparse
+import random
+import time
+
+from core.retrieval import get_retriever
+
+QUERY_TEMPLATES = [
+    "What medications is {name} on?",
+    "List the conditions for {name}",
+    "When did {name} last visit the clinic?",
+    "Does {name} have hypertension?",
+]
+
+# Build a deterministic query set from the indexed patient names
+def build_queries(summaries, num_queries, seed=42):
+    rng = random.Random(seed)
+    names = [s.split(",", 1)[0].replace("Patient: ", "") for s in summaries]
+    return [rng.choice(QUERY_TEMPLATES).format(name=rng.choice(names)) for _ in range(num_queries)]
+
+def run_benchmark(num_queries=200, k=5, batch_size=64):
+    retriever = get_retriever().load()
+    queries = build_queries(retriever.summaries, num_queries)
+
+    # Warm up both paths so neither pays first-call overhead
+    retriever.search(queries[0], k)
+    retriever.search_batch(queries[:2], k, batch_size=batch_size)
+
+    # Start both timed passes from an empty query-embedding cache
+    retriever.query_cache.clear()
+    start = time.perf_counter()
+    single = [retriever.search(q, k) for q in queries]
+    single_seconds = time.perf_counter() - start
+
+    retriever.query_cache.clear()
+    start = time.perf_counter()
+    batched = retriever.search_batch(queries, k, batch_size=batch_size)
+    batch_seconds = time.perf_counter() - start
+
+    agreement = sum(
+        [r["patient_id"] for r in a] == [r["patient_id"] for r in b]
+        for a, b in zip(single, batched)
+    ) / len(queries)
+
+    return {
+        "num_queries": num_queries,
+        "k": k,
+        "batch_size": batch_size,
+        "per_query_qps": num_queries / single_seconds,
+        "batched_qps": num_queries / batch_seconds,
+        "speedup": single_seconds / batch_seconds,
+        "result_agreement": agreement,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-query vs. batched retrieval throughput")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    report = run_benchmark(args.num_queries, args.k, args.batch_size)
+    print("\n[RESULTS]")
+    for key, value in report.items():
+        print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
@@ -0,0 +1,143 @@
+# benchmarks/startup.py
+#
+# Startup-time report: import time of each entry-point module and time to the
+# first answer for the Streamlit app path and the interactive __main__ entries,
+# each measured in a fresh interpreter so nothing is already imported or loaded.
+# Run from the repository root:
+#   PYTHONPATH=src python -m benchmarks.startup --save-baseline log/startup_baseline.json
+#   PYTHONPATH=src python -m benchmarks.startup --baseline log/startup_baseline.json --tolerance 0.25
+# Exits non-zero when an import exceeds --max-import-seconds or a measurement
+# regresses past the baseline by more than --tolerance.
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+# Modules with a __main__ entry point, plus the app's own imports
+IMPORT_MODULES = [
+    "agents.rag_graph",
+    "agents.ranker",
+    "agents.validator",
+    "core.retrieval",
+    "core.pipeline_llm",
+    "core.pipeline_qa",
+    "core.pipeline_seq2seq",
+    "misc.faiss_search",
+    "utils.embedding",
+    "utils.evaluation",
+    "utils.guardrails",
+    "utils.mlflow_logger",
+    "utils.prepare_data",
+]
+
+# Entry points that answer a query read from stdin. utils.embedding, utils.prepare_data
+# and utils.evaluation are batch jobs without a "first request", so only their import is timed.
+FIRST_REQUEST_ENTRIES = {
+    "app": ["-c", "from agents.rag_graph import run_rag_pipeline; run_rag_pipeline(input())"],
+    "core.retrieval": ["-m", "core.retrieval"],
+    "misc.faiss_search": ["-m", "misc.faiss_search"],
+    "core.pipeline_llm": ["-m", "core.pipeline_llm"],
+    "core.pipeline_qa": ["-m", "core.pipeline_qa"],
+    "core.pipeline_seq2seq": ["-m", "core.pipeline_seq2seq"],
+}
+
+IMPORT_SNIPPET = "import time, importlib; t = time.perf_counter(); importlib.import_module({!r}); print(time.perf_counter() - t)"
+
+def _env():
+    src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [src, env.get("PYTHONPATH")]))
+    return env
+
+def time_import(module, repeats=3, timeout=300):
+    """Median seconds to import `module` in a fresh interpreter, or None if the import fails."""
+    samples = []
+    for _ in range(repeats):
+        proc = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET.format(module)],
+                              capture_output=True, text=True, env=_env(), timeout=timeout)
+        if proc.returncode != 0:
+            print(f"[WARN] import {module} failed: {proc.stderr.strip().splitlines()[-1:]}")
+            return None
+        samples.append(float(proc.stdout.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+def time_first_request(name, query, timeout=600):
+    """Wall seconds from interpreter start to exit after answering one query, or None on failure."""
+    start = time.perf_counter()
+    try:
+        # The trailing blank line ends the interactive retrieval loop
+        proc = subprocess.run([sys.executable, *FIRST_REQUEST_ENTRIES[name]], input=f"{query}\n\n",
+                              capture_output=True, text=True, env=_env(), timeout=timeout)
+    except subprocess.TimeoutExpired:
+        print(f"[WARN] {name} timed out after {timeout}s")
+        return None
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        print(f"[WARN] {name} failed: {proc.stderr.strip().splitlines()[-1:]}")
+        return None
+    return elapsed
+
+def run_report(query, repeats=3, modules=None, entries=None, skip_first_request=False):
+    report = {"python": sys.version.split()[0], "import_seconds": {}, "first_request_seconds": {}}
+    for module in modules or IMPORT_MODULES:
+        report["import_seconds"][module] = time_import(module, repeats)
+        print(f"[IMPORT] {module:<24} {_fmt(report['import_seconds'][module])}")
+    if not skip_first_request:
+        for name in entries or FIRST_REQUEST_ENTRIES:
+            report["first_request_seconds"][name] = time_first_request(name, query)
+            print(f"[FIRST]  {name:<24} {_fmt(report['first_request_seconds'][name])}")
+    return report
+
+def check_regressions(report, baseline=None, tolerance=0.25, max_import_seconds=None):
+    """Returns a list of human-readable failures (empty when within budget)."""
+    failures = []
+    if max_import_seconds is not None:
+        for module, seconds in report["import_seconds"].items():
+            if seconds is not None and seconds > max_import_seconds:
+                failures.append(f"import {module}: {seconds:.3f}s > budget {max_import_seconds:.3f}s")
+    for section in ("import_seconds", "first_request_seconds") if baseline else ():
+        for name, seconds in report[section].items():
+            before = baseline.get(section, {}).get(name)
+            if seconds is None or before is None:
+                continue
+            if seconds > before * (1 + tolerance):
+                failures.append(f"{section} {name}: {seconds:.3f}s vs baseline {before:.3f}s (+{seconds / before - 1:.0%})")
+    return failures
+
+def _fmt(seconds):
+    return "failed" if seconds is None else f"{seconds:8.3f}s"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time and first-request latency report")
+    parser.add_argument("--query", default="What medications has the patient been prescribed?")
+    parser.add_argument("--repeats", type=int, default=3, help="Fresh interpreters per import measurement")
+    parser.add_argument("--modules", nargs="*", help="Modules to time (default: all entry points)")
+    parser.add_argument("--entries", nargs="*", choices=list(FIRST_REQUEST_ENTRIES), help="First-request entries to run")
+    parser.add_argument("--imports-only", action="store_true", help="Skip the first-request measurements")
+    parser.add_argument("--save-baseline", help="Write the report to this JSON file")
+    parser.add_argument("--baseline", help="Compare against a report saved with --save-baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown vs the baseline (0.25 = 25%%)")
+    parser.add_argument("--max-import-seconds", type=float, help="Absolute budget for any single import")
+    args = parser.parse_args()
+
+    report = run_report(args.query, args.repeats, args.modules, args.entries, args.imports_only)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"[INFO] Baseline written to {args.save_baseline}")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    failures = check_regressions(report, baseline, args.tolerance, args.max_import_seconds)
+    for failure in failures:
+        print(f"[REGRESSION] {failure}")
+    sys.exit(1 if failures else 0)
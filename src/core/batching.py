@@ -0,0 +1,168 @@
+# core/batching.py
+#
+# Request coalescing for the local generation pipelines. Concurrent callers put
+# prompts on a queue; one worker thread collects up to max_batch_size of them (or
+# whatever arrived within max_wait_ms of the first), groups them by length so short
+# prompts are not padded to the longest one, runs one generate call per group and
+# hands each caller its own output.
+
+import os
+import time
+import queue
+import atexit
+import threading
+from collections import Counter
+from concurrent.futures import Future
+
+from utils.metrics import registry, STAGE_SECONDS, COUNT_BUCKETS
+
+# Set to false to send every prompt to the model on its own
+MICRO_BATCHING = os.getenv("MICRO_BATCHING", "true").lower() != "false"
+# How long the first prompt of a batch waits for company
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+# A prompt shorter than (1 - BATCH_MAX_PADDING) x the longest prompt of its group starts a new group
+BATCH_MAX_PADDING = float(os.getenv("BATCH_MAX_PADDING", "0.5"))
+
+BATCH_SIZE = registry.histogram("generate_batch_size", "Prompts per generate call", COUNT_BUCKETS, ["batcher"])
+BATCHED_REQUESTS = registry.counter("batched_requests_total", "Prompts served by a micro-batcher", ["batcher", "outcome"])
+
+
+def length_groups(items, length, max_padding=BATCH_MAX_PADDING):
+    """Sorts items longest first and splits them where padding to the group's longest would waste more than max_padding."""
+    items = sorted(items, key=length, reverse=True)
+    groups = []
+    for item in items:
+        if groups and length(item) >= (1 - max_padding) * length(groups[-1][0]):
+            groups[-1].append(item)
+        else:
+            groups.append([item])
+    return groups
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent generate(prompt) calls into generate_batch(prompts) calls.
+    `generate_batch` must return one output per prompt, in order; `length` ranks
+    prompts for grouping (characters by default, which tracks token count closely
+    enough without tokenizing twice).
+    """
+
+    def __init__(self, generate_batch, max_batch_size=8, max_wait_ms=BATCH_MAX_WAIT_MS,
+                 max_padding=BATCH_MAX_PADDING, length=len, name="generate"):
+        self.generate_batch = generate_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_padding = max_padding
+        self.length = length
+        self.name = name
+        self._queue = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batch_sizes = Counter()
+        self.totals = {"requests": 0, "errors": 0, "generate_calls": 0, "generate_seconds": 0.0, "queue_wait_seconds": 0.0}
+        self._first_request = None
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._start_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name=f"batcher-{self.name}", daemon=True)
+                    self._worker.start()
+                    atexit.register(self.close)
+
+    def submit(self, prompt):
+        """Queues a prompt; returns a Future that resolves to its output."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((prompt, future, time.perf_counter()))
+        return future
+
+    def generate(self, prompt, timeout=None):
+        """Blocks until the batch holding `prompt` has been generated."""
+        return self.submit(prompt).result(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            closing = False
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            for group in length_groups(batch, lambda entry: self.length(entry[0]), self.max_padding):
+                self._generate_group(group)
+            if closing:
+                return
+
+    def _generate_group(self, group):
+        # Callers that cancelled while queued are left out of the batch
+        group = [entry for entry in group if entry[1].set_running_or_notify_cancel()]
+        if not group:
+            return
+        start = time.perf_counter()
+        try:
+            outputs = self.generate_batch([prompt for prompt, _, _ in group])
+            if len(outputs) != len(group):
+                raise RuntimeError(f"generate_batch returned {len(outputs)} outputs for {len(group)} prompts")
+        except Exception as exc:
+            for _, future, _ in group:
+                future.set_exception(exc)
+            self._record(group, start, error=True)
+            return
+        self._record(group, start)
+        for (_, future, _), output in zip(group, outputs):
+            future.set_result(output)
+
+    def _record(self, group, start, error=False):
+        elapsed = time.perf_counter() - start
+        waited = sum(start - queued_at for _, _, queued_at in group)
+        with self._stats_lock:
+            if self._first_request is None:
+                self._first_request = min(queued_at for _, _, queued_at in group)
+            self.batch_sizes[len(group)] += 1
+            self.totals["requests"] += len(group)
+            self.totals["errors"] += len(group) if error else 0
+            self.totals["generate_calls"] += 1
+            self.totals["generate_seconds"] += elapsed
+            self.totals["queue_wait_seconds"] += waited
+        BATCH_SIZE.observe(len(group), batcher=self.name)
+        BATCHED_REQUESTS.inc(len(group), batcher=self.name, outcome="error" if error else "ok")
+        STAGE_SECONDS.observe(elapsed, stage=f"{self.name}_generate")
+        for _, _, queued_at in group:
+            STAGE_SECONDS.observe(start - queued_at, stage=f"{self.name}_queue_wait")
+
+    def close(self, timeout=10.0):
+        """Generates whatever is still queued, then stops the worker."""
+        if self._worker is None or not self._worker.is_alive():
+            return
+        self._queue.put(None)
+        self._worker.join(timeout)
+
+    def stats(self):
+        """Batch-size distribution and throughput since the first request."""
+        with self._stats_lock:
+            totals = dict(self.totals)
+            sizes = dict(sorted(self.batch_sizes.items()))
+            first = self._first_request
+        requests, calls = totals["requests"], totals["generate_calls"]
+        wall = time.perf_counter() - first if first is not None else 0.0
+        return {
+            **totals,
+            "batch_size_distribution": sizes,
+            "mean_batch_size": requests / calls if calls else 0.0,
+            "mean_queue_wait_ms": totals["queue_wait_seconds"] * 1000.0 / requests if requests else 0.0,
+            # Prompts per second of model time, and per second since the first request
+            "generate_throughput": requests / totals["generate_seconds"] if totals["generate_seconds"] else 0.0,
+            "wall_throughput": requests / wall if wall else 0.0,
+            "pending": self._queue.qsize(),
+        }
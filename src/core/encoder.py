@@ -0,0 +1,57 @@
+# core/encoder.py
+#
+# Sentence encoder shared by index builds (utils/embedding.py) and query encoding
+# (core/retrieval.py), by ENCODER_BACKEND:
+#   torch      stock sentence-transformers on PyTorch
+#   onnx       the same weights through ONNX Runtime
+#   onnx_int8  ONNX Runtime with dynamically int8-quantized weights
+# The ONNX backends need sentence-transformers[onnx]. all-MiniLM-L6-v2 ships
+# pre-exported (and int8) graphs on the hub; other models are exported on first load.
+
+import os
+
+ENCODER_BACKENDS = ["torch", "onnx", "onnx_int8"]
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "torch")
+# Instruction set of the int8 graph: avx2 | avx512 | avx512_vnni | arm64
+ENCODER_QUANTIZATION = os.getenv("ENCODER_QUANTIZATION", "avx2")
+# Local copies of encoders quantized here (models without a published int8 graph)
+ENCODER_EXPORT_DIR = os.getenv("ENCODER_EXPORT_DIR", "./models/encoder")
+
+
+def check_encoder_backend(backend):
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}', expected one of {ENCODER_BACKENDS}")
+    return backend
+
+def encoder_id(model_name, backend=None):
+    """Model plus backend, recorded with anything built from the encoder's vectors."""
+    backend = check_encoder_backend(backend or ENCODER_BACKEND)
+    if backend == "onnx_int8":
+        return f"{model_name}:{backend}_{ENCODER_QUANTIZATION}"
+    return model_name if backend == "torch" else f"{model_name}:{backend}"
+
+# sentence_transformers (and torch or onnxruntime) is only imported when something needs encoding
+def load_encoder(model_name, backend=None):
+    from sentence_transformers import SentenceTransformer
+
+    backend = check_encoder_backend(backend or ENCODER_BACKEND)
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+    if backend == "onnx":
+        return SentenceTransformer(model_name, backend="onnx")
+
+    file_name = f"onnx/model_qint8_{ENCODER_QUANTIZATION}.onnx"
+    try:
+        return SentenceTransformer(model_name, backend="onnx", model_kwargs={"file_name": file_name})
+    except Exception:
+        pass  # no published int8 graph for this model: quantize a local copy once
+
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    local_dir = os.path.join(ENCODER_EXPORT_DIR, os.path.basename(os.path.normpath(model_name)))
+    if not os.path.exists(os.path.join(local_dir, file_name)):
+        print(f"[INFO] Exporting an int8 ({ENCODER_QUANTIZATION}) ONNX encoder to {local_dir}...")
+        model = SentenceTransformer(model_name, backend="onnx")
+        model.save_pretrained(local_dir)
+        export_dynamic_quantized_onnx_model(model, ENCODER_QUANTIZATION, local_dir)
+    return SentenceTransformer(local_dir, backend="onnx", model_kwargs={"file_name": file_name})
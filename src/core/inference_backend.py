@@ -0,0 +1,116 @@
+# core/inference_backend.py
+#
+# Model loading for the local generation pipelines, by INFERENCE_BACKEND:
+#   fp32  the checkpoint as trained (PyTorch, float32)
+#   int8  PyTorch with dynamic int8 quantization of every nn.Linear (weights stored
+#         as int8, activations quantized on the fly); no export step
+#   onnx  ONNX Runtime graphs exported once from the checkpoint under ONNX_EXPORT_DIR,
+#         dynamically int8-quantized unless ONNX_QUANTIZATION=none
+# The ONNX graphs are exported with past key/value inputs, so, like the PyTorch models,
+# they decode one new token per step instead of re-running the whole prefix.
+# Export ahead of time (otherwise the first load does it):
+#   PYTHONPATH=src python -m core.inference_backend --model ./models/flan-t5-small/ --kind seq2seq
+
+import os
+import glob
+import shutil
+import argparse
+
+BACKENDS = ["fp32", "int8", "onnx"]
+KINDS = ["seq2seq", "causal"]
+
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "fp32")
+# Exported graphs go to <ONNX_EXPORT_DIR>/<checkpoint name>[-int8]
+ONNX_EXPORT_DIR = os.getenv("ONNX_EXPORT_DIR", "./models/onnx")
+# Instruction set the int8 ONNX kernels target: avx2 | avx512 | avx512_vnni | arm64 | none
+ONNX_QUANTIZATION = os.getenv("ONNX_QUANTIZATION", "avx2")
+
+
+def _check_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}', expected one of {BACKENDS}")
+    return backend
+
+def _import_optimum():
+    try:
+        from optimum import onnxruntime
+    except ImportError as exc:
+        raise ImportError(
+            "INFERENCE_BACKEND=onnx needs optimum with ONNX Runtime: pip install 'optimum[onnxruntime]'"
+        ) from exc
+    return onnxruntime
+
+def _ort_model_class(onnxruntime, kind):
+    return onnxruntime.ORTModelForSeq2SeqLM if kind == "seq2seq" else onnxruntime.ORTModelForCausalLM
+
+def onnx_model_dir(model_path, quantization=ONNX_QUANTIZATION):
+    name = os.path.basename(os.path.normpath(model_path))
+    return os.path.join(ONNX_EXPORT_DIR, name if quantization == "none" else f"{name}-int8")
+
+# ORTQuantizer writes <name>_quantized.onnx; the graphs get the fp32 file names back
+# so from_pretrained finds the same files in the fp32 and int8 directories
+def restore_graph_names(model_dir):
+    for path in glob.glob(os.path.join(model_dir, "*_quantized.onnx")):
+        os.replace(path, path[:-len("_quantized.onnx")] + ".onnx")
+
+def export_onnx(model_path, kind, quantization=ONNX_QUANTIZATION):
+    """Exports the checkpoint to ONNX (with past key/value inputs) and optionally quantizes it."""
+    onnxruntime = _import_optimum()
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    output_dir = onnx_model_dir(model_path, quantization)
+    fp32_dir = onnx_model_dir(model_path, "none")
+    if not glob.glob(os.path.join(fp32_dir, "*.onnx")):
+        print(f"[INFO] Exporting {model_path} to ONNX in {fp32_dir}...")
+        model = _ort_model_class(onnxruntime, kind).from_pretrained(model_path, export=True, use_cache=True)
+        model.save_pretrained(fp32_dir)
+    if quantization == "none":
+        return fp32_dir
+
+    print(f"[INFO] Quantizing ONNX graphs to int8 ({quantization}) in {output_dir}...")
+    config = getattr(AutoQuantizationConfig, quantization)(is_static=False, per_channel=False)
+    os.makedirs(output_dir, exist_ok=True)
+    # Seq2seq exports are several graphs (encoder, decoder, decoder with past); each is quantized
+    for path in sorted(glob.glob(os.path.join(fp32_dir, "*.onnx"))):
+        quantizer = onnxruntime.ORTQuantizer.from_pretrained(fp32_dir, file_name=os.path.basename(path))
+        quantizer.quantize(save_dir=output_dir, quantization_config=config)
+    restore_graph_names(output_dir)
+    for path in glob.glob(os.path.join(fp32_dir, "*.json")):
+        shutil.copy(path, output_dir)
+    return output_dir
+
+def load_model(model_path, kind, backend=None):
+    """The pipeline's model for `backend` (INFERENCE_BACKEND unless overridden)."""
+    backend = _check_backend(backend or INFERENCE_BACKEND)
+    if kind not in KINDS:
+        raise ValueError(f"Unknown model kind '{kind}', expected one of {KINDS}")
+
+    if backend == "onnx":
+        onnxruntime = _import_optimum()
+        model_dir = onnx_model_dir(model_path)
+        if not glob.glob(os.path.join(model_dir, "*.onnx")):
+            model_dir = export_onnx(model_path, kind)
+        restore_graph_names(model_dir)  # int8 exports written before the rename
+        print(f"[INFO] Loading ONNX Runtime model from {model_dir}...")
+        return _ort_model_class(onnxruntime, kind).from_pretrained(model_dir, use_cache=True)
+
+    import torch
+    from transformers import AutoModelForSeq2SeqLM, AutoModelForCausalLM
+
+    model_class = AutoModelForSeq2SeqLM if kind == "seq2seq" else AutoModelForCausalLM
+    model = model_class.from_pretrained(model_path, torch_dtype=torch.float32)
+    model.eval()
+    if backend == "int8":
+        print("[INFO] Applying dynamic int8 quantization to Linear layers...")
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a local checkpoint to (int8) ONNX Runtime graphs")
+    parser.add_argument("--model", required=True, help="Checkpoint directory under ./models/")
+    parser.add_argument("--kind", choices=KINDS, required=True)
+    parser.add_argument("--quantization", default=ONNX_QUANTIZATION,
+                        help="avx2 | avx512 | avx512_vnni | arm64 | none")
+    args = parser.parse_args()
+    print(f"[INFO] ONNX model ready in {export_onnx(args.model, args.kind, args.quantization)}")
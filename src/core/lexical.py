@@ -0,0 +1,160 @@
+# core/lexical.py
+#
+# In-process BM25 inverted index over the patient summaries.
+# On-disk layout (all arrays memory-mapped on load):
+#   <prefix>.vocab.json   term -> term id, plus corpus statistics
+#   <prefix>.offsets.npy  int64, posting list boundaries per term id
+#   <prefix>.rows.npy     int64, metadata rows of each posting
+#   <prefix>.tf.npy       int32, term frequency of each posting
+#   <prefix>.doclen.npy   int32, token count per metadata row
+
+import os
+import re
+import json
+from collections import Counter, defaultdict
+
+import numpy as np
+
+STOPWORDS = {
+    "a", "an", "and", "are", "be", "by", "does", "for", "has", "have", "in", "is", "it",
+    "list", "of", "on", "or", "patient", "the", "to", "was", "what", "when", "which", "who", "with",
+}
+
+# Shortest term that can trigger the rare-term shortcut
+MIN_RARE_TERM_LENGTH = 3
+
+# Letters and digits are split so Synthea names like "Sarah123" match a query for "Sarah"
+def tokenize(text):
+    return [tok for tok in re.findall(r"[a-z]+|[0-9]+", text.lower()) if tok not in STOPWORDS]
+
+def is_identifier_term(term):
+    """Name-shaped terms (patient names, drugs, conditions); numbers such as ages, doses or years are not."""
+    return term.isalpha() and len(term) >= MIN_RARE_TERM_LENGTH
+
+
+class BM25Index:
+    """BM25 scorer over a posting-list index; rows are the metadata rows used by the FAISS index."""
+
+    # Terms present in more than this fraction of documents carry ~zero IDF and are skipped
+    MAX_DF_FRACTION = 0.5
+
+    def __init__(self, vocab, offsets, rows, tf, doclen, k1=1.5, b=0.75):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.rows = rows
+        self.tf = tf
+        self.doclen = doclen
+        self.k1 = k1
+        self.b = b
+        self.num_docs = int(np.count_nonzero(doclen))
+        self.avgdl = float(doclen.sum()) / self.num_docs if self.num_docs else 0.0
+
+    @classmethod
+    def from_texts(cls, texts, k1=1.5, b=0.75):
+        postings = defaultdict(list)
+        doclen = np.zeros(len(texts), dtype=np.int32)
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doclen[row] = sum(counts.values())
+            for term, count in counts.items():
+                postings[term].append((row, count))
+
+        vocab = {term: i for i, term in enumerate(sorted(postings))}
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        for term, i in vocab.items():
+            offsets[i + 1] = len(postings[term])
+        offsets = np.cumsum(offsets)
+
+        rows = np.empty(offsets[-1], dtype=np.int64)
+        tf = np.empty(offsets[-1], dtype=np.int32)
+        for term, i in vocab.items():
+            entries = np.asarray(postings[term], dtype=np.int64)
+            rows[offsets[i]:offsets[i + 1]] = entries[:, 0]
+            tf[offsets[i]:offsets[i + 1]] = entries[:, 1]
+        return cls(vocab, offsets, rows, tf, doclen, k1, b)
+
+    def save(self, path_prefix):
+        os.makedirs(os.path.dirname(path_prefix) or ".", exist_ok=True)
+        for suffix, array in (("offsets", self.offsets), ("rows", self.rows), ("tf", self.tf), ("doclen", self.doclen)):
+            path = f"{path_prefix}.{suffix}.npy"
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(path + ".tmp", path)
+        # Vocab last: its presence marks a complete index
+        with open(f"{path_prefix}.vocab.json.tmp", "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "terms": self.vocab}, f)
+        os.replace(f"{path_prefix}.vocab.json.tmp", f"{path_prefix}.vocab.json")
+
+    @staticmethod
+    def exists(path_prefix):
+        return os.path.exists(f"{path_prefix}.vocab.json")
+
+    @classmethod
+    def load(cls, path_prefix):
+        with open(f"{path_prefix}.vocab.json") as f:
+            meta = json.load(f)
+        arrays = [np.load(f"{path_prefix}.{suffix}.npy", mmap_mode="r") for suffix in ("offsets", "rows", "tf", "doclen")]
+        return cls(meta["terms"], *arrays, k1=meta["k1"], b=meta["b"])
+
+    def document_frequency(self, term):
+        i = self.vocab.get(term)
+        return 0 if i is None else int(self.offsets[i + 1] - self.offsets[i])
+
+    def postings(self, term):
+        i = self.vocab.get(term)
+        if i is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.rows[start:end], self.tf[start:end]
+
+    def _idf(self, df):
+        return np.log(1.0 + (self.num_docs - df + 0.5) / (df + 0.5))
+
+    def score(self, query, candidate_rows=None):
+        """BM25 scores as (rows, scores) for every document sharing a useful term with the query."""
+        all_rows, all_scores = [], []
+        max_df = max(1, int(self.MAX_DF_FRACTION * self.num_docs))
+        for term in set(tokenize(query)):
+            df = self.document_frequency(term)
+            if not df or df > max_df:
+                continue
+            rows, tf = self.postings(term)
+            tf = tf.astype(np.float32)
+            norm = self.k1 * (1 - self.b + self.b * self.doclen[rows] / self.avgdl)
+            all_rows.append(rows)
+            all_scores.append(self._idf(df) * tf * (self.k1 + 1) / (tf + norm))
+
+        if not all_rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows, inverse = np.unique(np.concatenate(all_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        if candidate_rows is not None:
+            keep = np.isin(rows, candidate_rows)
+            rows, scores = rows[keep], scores[keep]
+        return rows, scores
+
+    def search(self, query, k=5, candidate_rows=None):
+        """Top-k (row, score) pairs, best first."""
+        rows, scores = self.score(query, candidate_rows)
+        if not len(rows):
+            return []
+        top = np.argsort(-scores, kind="stable")[:k]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+    def rare_term_rows(self, query, max_df):
+        """
+        Rows containing any name-shaped query term that occurs in at most max_df documents
+        (e.g. a drug or a name). A rare number (an age, a dose, a year) does not make the
+        query about the few records that contain it, so numbers never qualify.
+        """
+        terms = [term for term in set(tokenize(query)) if is_identifier_term(term)]
+        rows = [self.postings(term)[0] for term in terms if 0 < self.document_frequency(term) <= max_df]
+        return np.unique(np.concatenate(rows)) if rows else None
+
+# Reciprocal rank fusion of several ranked row lists
+def reciprocal_rank_fusion(rankings, k=60):
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            fused[row] += 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: -item[1])
@@ -0,0 +1,79 @@
+# core/patient_keys.py
+#
+# Exact-match key index from patient id and normalized patient name to the
+# metadata row of that patient's summary. Names are keyed twice: as written, with
+# Synthea's numeric suffixes ("john123 smith456"), which tells same-name patients
+# apart, and without them ("john smith") as a fallback for queries that omit them.
+
+import os
+import re
+import json
+import unicodedata
+
+UUID_PATTERN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.IGNORECASE)
+NAME_PATTERN = re.compile(r"^Patient: (.*?), Age:")
+
+# Lowercase, drop accents and, unless keep_digits, Synthea's numeric name suffixes ("Sarah123" -> "sarah")
+def normalize_name(text, keep_digits=False):
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(re.findall(r"[a-z0-9]+" if keep_digits else r"[a-z]+", text.lower()))
+
+def _name_keys(tokens):
+    # Full name, plus "first last" when a middle name is present
+    keys = {" ".join(tokens), f"{tokens[0]} {tokens[-1]}" if len(tokens) > 1 else ""}
+    return [key for key in keys if " " in key]
+
+def build_patient_keys(doc_ids, summaries):
+    ids, exact_names, names = {}, {}, {}
+    for row, (pid, summary) in enumerate(zip(doc_ids, summaries)):
+        if not pid:  # row freed by an incremental update
+            continue
+        ids[str(pid).lower()] = row
+        match = NAME_PATTERN.match(summary)
+        if not match:
+            continue
+        for keys, keep_digits in ((exact_names, True), (names, False)):
+            tokens = normalize_name(match.group(1), keep_digits).split()
+            for key in _name_keys(tokens) if tokens else []:
+                keys.setdefault(key, []).append(row)
+    return {"ids": ids, "exact_names": exact_names, "names": names}
+
+def save_patient_keys(keys, path):
+    with open(path + ".tmp", "w") as f:
+        json.dump(keys, f)
+    os.replace(path + ".tmp", path)
+
+
+class PatientKeyIndex:
+    """Resolves a query to patient rows by id or by a full (first + last) name mentioned in it."""
+
+    MAX_NAME_TOKENS = 4
+
+    def __init__(self, keys):
+        self.ids = keys["ids"]
+        self.exact_names = keys.get("exact_names", {})  # absent in key files from older builds
+        self.names = keys["names"]
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def resolve(self, query):
+        rows = [self.ids[m.lower()] for m in UUID_PATTERN.findall(query) if m.lower() in self.ids]
+        if rows:
+            return rows
+
+        # A name written with its numeric suffixes names one patient; without them it may name several
+        return (self._find_name(normalize_name(query, keep_digits=True).split(), self.exact_names)
+                or self._find_name(normalize_name(query).split(), self.names))
+
+    def _find_name(self, tokens, keys):
+        # Longest name mentioned in the query wins
+        for n in range(min(self.MAX_NAME_TOKENS, len(tokens)), 1, -1):
+            for start in range(len(tokens) - n + 1):
+                key = " ".join(tokens[start:start + n])
+                if key in keys:
+                    return list(keys[key])
+        return None
@@ -1,10 +1,10 @@
-from src.core.retrieval import retrieve_relevant_docs
-from src.utils.guardrails import apply_guardrails
-from src.utils.evaluation import log_evaluation
-from transformers import pipeline
+from core.retrieval import retrieve_relevant_docs, retrieve_relevant_docs_batch
+from utils.guardrails import apply_guardrails, apply_guardrails_batch
+from utils.evaluation import log_evaluation, stage_timer
+from core.batching import MicroBatcher, MICRO_BATCHING, BATCH_MAX_WAIT_MS
+from core.inference_backend import load_model, INFERENCE_BACKEND
 from dotenv import load_dotenv
-from langchain_huggingface import HuggingFacePipeline
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+from functools import lru_cache
 import os
 
 # Load environment variables
@@ -12,26 +12,40 @@ load_dotenv()
 
 # model_path = os.getenv("LLM_MODEL_PATH", "./models/finetuned_model/roberta-base-squad2")
 model_path = "./models/cpu_model/"
-
-print(f"Loading model from {model_path}...")
-
-tokenizer = AutoTokenizer.from_pretrained(model_path)
-model = AutoModelForCausalLM.from_pretrained(
-    model_path,
-    torch_dtype="float32"
-)
-
-generator = pipeline(
-    "text-generation",
-    model=model,
-    tokenizer=tokenizer,
-    max_length=2048,
-    do_sample=True,
-    temperature=0.2,
-    # top_p=0.9,
-)
-
-llm = HuggingFacePipeline(pipeline=generator)
+TASK = "text-generation"
+
+# Prompts per forward pass in run_pipeline_batch
+GENERATION_BATCH_SIZE = int(os.getenv("GENERATION_BATCH_SIZE", "8"))
+
+# The model (and transformers itself) is loaded on the first query, not at import
+@lru_cache(maxsize=None)
+def load_pipeline():
+    from transformers import AutoTokenizer, pipeline
+    from langchain_huggingface import HuggingFacePipeline
+
+    print(f"Loading model from {model_path} ({INFERENCE_BACKEND})...")
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    # fp32 | int8 | onnx, see core/inference_backend.py
+    model = load_model(model_path, "causal")
+
+    # Batched generation pads on the left; causal models often ship without a pad token
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+
+    generator = pipeline(
+        TASK,
+        model=model,
+        tokenizer=tokenizer,
+        max_length=2048,
+        do_sample=True,
+        temperature=0.2,
+        # top_p=0.9,
+        # Prompts per padded generate call when LangChain hands the pipeline a list
+        batch_size=GENERATION_BATCH_SIZE,
+    )
+
+    return HuggingFacePipeline(pipeline=generator, batch_size=GENERATION_BATCH_SIZE)
 
 # Prompt template
 PROMPT_TEMPLATE = """
@@ -51,6 +65,21 @@ def build_prompt(chunks, query):
     prompt = PROMPT_TEMPLATE.format(context=context, query=query)
     return prompt
 
+def _generated_text(output):
+    return (output[0] if isinstance(output, list) else output)["generated_text"]
+
+def generate_batch(prompts, batch_size=None):
+    """One padded generate call per `batch_size` prompts (all of them at once by default)."""
+    generator = load_pipeline().pipeline
+    return [_generated_text(output) for output in generator(prompts, batch_size=batch_size or len(prompts))]
+
+@lru_cache(maxsize=None)
+def get_batcher():
+    return MicroBatcher(generate_batch, GENERATION_BATCH_SIZE, BATCH_MAX_WAIT_MS, name="llm")
+
+def generate(prompt):
+    return get_batcher().generate(prompt) if MICRO_BATCHING else generate_batch([prompt])[0]
+
 def run_pipeline(query):
     # Step 1: Retrieve relevant patient records
     chunks = retrieve_relevant_docs(query)
@@ -58,8 +87,8 @@ def run_pipeline(query):
     # Step 2: Build the prompt
     prompt = build_prompt(chunks, query)
 
-    # Step 3: Query the LLM
-    response = llm.invoke(prompt)
+    # Step 3: Query the LLM (batched with concurrent requests)
+    response = generate(prompt)
 
     # Step 4: Apply guardrails
     guardrail_result = apply_guardrails(response)
@@ -69,6 +98,31 @@ def run_pipeline(query):
 
     return response, prompt, chunks, guardrail_result
 
+def run_pipeline_batch(queries, batch_size=GENERATION_BATCH_SIZE, timings=None):
+    """
+    Batched run_pipeline for offline evaluation: one batched retrieval pass and
+    batched generation. Returns a (response, prompt, chunks, guardrails) tuple per
+    query; per-stage seconds are added to `timings` when given. Queries are not
+    logged to MLflow one by one.
+    """
+    timings = timings if timings is not None else {}
+    with stage_timer(timings, "model_load"):
+        load_pipeline()
+
+    with stage_timer(timings, "retrieval"):
+        chunk_lists = retrieve_relevant_docs_batch(queries)
+
+    with stage_timer(timings, "prompt"):
+        prompts = [build_prompt(chunks, query) for chunks, query in zip(chunk_lists, queries)]
+
+    with stage_timer(timings, "generation"):
+        responses = generate_batch(prompts, batch_size)
+
+    with stage_timer(timings, "guardrails"):
+        guardrail_results = apply_guardrails_batch(responses)
+
+    return list(zip(responses, prompts, chunk_lists, guardrail_results))
+
 # Standalone test
 if __name__ == "__main__":
     user_query = input("Enter a medical question: ")
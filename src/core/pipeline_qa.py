@@ -1,9 +1,8 @@
-from core.retrieval import retrieve_relevant_docs
-from utils.guardrails import apply_guardrails
-from utils.evaluation import log_evaluation
-from transformers import pipeline
+from core.retrieval import retrieve_relevant_docs, retrieve_relevant_docs_batch
+from utils.guardrails import apply_guardrails, apply_guardrails_batch
+from utils.evaluation import log_evaluation, stage_timer
 from dotenv import load_dotenv
-from transformers import AutoTokenizer, AutoModelForQuestionAnswering, pipeline
+from functools import lru_cache
 import os
 
 # Load environment variables
@@ -11,20 +10,28 @@ load_dotenv()
 
 # model_path = os.getenv("LLM_MODEL_PATH", "./models/finetuned_model/roberta-base-squad2")
 model_path = "./models/finetuned_model/roberta-base-squad2/"
+TASK = "question-answering"
 
-print(f"Loading model from {model_path}...")
+# Question/context pairs per forward pass in run_pipeline_batch
+GENERATION_BATCH_SIZE = int(os.getenv("GENERATION_BATCH_SIZE", "8"))
 
-tokenizer = AutoTokenizer.from_pretrained(model_path)
-model = AutoModelForQuestionAnswering.from_pretrained(
-    model_path,
-    torch_dtype="float32"
-)
+# The model (and transformers itself) is loaded on the first query, not at import
+@lru_cache(maxsize=None)
+def load_pipeline():
+    from transformers import AutoTokenizer, AutoModelForQuestionAnswering, pipeline
 
-qa_pipeline = pipeline(
-    "question-answering",
-    model=model,
-    tokenizer=tokenizer
-)
+    print(f"Loading model from {model_path}...")
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModelForQuestionAnswering.from_pretrained(
+        model_path,
+        torch_dtype="float32"
+    )
+
+    return pipeline(
+        TASK,
+        model=model,
+        tokenizer=tokenizer
+    )
 
 # Prompt template
 PROMPT_TEMPLATE = """
@@ -42,6 +49,8 @@ def build_prompt(chunks, query):
     return prompt
 
 def run_pipeline(query):
+    qa_pipeline = load_pipeline()
+
     # Step 1: Retrieve relevant patient records
     chunks = retrieve_relevant_docs(query)
 
@@ -64,6 +73,34 @@ def run_pipeline(query):
 
     return response, prompt, chunks, guardrail_result
 
+def run_pipeline_batch(queries, batch_size=GENERATION_BATCH_SIZE, timings=None):
+    """
+    Batched run_pipeline for offline evaluation: one batched retrieval pass and
+    batched generation. Returns a (response, prompt, chunks, guardrails) tuple per
+    query; per-stage seconds are added to `timings` when given. Queries are not
+    logged to MLflow one by one.
+    """
+    timings = timings if timings is not None else {}
+    with stage_timer(timings, "model_load"):
+        qa_pipeline = load_pipeline()
+
+    with stage_timer(timings, "retrieval"):
+        chunk_lists = retrieve_relevant_docs_batch(queries)
+
+    with stage_timer(timings, "prompt"):
+        prompts = [build_prompt(chunks, query) for chunks, query in zip(chunk_lists, queries)]
+
+    with stage_timer(timings, "generation"):
+        outputs = qa_pipeline(question=list(queries), context=prompts, batch_size=batch_size)
+        # A single pair comes back as a dict rather than a list
+        outputs = [outputs] if isinstance(outputs, dict) else outputs
+        responses = [output["answer"] for output in outputs]
+
+    with stage_timer(timings, "guardrails"):
+        guardrail_results = apply_guardrails_batch(responses)
+
+    return list(zip(responses, prompts, chunk_lists, guardrail_results))
+
 # Standalone test
 if __name__ == "__main__":
     user_query = input("Enter a medical question: ")
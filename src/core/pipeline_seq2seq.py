@@ -1,26 +1,34 @@
-from core.retrieval import retrieve_relevant_docs
-from utils.guardrails import apply_guardrails
-from utils.evaluation import log_evaluation
-from transformers import pipeline
+from core.retrieval import retrieve_relevant_docs, retrieve_relevant_docs_batch
+from utils.guardrails import apply_guardrails, apply_guardrails_batch
+from utils.evaluation import log_evaluation, stage_timer
+from core.batching import MicroBatcher, MICRO_BATCHING, BATCH_MAX_WAIT_MS
+from core.inference_backend import load_model, INFERENCE_BACKEND
 from dotenv import load_dotenv
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, pipeline
+from functools import lru_cache
 import os
-import streamlit as st
 
 # Load environment variables
 load_dotenv()
 
 # model_path = os.getenv("LLM_MODEL_PATH", "./models/finetuned_model/roberta-base-squad2")
+model_path = "./models/finetuned_model/flan-t5-small/"
+TASK = "text2text-generation"
 
-@st.cache_resource
+# Prompts per forward pass in run_pipeline_batch
+GENERATION_BATCH_SIZE = int(os.getenv("GENERATION_BATCH_SIZE", "8"))
+
+# Cached per process (also across Streamlit reruns); transformers is imported on first use
+@lru_cache(maxsize=None)
 def load_pipeline():
-    model_path = "./models/finetuned_model/flan-t5-small/"
-    print(f"Loading model from {model_path}...")
+    from transformers import AutoTokenizer, pipeline
+
+    print(f"Loading model from {model_path} ({INFERENCE_BACKEND})...")
     tokenizer = AutoTokenizer.from_pretrained(model_path)
-    model = AutoModelForSeq2SeqLM.from_pretrained(model_path)
+    # fp32 | int8 | onnx, see core/inference_backend.py
+    model = load_model(model_path, "seq2seq")
 
     return pipeline(
-        "text2text-generation",
+        TASK,
         model=model,
         tokenizer=tokenizer,
         max_length=512,
@@ -46,22 +54,32 @@ def build_prompt(chunks, query):
     prompt = PROMPT_TEMPLATE.format(context=context, query=query)
     return prompt
 
-def run_pipeline(query):
-    
+def _generated_text(output):
+    return (output[0] if isinstance(output, list) else output)["generated_text"]
+
+def generate_batch(prompts):
+    """One padded generate call over all `prompts`."""
     pipeline = load_pipeline()
+    return [_generated_text(output) for output in pipeline(prompts, batch_size=len(prompts))]
 
+@lru_cache(maxsize=None)
+def get_batcher():
+    return MicroBatcher(generate_batch, GENERATION_BATCH_SIZE, BATCH_MAX_WAIT_MS, name="seq2seq")
+
+def generate(prompt):
+    return get_batcher().generate(prompt) if MICRO_BATCHING else generate_batch([prompt])[0]
+
+def run_pipeline(query):
     # Step 1: Retrieve relevant patient records
     chunks = retrieve_relevant_docs(query, k=3)
 
     # Step 2: Build the prompt
     prompt = build_prompt(chunks, query)
 
-    # Step 3: Query the LLM
-    raw_response = pipeline(prompt)
-    
-    print(f'Raw Response: {raw_response}')
-    
-    response = raw_response[0]["generated_text"]
+    # Step 3: Query the LLM (batched with concurrent requests)
+    response = generate(prompt)
+
+    print(f'Raw Response: {response}')
 
     # Step 4: Apply guardrails
     guardrail_result = apply_guardrails(response)
@@ -71,6 +89,31 @@ def run_pipeline(query):
 
     return response, prompt, chunks, guardrail_result
 
+def run_pipeline_batch(queries, batch_size=GENERATION_BATCH_SIZE, timings=None):
+    """
+    Batched run_pipeline for offline evaluation: one batched retrieval pass and
+    batched generation. Returns a (response, prompt, chunks, guardrails) tuple per
+    query; per-stage seconds are added to `timings` when given. Queries are not
+    logged to MLflow one by one.
+    """
+    timings = timings if timings is not None else {}
+    with stage_timer(timings, "model_load"):
+        pipeline = load_pipeline()
+
+    with stage_timer(timings, "retrieval"):
+        chunk_lists = retrieve_relevant_docs_batch(queries, k=3)
+
+    with stage_timer(timings, "prompt"):
+        prompts = [build_prompt(chunks, query) for chunks, query in zip(chunk_lists, queries)]
+
+    with stage_timer(timings, "generation"):
+        responses = [_generated_text(output) for output in pipeline(prompts, batch_size=batch_size)]
+
+    with stage_timer(timings, "guardrails"):
+        guardrail_results = apply_guardrails_batch(responses)
+
+    return list(zip(responses, prompts, chunk_lists, guardrail_results))
+
 # Standalone test
 if __name__ == "__main__":
     user_query = input("Enter a medical question: ")
@@ -0,0 +1,112 @@
+# core/query_cache.py
+#
+# Bounded LRU cache of query embeddings, keyed on normalized query text.
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Lowercase and collapse whitespace so trivially different phrasings share an entry
+def normalize_query(text):
+    return " ".join(str(text).lower().split())
+
+
+class QueryEmbeddingCache:
+    """
+    LRU cache of query vectors with an optional per-entry TTL.
+    A max_size of 0 disables caching. When persist_path is set the cache can be
+    saved to / restored from an .npz file so warm restarts keep their hit rate.
+    """
+
+    def __init__(self, max_size=1024, ttl_seconds=None, persist_path=None, model_name=None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds or None
+        self.persist_path = persist_path
+        self.model_name = model_name
+        self._entries = OrderedDict()  # key -> (vector, stored_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expired(self, stored_at, now):
+        return self.ttl_seconds is not None and now - stored_at > self.ttl_seconds
+
+    def get(self, query):
+        if not self.max_size:
+            return None
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[1], time.time()):
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, query, vector, stored_at=None):
+        if not self.max_size:
+            return
+        key = normalize_query(query)
+        with self._lock:
+            self._entries[key] = (np.asarray(vector, dtype="float32"), stored_at or time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def save(self, path=None):
+        path = path or self.persist_path
+        if not path or not self._entries:
+            return
+        with self._lock:
+            keys = list(self._entries)
+            vectors = np.stack([self._entries[k][0] for k in keys])
+            stored_at = np.asarray([self._entries[k][1] for k in keys], dtype="float64")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, keys=np.asarray(keys), vectors=vectors, stored_at=stored_at, model=np.asarray(self.model_name or ""))
+        os.replace(path + ".tmp", path)
+
+    def load(self, path=None):
+        path = path or self.persist_path
+        if not path or not os.path.exists(path):
+            return 0
+        with np.load(path) as data:
+            if self.model_name and str(data["model"]) != self.model_name:
+                print(f"[INFO] Ignoring query cache {path}: built with a different model")
+                return 0
+            # Oldest first, so LRU order survives the round trip
+            for key, vector, stored_at in zip(data["keys"], data["vectors"], data["stored_at"]):
+                if not self._expired(stored_at, time.time()):
+                    self.put(str(key), vector, stored_at=float(stored_at))
+        return len(self._entries)
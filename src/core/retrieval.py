@@ -1,8 +1,19 @@
 import os
+import time
+import atexit
+import threading
 import faiss
 import pickle
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from typing import NamedTuple
+
+from utils.doc_store import StringTable, IdArray, string_table_exists
+from core.query_cache import QueryEmbeddingCache
+from core.lexical import BM25Index, reciprocal_rank_fusion
+from core.patient_keys import PatientKeyIndex
+from core.encoder import ENCODER_BACKEND, load_encoder, encoder_id
+from core.vector_store import VectorStore, vectors_exist
+from utils.metrics import timer, record_retrieval, CACHE_EVENTS, STAGE_SECONDS
 
 # Config
 OUTPUT_DIR = "./embeddings/"
@@ -10,41 +21,388 @@ MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 FAISS_INDEX_FILE = os.path.join(OUTPUT_DIR, "ehr_faiss_index.faiss")
 MAPPING_FILE = os.path.join(OUTPUT_DIR, "doc_id_mapping.pkl")
 SUMMARY_FILE = os.path.join(OUTPUT_DIR, "summaries.pkl")
+DOC_ID_FILE = os.path.join(OUTPUT_DIR, "doc_ids.npy")
+SUMMARY_TABLE = os.path.join(OUTPUT_DIR, "summaries")
+LEXICAL_INDEX = os.path.join(OUTPUT_DIR, "bm25")
+PATIENT_KEYS_FILE = os.path.join(OUTPUT_DIR, "patient_keys.json")
+VECTOR_STORE = os.path.join(OUTPUT_DIR, "vectors")
+DEFAULT_BATCH_SIZE = int(os.getenv("RETRIEVAL_BATCH_SIZE", "64"))
+
+# Query-time knobs for approximate indexes (ignored by index types that lack them)
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+
+# Retrieval mode: vector | hybrid (BM25 + vectors fused with reciprocal rank fusion).
+# Hybrid falls back to vector search when no lexical index has been built.
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+HYBRID_OVERFETCH = int(os.getenv("HYBRID_OVERFETCH", "4"))
+RRF_K = 60
+
+# Query-embedding cache (size 0 disables it, TTL 0 means entries never expire)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "0"))
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH")  # e.g. ./embeddings/query_cache.npz
+
+# Read a FAISS index, memory-mapping it when the index type supports it
+def read_faiss_index(path, mmap=True):
+    if mmap:
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        try:
+            return faiss.read_index(path, flags)
+        except RuntimeError:
+            pass  # index type without mmap support: fall back to a full read
+    return faiss.read_index(path)
+
+# Apply nprobe (IVF) / efSearch (HNSW) to whichever of them the index understands
+def apply_search_params(index, nprobe=None, ef_search=None):
+    space = faiss.ParameterSpace()
+    applied = {}
+    for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+        if value is None:
+            continue
+        try:
+            space.set_index_parameter(index, name, value)
+            applied[name] = value
+        except RuntimeError:
+            pass
+    return applied
 
 # Load FAISS index and metadata
 def load_faiss_index():
-    index = faiss.read_index(FAISS_INDEX_FILE)
+    index = read_faiss_index(FAISS_INDEX_FILE)
+
+    # Memory-mapped layout written by utils.embedding.embed_and_save
+    if os.path.exists(DOC_ID_FILE) and string_table_exists(SUMMARY_TABLE):
+        return index, IdArray(DOC_ID_FILE), StringTable(SUMMARY_TABLE)
+
+    # Legacy pickled metadata
     with open(MAPPING_FILE, "rb") as f:
         doc_ids = pickle.load(f)
     with open(SUMMARY_FILE, "rb") as f:
         summaries = pickle.load(f)
     return index, doc_ids, summaries
 
-# Retrieve top-k similar chunks for a given query
-def retrieve_relevant_docs(query, k=5):
-    print("[INFO] Loading model and index...")
-    model = SentenceTransformer(MODEL_NAME)
-    index, doc_ids, summaries = load_faiss_index()
-
-    print("[INFO] Encoding query...")
-    query_vector = model.encode([query])
-    distances, indices = index.search(np.array(query_vector), k)
-
-    results = []
-    for i, idx in enumerate(indices[0]):
-        result = {
-            "rank": i + 1,
-            "patient_id": doc_ids[idx],
-            "summary": summaries[idx],
-            "score": float(distances[0][i])
+
+class RetrievalState(NamedTuple):
+    """Everything a query reads. Built in full before it is published, then never mutated."""
+    model: object
+    index: object
+    doc_ids: object
+    summaries: object
+    lexical: object
+    patient_keys: object
+    vectors: object
+
+def _state_field(name):
+    return property(lambda self: getattr(self._state, name) if self._state is not None else None)
+
+
+class Retriever:
+    """
+    Long-lived retrieval engine. The encoder, FAISS index, doc ids and summaries
+    are loaded once on first use and then served from memory. A single instance
+    is safe to share between threads: everything is loaded into one RetrievalState
+    that is published (and swapped by reload) in a single assignment, and each
+    query reads that snapshot once, so it never sees a half-loaded or mixed state.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH, mode=RETRIEVAL_MODE,
+                 encoder_backend=ENCODER_BACKEND):
+        self.model_name = model_name
+        self.encoder_backend = encoder_backend
+        self.mode = mode
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self._state = None
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._load_seconds = None
+        self._cold_query_seconds = None
+        self._warm_queries = 0
+        self._warm_query_seconds = 0.0
+        # Called after reload swaps in a new state, e.g. to drop caches built on the old one
+        self._reload_listeners = []
+        self.query_cache = QueryEmbeddingCache(
+            max_size=QUERY_CACHE_SIZE,
+            ttl_seconds=QUERY_CACHE_TTL,
+            persist_path=QUERY_CACHE_PATH,
+            # Cached vectors are only reused by the same encoder backend
+            model_name=encoder_id(model_name, encoder_backend),
+        )
+
+    @property
+    def loaded(self):
+        return self._state is not None
+
+    # Read-only views of the current snapshot (None until loaded), for callers outside a query
+    model = _state_field("model")
+    index = _state_field("index")
+    doc_ids = _state_field("doc_ids")
+    summaries = _state_field("summaries")
+    lexical = _state_field("lexical")
+    patient_keys = _state_field("patient_keys")
+    vectors = _state_field("vectors")
+
+    def _read_state(self, model=None):
+        """A new RetrievalState from disk, reusing `model` as the encoder when given."""
+        with timer("index_load"):
+            index, doc_ids, summaries = load_faiss_index()
+            apply_search_params(index, self.nprobe, self.ef_search)
+            lexical = BM25Index.load(LEXICAL_INDEX) if BM25Index.exists(LEXICAL_INDEX) else None
+            patient_keys = PatientKeyIndex.load(PATIENT_KEYS_FILE) if os.path.exists(PATIENT_KEYS_FILE) else None
+            vectors = VectorStore(VECTOR_STORE) if vectors_exist(VECTOR_STORE) else None
+        if model is None:
+            with timer("encoder_load"):
+                # sentence_transformers is imported here: it pulls in torch, which dominates import time
+                model = load_encoder(self.model_name, self.encoder_backend)
+        query_encoder = encoder_id(self.model_name, self.encoder_backend)
+        if vectors is not None and vectors.encoder not in (None, query_encoder):
+            print(f"[INFO] Index built with {vectors.encoder}, queries encoded with {query_encoder}")
+        return RetrievalState(model, index, doc_ids, summaries, lexical, patient_keys, vectors)
+
+    def load(self):
+        if self.loaded:
+            return self
+        with self._load_lock:
+            if not self.loaded:
+                start = time.perf_counter()
+                print("[INFO] Loading model and index...")
+                self.query_cache.load()
+                self._state = self._read_state()
+                self._load_seconds = time.perf_counter() - start
+        return self
+
+    def _snapshot(self):
+        state = self._state
+        return state if state is not None else self.load()._state
+
+    def reload(self):
+        """
+        Reads the index and metadata from disk again and swaps them in at once; queries
+        already running finish on the previous snapshot. The encoder is kept.
+        """
+        with self._load_lock:
+            current = self._state
+            self._state = self._read_state(current.model if current else None)
+        for listener in list(self._reload_listeners):
+            listener()
+        return self
+
+    def add_reload_listener(self, listener):
+        """Registers a no-argument callable to run after every reload."""
+        self._reload_listeners.append(listener)
+
+    def set_search_params(self, nprobe=None, ef_search=None):
+        """Changes nprobe / efSearch for subsequent queries. Returns the parameters the index accepted."""
+        with self._load_lock:
+            if nprobe is not None:
+                self.nprobe = nprobe
+            if ef_search is not None:
+                self.ef_search = ef_search
+            if self._state is None:
+                return {}
+            return apply_search_params(self._state.index, nprobe, ef_search)
+
+    def encode(self, queries, batch_size=DEFAULT_BATCH_SIZE):
+        """Query vectors for the given texts; only cache misses go through the encoder."""
+        return self._encode(self._snapshot().model, queries, batch_size)
+
+    def _encode(self, model, queries, batch_size=DEFAULT_BATCH_SIZE):
+        vectors = [self.query_cache.get(q) for q in queries]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        CACHE_EVENTS.inc(len(vectors) - len(missing), cache="query_embedding", result="hit")
+        if missing:
+            CACHE_EVENTS.inc(len(missing), cache="query_embedding", result="miss")
+            with timer("query_encode"):
+                encoded = model.encode([queries[i] for i in missing], batch_size=batch_size)
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+                self.query_cache.put(queries[i], vector)
+        return np.asarray(vectors, dtype="float32")
+
+    def reconstruct(self, rows):
+        """
+        Stored document vectors for the given metadata rows: from the vector store when
+        the build wrote one, else from the index (re-encoding summaries if it cannot reconstruct).
+        """
+        state = self._snapshot()
+        rows = [int(r) for r in rows]
+        if state.vectors is not None and (not rows or max(rows) < len(state.vectors)):
+            return state.vectors.get(rows)
+        try:
+            return np.stack([state.index.reconstruct(r) for r in rows]).astype("float32")
+        except RuntimeError:
+            return np.asarray(state.model.encode([state.summaries[r] for r in rows]), dtype="float32")
+
+    @staticmethod
+    def _make_result(state, rank, row, score, source, distance=None):
+        # score is an L2 distance for "vector" results, a BM25 score for "lexical"
+        # results, a reciprocal-rank-fusion score for "hybrid" results and 0 for
+        # "patient_lookup" results; distance is the L2 distance of rows the vector
+        # search returned (None for the others)
+        return {
+            "rank": rank,
+            "row": int(row),
+            "patient_id": state.doc_ids[row],
+            "summary": state.summaries[row],
+            "score": float(score),
+            "source": source,
+            "distance": float(distance) if distance is not None else None,
         }
-        results.append(result)
 
-    return results
+    def _to_results(self, state, distances, indices):
+        results = []
+        for i, idx in enumerate(indices):
+            if idx < 0:  # FAISS pads with -1 when fewer than k vectors exist
+                continue
+            results.append(self._make_result(state, len(results) + 1, idx, distances[i], "vector", distances[i]))
+        return results
+
+    def _use_lexical(self, state, mode):
+        return (mode or self.mode) == "hybrid" and state.lexical is not None
+
+    def _lexical_shortcut(self, state, query, k):
+        # Queries naming a rare term (a drug, a condition, a patient name) are answered
+        # straight from the posting lists of that term, without touching the vectors
+        rows = state.lexical.rare_term_rows(query, max_df=k)
+        if rows is None:
+            return None
+        hits = state.lexical.search(query, k, candidate_rows=rows)
+        return [self._make_result(state, rank + 1, row, score, "lexical") for rank, (row, score) in enumerate(hits)]
+
+    def _fuse(self, state, query, distances, indices, k):
+        vector_distances = {int(idx): distance for idx, distance in zip(indices, distances) if idx >= 0}
+        vector_rows = list(vector_distances)
+        lexical_rows = [row for row, _ in state.lexical.search(query, len(vector_rows) or k)]
+        fused = reciprocal_rank_fusion([vector_rows, lexical_rows], RRF_K)[:k]
+        return [self._make_result(state, rank + 1, row, score, "hybrid", vector_distances.get(row))
+                for rank, (row, score) in enumerate(fused)]
+
+    def _record_latency(self, seconds, cold):
+        STAGE_SECONDS.observe(seconds, stage="retrieval")
+        with self._stats_lock:
+            if cold:
+                self._cold_query_seconds = seconds
+            else:
+                self._warm_queries += 1
+                self._warm_query_seconds += seconds
+
+    def lookup_patient(self, query, k=5):
+        """Summaries of the patient(s) the query names by id or full name, or None if it names none."""
+        state = self._snapshot()
+        with timer("patient_lookup"):
+            rows = state.patient_keys.resolve(query) if state.patient_keys is not None else None
+        if not rows:
+            return None
+        results = [self._make_result(state, rank + 1, row, 0.0, "patient_lookup") for rank, row in enumerate(rows[:k])]
+        record_retrieval(results, "patient_lookup")
+        return results
+
+    def search(self, query, k=5, mode=None):
+        cold = not self.loaded
+        start = time.perf_counter()
+        state = self._snapshot()
+
+        hybrid = self._use_lexical(state, mode)
+        with timer("lexical_shortcut"):
+            results = self._lexical_shortcut(state, query, k) if hybrid else None
+        best_distance = None
+        if not results:
+            query_vector = self._encode(state.model, [query])
+            with timer("faiss_search"):
+                distances, indices = state.index.search(query_vector, k * HYBRID_OVERFETCH if hybrid else k)
+            best_distance = distances[0][0] if indices[0][0] >= 0 else None
+            if hybrid:
+                with timer("rrf_fuse"):
+                    results = self._fuse(state, query, distances[0], indices[0], k)
+            else:
+                results = self._to_results(state, distances[0], indices[0])
+
+        self._record_latency(time.perf_counter() - start, cold)
+        record_retrieval(results, results[0]["source"] if results else "none", best_distance)
+        return results
+
+    def search_batch(self, queries, k=5, batch_size=DEFAULT_BATCH_SIZE, mode=None):
+        """
+        Encodes all queries in one encoder call (batch_size rows per forward pass)
+        and runs a single FAISS search over the resulting matrix.
+        Returns one result list per query, in input order.
+        """
+        if not queries:
+            return []
+        queries = list(queries)
+        cold = not self.loaded
+        start = time.perf_counter()
+        state = self._snapshot()
+
+        hybrid = self._use_lexical(state, mode)
+        with timer("lexical_shortcut"):
+            results = [self._lexical_shortcut(state, q, k) if hybrid else None for q in queries]
+        pending = [i for i, res in enumerate(results) if not res]
+        best_distances = {}
+        if pending:
+            query_vectors = self._encode(state.model, [queries[i] for i in pending], batch_size=batch_size)
+            with timer("faiss_search_batch"):
+                distances, indices = state.index.search(query_vectors, k * HYBRID_OVERFETCH if hybrid else k)
+            for row, i in enumerate(pending):
+                if indices[row][0] >= 0:
+                    best_distances[i] = distances[row][0]
+                if hybrid:
+                    results[i] = self._fuse(state, queries[i], distances[row], indices[row], k)
+                else:
+                    results[i] = self._to_results(state, distances[row], indices[row])
+
+        self._record_latency(time.perf_counter() - start, cold)
+        for i, res in enumerate(results):
+            record_retrieval(res, res[0]["source"] if res else "none", best_distances.get(i))
+        return results
+
+    def stats(self):
+        """Cold (first call, including load) vs. warm (average of later calls) latency."""
+        with self._stats_lock:
+            warm_avg = self._warm_query_seconds / self._warm_queries if self._warm_queries else None
+            return {
+                "loaded": self.loaded,
+                "load_seconds": self._load_seconds,
+                "cold_query_seconds": self._cold_query_seconds,
+                "warm_queries": self._warm_queries,
+                "warm_query_avg_seconds": warm_avg,
+                "query_cache": self.query_cache.stats(),
+            }
+
+
+_retriever = None
+_retriever_lock = threading.Lock()
+
+# Process-wide retriever shared by the LangGraph agents and all core pipelines
+def get_retriever():
+    global _retriever
+    if _retriever is None:
+        with _retriever_lock:
+            if _retriever is None:
+                _retriever = Retriever()
+                atexit.register(_retriever.query_cache.save)
+    return _retriever
+
+# Retrieve top-k similar chunks for a given query
+def retrieve_relevant_docs(query, k=5, mode=None):
+    return get_retriever().search(query, k, mode=mode)
+
+# Direct fetch for queries that name a known patient id or name (None otherwise)
+def lookup_patient(query, k=5):
+    return get_retriever().lookup_patient(query, k)
+
+# Retrieve top-k similar chunks for many queries at once (one result list per query)
+def retrieve_relevant_docs_batch(queries, k=5, batch_size=DEFAULT_BATCH_SIZE, mode=None):
+    return get_retriever().search_batch(queries, k, batch_size=batch_size, mode=mode)
 
 # Test in isolation
 if __name__ == "__main__":
-    user_query = input("Enter your query: ")
-    results = retrieve_relevant_docs(user_query)
-    for res in results:
-        print(f"\nRank #{res['rank']}\nPatient ID: {res['patient_id']}\nSummary: {res['summary']}\nScore: {res['score']:.4f}")
\ No newline at end of file
+    while True:
+        user_query = input("Enter your query (blank to quit): ")
+        if not user_query:
+            break
+        results = retrieve_relevant_docs(user_query)
+        for res in results:
+            print(f"\nRank #{res['rank']}\nPatient ID: {res['patient_id']}\nSummary: {res['summary']}\nScore: {res['score']:.4f}")
+        print(f"\n[STATS] {get_retriever().stats()}")
@@ -0,0 +1,112 @@
+# core/vector_store.py
+#
+# Compressed copy of the corpus embeddings, one row per metadata row:
+#   <name>.npy   float32, float16 or int8 matrix (memory-mapped on read)
+#   <name>.json  storage type, shape, the encoder that produced the vectors and,
+#                for int8, the per-dimension scales (vector = int8 * scale)
+# int8 uses symmetric per-dimension scales, so dequantizing is one multiply. The
+# store lets reranking and index rebuilds read document vectors without asking
+# a lossy FAISS index to reconstruct them, or re-encoding the summaries.
+
+import os
+import json
+
+import numpy as np
+
+STORAGE_TYPES = ("float32", "float16", "int8")
+# Storage type of the vectors written by index builds (float32 keeps them exact)
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float16")
+
+
+def int8_scale(max_abs):
+    """Per-dimension scales from the largest absolute value of each dimension."""
+    scale = np.asarray(max_abs, dtype="float32") / 127.0
+    return np.where(scale > 0, scale, 1.0).astype("float32")
+
+def quantize(vectors, storage, scale=None):
+    """(stored matrix, per-dimension scales or None) for float32 `vectors`; int8 derives `scale` unless given."""
+    vectors = np.asarray(vectors, dtype="float32")
+    if storage == "float32":
+        return vectors, None
+    if storage == "float16":
+        return vectors.astype("float16"), None
+    if storage == "int8":
+        if scale is None:
+            scale = int8_scale(np.abs(vectors).max(axis=0) if len(vectors) else np.zeros(vectors.shape[1]))
+        return np.clip(np.rint(vectors / scale), -127, 127).astype("int8"), scale
+    raise ValueError(f"Unknown embedding storage '{storage}', expected one of {STORAGE_TYPES}")
+
+def dequantize(stored, scale=None):
+    stored = np.asarray(stored)
+    if scale is not None:
+        return stored.astype("float32") * scale
+    return stored.astype("float32")
+
+def _write_meta(path_prefix, storage, count, dim, encoder, scale):
+    meta = {
+        "storage": storage,
+        "count": int(count),
+        "dim": int(dim),
+        "encoder": encoder,
+        "scale": scale.tolist() if scale is not None else None,
+    }
+    with open(f"{path_prefix}.json.tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(f"{path_prefix}.npy.tmp", f"{path_prefix}.npy")
+    os.replace(f"{path_prefix}.json.tmp", f"{path_prefix}.json")
+    return meta
+
+def write_vectors(path_prefix, vectors, storage=EMBEDDING_STORAGE, encoder=None):
+    stored, scale = quantize(vectors, storage)
+    with open(f"{path_prefix}.npy.tmp", "wb") as f:
+        np.save(f, stored)
+    return _write_meta(path_prefix, storage, stored.shape[0], stored.shape[1] if stored.ndim == 2 else 0, encoder, scale)
+
+def write_vector_chunks(path_prefix, chunks, count, dim, storage=EMBEDDING_STORAGE, encoder=None, max_abs=None):
+    """
+    Streams float32 chunks (in row order, `count` rows in total) into a store without
+    holding the whole matrix; int8 needs the per-dimension `max_abs` of all chunks up front.
+    """
+    if storage == "int8" and max_abs is None:
+        raise ValueError("int8 storage needs max_abs to quantize chunk by chunk")
+    scale = int8_scale(max_abs) if storage == "int8" else None
+    out = np.lib.format.open_memmap(f"{path_prefix}.npy.tmp", mode="w+", dtype=storage, shape=(count, dim))
+    row = 0
+    for chunk in chunks:
+        stored, _ = quantize(chunk, storage, scale)
+        out[row:row + len(stored)] = stored
+        row += len(stored)
+    if row != count:
+        raise ValueError(f"Expected {count} vectors, got {row}")
+    out.flush()
+    del out
+    return _write_meta(path_prefix, storage, count, dim, encoder, scale)
+
+def vectors_exist(path_prefix):
+    return os.path.exists(f"{path_prefix}.npy") and os.path.exists(f"{path_prefix}.json")
+
+
+class VectorStore:
+    """Read-only, memory-mapped view over vectors written by write_vectors; rows come back as float32."""
+
+    def __init__(self, path_prefix):
+        self.path_prefix = path_prefix
+        with open(f"{path_prefix}.json") as f:
+            self.meta = json.load(f)
+        self.storage = self.meta["storage"]
+        self.encoder = self.meta.get("encoder")
+        self.scale = np.asarray(self.meta["scale"], dtype="float32") if self.meta.get("scale") else None
+        self._data = np.load(f"{path_prefix}.npy", mmap_mode="r")
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes
+
+    def get(self, rows):
+        return dequantize(self._data[np.asarray(rows, dtype="int64")], self.scale)
+
+    def all(self):
+        return dequantize(self._data, self.scale)
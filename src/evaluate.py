@@ -1,53 +1,259 @@
-import mlflow
-import pandas as pd
-from transformers import pipeline, AutoModelForSeq2SeqLM, AutoTokenizer
-from mlflow.models.signature import infer_signature
-
-mlflow.set_tracking_uri("http://127.0.0.1:5000")
-
-# Load your model
-model_path = "./models/finetuned_model/flan-t5-small/"  # or your fine-tuned path
-tokenizer = AutoTokenizer.from_pretrained(model_path, token=False)
-model = AutoModelForSeq2SeqLM.from_pretrained(model_path, token=False)
-
-# Wrap it into a pipeline
-qa_pipeline = pipeline("text2text-generation", model=model, tokenizer=tokenizer)
-
-# Sample QA dataset
-eval_data = pd.DataFrame({
-    "inputs": [
-        "What medications has the patient been prescribed?\n\nPatient: John, Age: 60, Gender: M.\nConditions: Diabetes.\nEncounters: Check-up.\nMedications: Metformin, Lisinopril",
-        "What medications has the patient been prescribed?\n\nPatient: Sarah, Age: 70, Gender: F.\nConditions: Hypertension.\nEncounters: Emergency room.\nMedications: Amlodipine, Aspirin"
-    ],
-    "ground_truth": [
-        "Metformin, Lisinopril",
-        "Amlodipine, Aspirin"
-    ]
-})
-
-# Start an MLflow run
-with mlflow.start_run() as run:
-    
-    inputs = "What medications has the patient been prescribed?\n\nPatient: ... "
-    preds = qa_pipeline(inputs)
-    signature = infer_signature([inputs], [preds[0]["generated_text"]])
-    
-    # Log your model
-    logged_model_info = mlflow.transformers.log_model(
-        transformers_model=qa_pipeline,
-        artifact_path="model",
-        input_example={"inputs": eval_data["inputs"].iloc[0]},
-        task="text2text-generation",
-        metadata={"source": "local", "note": "custom finetuned model", "license": "apache-2.0"}
-    )
+# evaluate.py
+#
+# Offline evaluation of the local model pipelines (core.pipeline_seq2seq,
+# core.pipeline_qa, core.pipeline_llm) over a question set, using their batched
+# run_pipeline_batch. Reports exact match / token F1 / retrieval hit rate next to
+# throughput and per-stage latency, and logs the run to MLflow. The model itself is
+# logged once per content hash; later runs on the same weights reuse that model.
+#   python src/evaluate.py --pipeline seq2seq --data data/finetune/ehr_squad_format.json --limit 200
+#   python src/evaluate.py --pipeline qa --data questions.parquet --batch-size 16 --no-mlflow
+
+import os
+import re
+import json
+import time
+import string
+import hashlib
+import argparse
+import importlib
+from collections import Counter
+
+from utils.mlflow_logger import configure_mlflow, MLFLOW_TRACKING_URI
+
+EVAL_EXPERIMENT = "MedChatGuard-Evaluation"
+MODEL_HASH_TAG = "model_content_hash"
+
+PIPELINES = {
+    "seq2seq": "core.pipeline_seq2seq",
+    "qa": "core.pipeline_qa",
+    "llm": "core.pipeline_llm",
+}
+
+# === QUESTION SETS ===
+
+def load_squad(path):
+    """SQuAD-style JSON (e.g. utils/prepare_data.py's ehr_squad_format.json). The patient
+    name (article title) is prefixed to each question so retrieval can find the record."""
+    with open(path) as f:
+        articles = json.load(f)["data"]
+    questions = []
+    for article in articles:
+        for paragraph in article["paragraphs"]:
+            for qa in paragraph["qas"]:
+                questions.append({
+                    "question": f"{article['title']}: {qa['question']}",
+                    "answers": [answer["text"] for answer in qa["answers"]],
+                    "patient_id": qa.get("id"),
+                })
+    return questions
+
+def load_table(path, question_field="question", answer_field="answer"):
+    """JSONL or Parquet rows with a question, an answer (string or list) and optionally a patient_id."""
+    if path.endswith(".parquet"):
+        import pandas as pd
+        rows = pd.read_parquet(path).to_dict("records")
+    else:
+        with open(path) as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    questions = []
+    for row in rows:
+        answers = row.get(answer_field, row.get("ground_truth", ""))
+        answers = list(answers) if isinstance(answers, (list, tuple)) or hasattr(answers, "tolist") else [answers]
+        questions.append({
+            "question": row[question_field],
+            "answers": [str(answer) for answer in answers],
+            "patient_id": row.get("patient_id"),
+        })
+    return questions
+
+def load_questions(path, limit=None, question_field="question", answer_field="answer"):
+    if path.endswith(".json"):
+        questions = load_squad(path)
+    else:
+        questions = load_table(path, question_field, answer_field)
+    return questions[:limit] if limit else questions
+
+# === METRICS (SQuAD normalization) ===
+
+PUNCTUATION = set(string.punctuation)
+
+def normalize_answer(text):
+    text = str(text).lower()
+    text = "".join(ch for ch in text if ch not in PUNCTUATION)
+    text = re.sub(r"\b(a|an|the)\b", " ", text)
+    return " ".join(text.split())
+
+def exact_match(prediction, answers):
+    return float(any(normalize_answer(prediction) == normalize_answer(answer) for answer in answers))
+
+def token_f1(prediction, answers):
+    best = 0.0
+    predicted = normalize_answer(prediction).split()
+    for answer in answers:
+        expected = normalize_answer(answer).split()
+        common = sum((Counter(predicted) & Counter(expected)).values())
+        if common:
+            precision, recall = common / len(predicted), common / len(expected)
+            best = max(best, 2 * precision * recall / (precision + recall))
+    return best
 
-    # Evaluate the logged model
-    results = mlflow.evaluate(
-        model=logged_model_info.model_uri,
-        data=eval_data,
-        targets="ground_truth",
-        model_type="question-answering",
+# === MODEL IDENTITY ===
+
+def model_content_hash(model_dir):
+    """sha256 over every file (relative path and bytes) in a model directory."""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(model_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, model_dir).encode("utf-8"))
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+    return digest.hexdigest()
+
+def find_logged_model(client, experiment_id, content_hash):
+    runs = client.search_runs(
+        [experiment_id],
+        filter_string=f"tags.{MODEL_HASH_TAG} = '{content_hash}'",
+        order_by=["attributes.start_time DESC"],
+        max_results=1,
     )
+    return f"runs:/{runs[0].info.run_id}/model" if runs else None
+
+def ensure_logged_model(mlflow, experiment_id, module, content_hash):
+    """Model URI for these weights, logging the model only if no run carries its hash yet."""
+    model_uri = find_logged_model(mlflow.tracking.MlflowClient(), experiment_id, content_hash)
+    if model_uri:
+        print(f"[INFO] Reusing logged model {model_uri} ({content_hash[:12]})")
+        return model_uri
+
+    print(f"[INFO] Logging model {module.model_path} ({content_hash[:12]})...")
+    loaded = module.load_pipeline()
+    with mlflow.start_run(run_name=f"model_{content_hash[:12]}", experiment_id=experiment_id):
+        mlflow.set_tag(MODEL_HASH_TAG, content_hash)
+        info = mlflow.transformers.log_model(
+            transformers_model=getattr(loaded, "pipeline", loaded),  # unwrap HuggingFacePipeline
+            artifact_path="model",
+            task=module.TASK,
+            metadata={"source": "local", "model_path": module.model_path},
+        )
+    return info.model_uri
+
+# === EVALUATION ===
+
+def evaluate(pipeline_name, questions, batch_size=8, chunk_size=256):
+    module = importlib.import_module(PIPELINES[pipeline_name])
+    timings = {}
+    rows = []
+
+    start = time.perf_counter()
+    for i in range(0, len(questions), chunk_size):
+        chunk = questions[i:i + chunk_size]
+        outputs = module.run_pipeline_batch([q["question"] for q in chunk], batch_size=batch_size, timings=timings)
+        for question, (response, _, chunks, guardrails) in zip(chunk, outputs):
+            retrieved_ids = [c["patient_id"] for c in chunks]
+            rows.append({
+                "question": question["question"],
+                "answers": question["answers"],
+                "prediction": response,
+                "exact_match": exact_match(response, question["answers"]),
+                "f1": token_f1(response, question["answers"]),
+                "retrieval_hit": float(question["patient_id"] in retrieved_ids) if question.get("patient_id") else None,
+                "safe_to_use": guardrails["safe_to_use"],
+            })
+        print(f"[INFO] {len(rows)}/{len(questions)} questions evaluated")
+    elapsed = time.perf_counter() - start
+
+    n = len(rows)
+    hits = [row["retrieval_hit"] for row in rows if row["retrieval_hit"] is not None]
+    # Throughput excludes the one-off model load
+    serving_seconds = elapsed - timings.get("model_load", 0.0)
+    metrics = {
+        "exact_match": sum(row["exact_match"] for row in rows) / n if n else 0.0,
+        "f1": sum(row["f1"] for row in rows) / n if n else 0.0,
+        "guardrail_pass_rate": sum(row["safe_to_use"] for row in rows) / n if n else 0.0,
+        "questions_per_second": n / serving_seconds if serving_seconds > 0 else 0.0,
+        "total_seconds": elapsed,
+    }
+    if hits:
+        metrics["retrieval_hit_rate"] = sum(hits) / len(hits)
+    for stage, seconds in timings.items():
+        metrics[f"{stage}_seconds"] = seconds
+        if stage != "model_load":
+            metrics[f"{stage}_ms_per_question"] = seconds * 1000.0 / n if n else 0.0
+
+    return module, metrics, rows
+
+def log_to_mlflow(module, args, metrics, rows, log_model=True):
+    mlflow = configure_mlflow()
+    experiment_id = mlflow.set_experiment(EVAL_EXPERIMENT).experiment_id
+    content_hash = model_content_hash(module.model_path)
+    backend = getattr(module, "INFERENCE_BACKEND", "fp32")
+    if log_model and backend != "fp32":
+        # The logged model is the checkpoint itself; int8/onnx models are derived from it at load time
+        print(f"[WARN] Not logging the model for inference backend '{backend}'")
+        log_model = False
+    model_uri = ensure_logged_model(mlflow, experiment_id, module, content_hash) if log_model else None
+
+    with mlflow.start_run(run_name=f"eval_{args.pipeline}_{time.strftime('%Y%m%d_%H%M%S')}", experiment_id=experiment_id):
+        # Not MODEL_HASH_TAG: that tag marks the run holding the logged model
+        mlflow.set_tags({"evaluated_model_hash": content_hash, "model_uri": model_uri or ""})
+        mlflow.log_params({
+            "pipeline": args.pipeline,
+            "data": args.data,
+            "num_questions": len(rows),
+            "batch_size": args.batch_size,
+            "model_path": module.model_path,
+            "inference_backend": backend,
+        })
+        mlflow.log_metrics(metrics)
+        mlflow.log_dict({"metrics": metrics, "rows": rows}, "eval_results.json")
+    print(f"[DONE] Evaluation logged to {MLFLOW_TRACKING_URI} (experiment '{EVAL_EXPERIMENT}')")
+
+def print_report(metrics):
+    print("\n=== Accuracy ===")
+    for key in ("exact_match", "f1", "retrieval_hit_rate", "guardrail_pass_rate"):
+        if key in metrics:
+            print(f"{key}: {metrics[key]:.4f}")
+    print("\n=== Throughput ===")
+    print(f"questions_per_second: {metrics['questions_per_second']:.2f}")
+    print(f"total_seconds: {metrics['total_seconds']:.2f}")
+    print("\n=== Per-stage latency ===")
+    for key, value in metrics.items():
+        if key.endswith("_ms_per_question"):
+            print(f"{key[:-len('_ms_per_question')]:<12} {value:10.2f} ms/question")
+    if "model_load_seconds" in metrics:
+        print(f"{'model_load':<12} {metrics['model_load_seconds']:10.2f} s (once)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batched offline evaluation of the local model pipelines")
+    parser.add_argument("--pipeline", choices=list(PIPELINES), default="seq2seq")
+    parser.add_argument("--data", default="./data/finetune/ehr_squad_format.json",
+                        help="SQuAD-style .json, .jsonl or .parquet question set")
+    parser.add_argument("--question-field", default="question")
+    parser.add_argument("--answer-field", default="answer")
+    parser.add_argument("--limit", type=int, help="Evaluate only the first N questions")
+    parser.add_argument("--batch-size", type=int, default=8, help="Prompts per generation forward pass")
+    parser.add_argument("--chunk-size", type=int, default=256, help="Questions per run_pipeline_batch call")
+    parser.add_argument("--output", help="Write per-question results to this JSONL file")
+    parser.add_argument("--no-mlflow", action="store_true", help="Skip MLflow logging")
+    parser.add_argument("--skip-model-log", action="store_true", help="Log metrics without logging the model")
+    args = parser.parse_args()
+
+    questions = load_questions(args.data, args.limit, args.question_field, args.answer_field)
+    print(f"[INFO] Loaded {len(questions)} questions from {args.data}")
+    module, metrics, rows = evaluate(args.pipeline, questions, args.batch_size, args.chunk_size)
+    print_report(metrics)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+        print(f"\n[INFO] Per-question results written to {args.output}")
 
-    print("🔍 Evaluation metrics:\n", results.metrics)
-    print("📋 Evaluation table:\n", results.tables["eval_results_table"])
\ No newline at end of file
+    if not args.no_mlflow:
+        log_to_mlflow(module, args, metrics, rows, log_model=not args.skip_model_log)
+        print("[MLflow] Evaluation logged.")
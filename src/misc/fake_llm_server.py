@@ -0,0 +1,118 @@
+# misc/fake_llm_server.py
+#
+# Local stand-in for the Groq chat-completions API, for exercising the shared LLM
+# client (rate limiting, retries, streaming) without a network or an API key.
+#   python src/misc/fake_llm_server.py --port 8001 --latency-ms 400 --error-rate 0.1
+#   GROQ_BASE_URL=http://127.0.0.1:8001 GROQ_API_KEY=fake streamlit run src/app.py
+
+import json
+import time
+import random
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHAT_PATH = "/openai/v1/chat/completions"
+
+# Deterministic replies shaped like what each caller parses
+def fake_reply(prompt):
+    if "Rank the following summaries" in prompt:
+        return "[1]\n[2]\n[3]"
+    if "medical reviewer" in prompt:
+        return "The response is grounded in the patient record. Approved."
+    return "- The patient record lists the requested information."
+
+
+def make_handler(latency_ms, jitter, error_rate, seed):
+    rng = random.Random(seed)
+
+    class FakeChatHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.path != CHAT_PATH:
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+            if rng.random() < error_rate:
+                self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit_exceeded"}}, {"retry-after": "0.2"})
+                return
+
+            time.sleep(max(0.0, rng.gauss(latency_ms, latency_ms * jitter)) / 1000.0)
+            prompt = "\n".join(str(m.get("content", "")) for m in request.get("messages", []))
+            reply = fake_reply(prompt)
+            usage = {
+                "prompt_tokens": max(1, len(prompt) // 4),
+                "completion_tokens": max(1, len(reply) // 4),
+            }
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            base = {"id": f"fake-{time.time_ns()}", "created": int(time.time()), "model": request.get("model", "fake")}
+
+            if request.get("stream"):
+                self._stream(base, reply, usage)
+                return
+
+            self._send_json(200, {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        def _stream(self, base, reply, usage):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            words = reply.split(" ")
+            for i, word in enumerate(words):
+                delta = {"content": word if i == 0 else " " + word}
+                if i == 0:
+                    delta["role"] = "assistant"
+                chunk = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            final = {
+                **base,
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                "x_groq": {"usage": usage},
+            }
+            self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+            self.wfile.flush()
+            self.close_connection = True
+
+    return FakeChatHandler
+
+def serve(port=8001, latency_ms=300.0, jitter=0.2, error_rate=0.0, seed=42):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency_ms, jitter, error_rate, seed))
+    server.daemon_threads = True
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Groq-compatible chat completions server")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency standard deviation as a fraction of the mean")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 429")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.latency_ms, args.jitter, args.error_rate)
+    print(f"[INFO] Fake LLM server listening on http://127.0.0.1:{args.port}{CHAT_PATH}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,99 @@
+# utils/doc_store.py
+#
+# Pickle-free, memory-mapped storage for the retrieval metadata.
+#   <name>.bin          UTF-8 bytes of every string, back to back
+#   <name>.offsets.npy  int64 offsets, len(strings) + 1 entries
+#   doc_ids.npy         fixed-width byte-string array (one row per vector)
+# Readers map the files lazily and only decode the rows they are asked for,
+# so several worker processes share one copy through the OS page cache.
+
+import os
+import numpy as np
+
+# Write strings as a packed offset + bytes table
+def write_string_table(path_prefix, strings):
+    bin_path = f"{path_prefix}.bin"
+    offsets_path = f"{path_prefix}.offsets.npy"
+
+    offsets = [0]
+    with open(bin_path + ".tmp", "wb") as f:
+        for text in strings:
+            data = text.encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+
+    with open(offsets_path + ".tmp", "wb") as f:
+        np.save(f, np.asarray(offsets, dtype=np.int64))
+
+    os.replace(bin_path + ".tmp", bin_path)
+    os.replace(offsets_path + ".tmp", offsets_path)
+
+def string_table_exists(path_prefix):
+    return os.path.exists(f"{path_prefix}.bin") and os.path.exists(f"{path_prefix}.offsets.npy")
+
+
+class StringTable:
+    """Read-only, lazily memory-mapped view over a table written by write_string_table."""
+
+    def __init__(self, path_prefix):
+        self.path_prefix = path_prefix
+        self._offsets = None
+        self._data = None
+
+    def _open(self):
+        if self._offsets is None:
+            self._offsets = np.load(f"{self.path_prefix}.offsets.npy", mmap_mode="r")
+            # np.memmap cannot map an empty file
+            if self._offsets[-1] > 0:
+                self._data = np.memmap(f"{self.path_prefix}.bin", dtype=np.uint8, mode="r")
+            else:
+                self._data = np.zeros(0, dtype=np.uint8)
+        return self._offsets, self._data
+
+    def __len__(self):
+        offsets, _ = self._open()
+        return len(offsets) - 1
+
+    def __getitem__(self, idx):
+        offsets, data = self._open()
+        idx = int(idx)
+        if idx < 0:
+            idx += len(offsets) - 1
+        if not 0 <= idx < len(offsets) - 1:
+            raise IndexError(idx)
+        return bytes(data[offsets[idx]:offsets[idx + 1]]).decode("utf-8")
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+# Write ids as a fixed-width byte-string array
+def write_id_array(path, ids):
+    ids = [str(i).encode("utf-8") for i in ids]
+    width = max((len(i) for i in ids), default=1)
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, np.asarray(ids, dtype=f"S{width}"))
+    os.replace(path + ".tmp", path)
+
+
+class IdArray:
+    """Read-only, lazily memory-mapped view over an array written by write_id_array."""
+
+    def __init__(self, path):
+        self.path = path
+        self._ids = None
+
+    def _open(self):
+        if self._ids is None:
+            self._ids = np.load(self.path, mmap_mode="r")
+        return self._ids
+
+    def __len__(self):
+        return len(self._open())
+
+    def __getitem__(self, idx):
+        return self._open()[int(idx)].decode("utf-8")
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
@@ -1,9 +1,17 @@
 import os
 import pandas as pd
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import faiss
 import pickle
+import argparse
+import hashlib
+import json
+
+from utils.doc_store import write_string_table, write_id_array, StringTable, IdArray
+from core.lexical import BM25Index
+from core.patient_keys import build_patient_keys, save_patient_keys
+from core.encoder import load_encoder as _load_encoder, encoder_id
+from core.vector_store import STORAGE_TYPES, EMBEDDING_STORAGE, VectorStore, write_vectors, vectors_exist
 
 # Configurations
 DATA_DIR = "./data/rag_docs/"
@@ -11,7 +19,22 @@ OUTPUT_DIR = "./embeddings/"
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 FAISS_INDEX_FILE = os.path.join(OUTPUT_DIR, "ehr_faiss_index.faiss")
 MAPPING_FILE = os.path.join(OUTPUT_DIR, "doc_id_mapping.pkl")
-SUMMARY_FILE = os.path.join(OUTPUT_DIR, "summaries.pkl")
+SUMMARY_FILE = os.path.join(OUTPUT_DIR, "summaries.pkl")  # legacy, read-only
+DOC_ID_FILE = os.path.join(OUTPUT_DIR, "doc_ids.npy")
+SUMMARY_TABLE = os.path.join(OUTPUT_DIR, "summaries")
+MANIFEST_FILE = os.path.join(OUTPUT_DIR, "manifest.json")
+LEXICAL_INDEX = os.path.join(OUTPUT_DIR, "bm25")
+PATIENT_KEYS_FILE = os.path.join(OUTPUT_DIR, "patient_keys.json")
+VECTOR_STORE = os.path.join(OUTPUT_DIR, "vectors")  # compressed copy of the embeddings, see core/vector_store.py
+
+# Index type: flat | ivf_flat | ivf_pq | hnsw | sq_fp16 | sq_int8
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq_fp16", "sq_int8")
+INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+TRAIN_SAMPLE_SIZE = int(os.getenv("FAISS_TRAIN_SAMPLE_SIZE", "50000"))
+HNSW_M = 32
+PQ_SUBQUANTIZERS = 48  # must divide the embedding dimension (384 for MiniLM)
+# Incremental updates rebuild from scratch once rows freed by deletions exceed this share of the index
+COMPACT_THRESHOLD = float(os.getenv("FAISS_COMPACT_THRESHOLD", "0.25"))
 
 # Load CSVs from Synthea
 def load_synthea_data():
@@ -56,33 +79,268 @@ def build_patient_summaries(patients, conditions, medications, encounters):
 
     return summaries, doc_ids
 
+# Map an index type to a FAISS factory string sized for the corpus
+# Centroid counts are bounded by num_train, the number of vectors the index is trained
+# on (all of them unless given)
+def index_factory_string(index_type, dim, num_vectors, num_train=None):
+    num_train = num_vectors if num_train is None else num_train
+    # FAISS wants ~39 training points per IVF centroid
+    nlist = max(1, min(int(4 * np.sqrt(num_vectors)), num_train // 39))
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    if index_type == "ivf_pq":
+        m = PQ_SUBQUANTIZERS if dim % PQ_SUBQUANTIZERS == 0 else dim // 8
+        # 2**nbits centroids per sub-quantizer, again ~39 training points each
+        nbits = int(min(8, max(4, np.floor(np.log2(max(num_train, 1) / 39)))))
+        return f"IVF{nlist},PQ{m}x{nbits}"
+    if index_type == "hnsw":
+        return f"HNSW{HNSW_M}"
+    if index_type == "sq_fp16":
+        return "SQfp16"
+    if index_type == "sq_int8":
+        return "SQ8"
+    raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+# Empty ID-mapped index of the given type for num_vectors vectors. Index types that
+# need training call sample(size) for at most TRAIN_SAMPLE_SIZE training vectors.
+def create_faiss_index(index_type, dim, num_vectors, sample):
+    num_train = min(num_vectors, TRAIN_SAMPLE_SIZE)
+    factory = index_factory_string(index_type, dim, num_vectors, num_train)
+    index = faiss.index_factory(dim, f"IDMap2,{factory}", faiss.METRIC_L2)
+    if not index.is_trained:
+        train = np.ascontiguousarray(sample(num_train), dtype="float32")
+        print(f"[INFO] Training {factory} index on {len(train)} vectors...")
+        index.train(train)
+    return index
+
+# Build (and train on a sample, if needed) a FAISS index of the given type.
+# The index is ID-mapped: each vector's label is its row in the metadata tables,
+# so rows can later be removed or replaced in place.
+def build_faiss_index(embeddings, index_type=INDEX_TYPE, ids=None, seed=42):
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    num_vectors, dim = embeddings.shape
+    rng = np.random.default_rng(seed)
+    index = create_faiss_index(
+        index_type, dim, num_vectors,
+        lambda size: embeddings[rng.choice(num_vectors, size, replace=False)],
+    )
+
+    if ids is None:
+        ids = np.arange(num_vectors)
+    index.add_with_ids(embeddings, np.asarray(ids, dtype="int64"))
+    return index
+
+def write_faiss_index(index):
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    faiss.write_index(index, FAISS_INDEX_FILE + ".tmp")
+    os.replace(FAISS_INDEX_FILE + ".tmp", FAISS_INDEX_FILE)
+
+def content_hash(summary):
+    return hashlib.sha256(summary.encode("utf-8")).hexdigest()
+
+# Manifest: per-patient metadata row and summary hash, used by incremental builds
+def write_manifest(rows, hashes, index_type, next_row, storage=EMBEDDING_STORAGE):
+    manifest = {
+        "model": MODEL_NAME,
+        "encoder": encoder_id(MODEL_NAME),
+        "embedding_storage": storage,
+        "index_type": index_type,
+        "next_row": next_row,
+        "patients": {pid: [rows[pid], hashes[pid]] for pid in rows},
+    }
+    with open(MANIFEST_FILE + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(MANIFEST_FILE + ".tmp", MANIFEST_FILE)
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return None
+    with open(MANIFEST_FILE) as f:
+        return json.load(f)
+
+# Backend from ENCODER_BACKEND (torch | onnx | onnx_int8), see core/encoder.py
+def load_encoder():
+    return _load_encoder(MODEL_NAME)
+
+def save_vectors(embeddings, storage):
+    meta = write_vectors(VECTOR_STORE, embeddings, storage, encoder_id(MODEL_NAME))
+    print(f"[DONE] {meta['count']} vectors saved to {VECTOR_STORE}.npy ({storage})")
+
 # Generate embeddings and save FAISS index
-def embed_and_save(summaries, doc_ids):
+def embed_and_save(summaries, doc_ids, index_type=INDEX_TYPE, storage=EMBEDDING_STORAGE):
     print("[INFO] Loading model...")
-    model = SentenceTransformer(MODEL_NAME)
+    model = load_encoder()
 
     print("[INFO] Encoding summaries...")
     embeddings = model.encode(summaries, show_progress_bar=True)
 
-    print("[INFO] Creating FAISS index...")
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(np.array(embeddings))
+    print(f"[INFO] Creating FAISS index ({index_type})...")
+    index = build_faiss_index(embeddings, index_type)
+
+    write_faiss_index(index)
+    save_vectors(embeddings, storage)
+    save_metadata(summaries, doc_ids)
+    write_manifest(
+        {pid: row for row, pid in enumerate(doc_ids)},
+        {pid: content_hash(summary) for pid, summary in zip(doc_ids, summaries)},
+        index_type,
+        len(doc_ids),
+        storage,
+    )
+
+    print(f"[DONE] FAISS index saved to {FAISS_INDEX_FILE}")
+    return {"reused": 0, "added": len(doc_ids), "changed": 0, "deleted": 0}
+
+# Re-encode only new or changed patients and update the existing index in place.
+# Falls back to a full build when there is no compatible previous build of the
+# requested index type, or to compact away rows freed by deletions.
+def embed_incremental(summaries, doc_ids, index_type=INDEX_TYPE, storage=EMBEDDING_STORAGE):
+    manifest = load_manifest()
+    # Vectors from another encoder backend are close but not identical, so they are not mixed in one build
+    if (manifest is None or manifest["model"] != MODEL_NAME or not os.path.exists(FAISS_INDEX_FILE)
+            or manifest.get("encoder", MODEL_NAME) != encoder_id(MODEL_NAME)):
+        print("[INFO] No compatible previous build found, running a full build...")
+        return embed_and_save(summaries, doc_ids, index_type, storage)
 
+    if manifest["index_type"] != index_type:
+        print(f"[INFO] Previous build is a '{manifest['index_type']}' index, running a full '{index_type}' build...")
+        return embed_and_save(summaries, doc_ids, index_type, storage)
+
+    index = faiss.read_index(FAISS_INDEX_FILE)
+    if not isinstance(faiss.downcast_index(index), (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        print("[INFO] Existing index is not ID-mapped, running a full build...")
+        return embed_and_save(summaries, doc_ids, index_type, storage)
+
+    previous = manifest["patients"]
+    hashes = {pid: content_hash(summary) for pid, summary in zip(doc_ids, summaries)}
+    summary_by_id = dict(zip(doc_ids, summaries))
+
+    deleted = [pid for pid in previous if pid not in hashes]
+    changed = [pid for pid in doc_ids if pid in previous and previous[pid][1] != hashes[pid]]
+    added = [pid for pid in doc_ids if pid not in previous]
+    reused = len(doc_ids) - len(changed) - len(added)
+    if not (deleted or changed or added):
+        report = {"reused": reused, "added": 0, "changed": 0, "deleted": 0}
+        print(f"[DONE] Index is up to date: {report}")
+        return report
+
+    # Changed patients keep their row; new patients fill rows freed by deletions first
+    rows = {pid: previous[pid][0] for pid in doc_ids if pid in previous}
+    free_rows = sorted(set(range(manifest["next_row"])) - set(rows.values()))
+    next_row = manifest["next_row"]
+    for pid in added:
+        if free_rows:
+            rows[pid] = free_rows.pop(0)
+        else:
+            rows[pid] = next_row
+            next_row += 1
+
+    if next_row and len(free_rows) / next_row > COMPACT_THRESHOLD:
+        print(f"[INFO] {len(free_rows)} of {next_row} rows would be empty, running a full build to compact the index...")
+        return embed_and_save(summaries, doc_ids, index_type, storage)
+
+    stale_rows = [previous[pid][0] for pid in deleted + changed]
+    if stale_rows:
+        try:
+            index.remove_ids(np.asarray(stale_rows, dtype="int64"))
+        except RuntimeError:
+            print(f"[INFO] Index type '{manifest['index_type']}' cannot remove vectors, running a full build...")
+            return embed_and_save(summaries, doc_ids, index_type, storage)
+
+    to_encode = changed + added
+    embeddings = None
+    if to_encode:
+        print(f"[INFO] Encoding {len(to_encode)} new or changed summaries...")
+        model = load_encoder()
+        embeddings = model.encode([summary_by_id[pid] for pid in to_encode], show_progress_bar=True)
+        index.add_with_ids(
+            np.ascontiguousarray(embeddings, dtype="float32"),
+            np.asarray([rows[pid] for pid in to_encode], dtype="int64"),
+        )
+
+    # Rewrite the row-aligned metadata; rows no longer in the index are left blank
+    old_ids = IdArray(DOC_ID_FILE)
+    old_summaries = StringTable(SUMMARY_TABLE)
+    row_ids = [old_ids[row] if row < len(old_ids) else "" for row in range(next_row)]
+    row_summaries = [old_summaries[row] if row < len(old_summaries) else "" for row in range(next_row)]
+    for row in free_rows:
+        row_ids[row] = row_summaries[row] = ""
+    for pid in to_encode:
+        row_ids[rows[pid]] = pid
+        row_summaries[rows[pid]] = summary_by_id[pid]
+
+    write_faiss_index(index)
+    update_vectors(rows, to_encode, embeddings, free_rows, next_row, storage)
+    save_metadata(row_summaries, row_ids)
+    write_manifest(rows, hashes, manifest["index_type"], next_row, storage)
+
+    report = {"reused": reused, "added": len(added), "changed": len(changed), "deleted": len(deleted)}
+    print(f"[DONE] Incremental update: {report}")
+    return report
+
+# Row-aligned rewrite of the vector store: re-encoded rows replaced, freed rows zeroed.
+# int8 scales are recomputed over the whole matrix.
+def update_vectors(rows, encoded_ids, embeddings, free_rows, next_row, storage):
+    if not vectors_exist(VECTOR_STORE):
+        print("[INFO] No vector store from the previous build, skipping it (run a full build to create one)")
+        return
+    old = VectorStore(VECTOR_STORE).all()
+    vectors = np.zeros((next_row, old.shape[1]), dtype="float32")
+    vectors[:min(len(old), next_row)] = old[:next_row]
+    vectors[free_rows] = 0.0
+    if encoded_ids:
+        vectors[[rows[pid] for pid in encoded_ids]] = embeddings
+    save_vectors(vectors, storage)
+
+# Save ids, summaries and the lexical/key indexes over them in the layout read by core.retrieval
+def save_metadata(summaries, doc_ids):
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-    faiss.write_index(index, FAISS_INDEX_FILE)
+    write_id_array(DOC_ID_FILE, doc_ids)
+    write_string_table(SUMMARY_TABLE, summaries)
+    print(f"[DONE] Ids saved to {DOC_ID_FILE}")
+    print(f"[DONE] Summaries saved to {SUMMARY_TABLE}.bin")
 
-    with open(MAPPING_FILE, "wb") as f:
-        pickle.dump(doc_ids, f)
+    BM25Index.from_texts(summaries).save(LEXICAL_INDEX)
+    print(f"[DONE] Lexical index saved to {LEXICAL_INDEX}.*")
 
-    print(f"[DONE] FAISS index saved to {FAISS_INDEX_FILE}")
-    print(f"[DONE] Mapping saved to {MAPPING_FILE}")
-    
-    with open(SUMMARY_FILE, "wb") as f:
-        pickle.dump(summaries, f)
+    save_patient_keys(build_patient_keys(doc_ids, summaries), PATIENT_KEYS_FILE)
+    print(f"[DONE] Patient key index saved to {PATIENT_KEYS_FILE}")
+
+# Convert pickled metadata from older builds without re-encoding anything
+def convert_legacy_metadata():
+    with open(MAPPING_FILE, "rb") as f:
+        doc_ids = pickle.load(f)
+    with open(SUMMARY_FILE, "rb") as f:
+        summaries = pickle.load(f)
+    save_metadata(summaries, doc_ids)
 
 if __name__ == "__main__":
-    print("[START] Generating EHR embeddings...")
-    patients, conditions, medications, encounters = load_synthea_data()
-    summaries, doc_ids = build_patient_summaries(patients, conditions, medications, encounters)
-    embed_and_save(summaries, doc_ids)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the EHR FAISS index and metadata")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=INDEX_TYPE, help="FAISS index type to build")
+    parser.add_argument("--incremental", action="store_true", help="Re-encode only new or changed patients")
+    parser.add_argument("--embedding-storage", choices=STORAGE_TYPES, default=EMBEDDING_STORAGE,
+                        help="Type of the stored copy of the embeddings")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Encode in shards across this many processes (resumable, see utils/sharded_embedding.py)")
+    parser.add_argument("--shard-size", type=int, help="Summaries per shard (default EMBED_SHARD_SIZE)")
+    parser.add_argument("--keep-shards", action="store_true", help="Keep the shard files after the merge")
+    parser.add_argument("--convert-legacy", action="store_true", help="Rewrite existing .pkl metadata in the memory-mapped layout and exit")
+    args = parser.parse_args()
+
+    if args.convert_legacy:
+        print("[START] Converting pickled metadata...")
+        convert_legacy_metadata()
+    else:
+        print("[START] Generating EHR embeddings...")
+        patients, conditions, medications, encounters = load_synthea_data()
+        summaries, doc_ids = build_patient_summaries(patients, conditions, medications, encounters)
+        if args.incremental:
+            embed_incremental(summaries, doc_ids, args.index_type, args.embedding_storage)
+        elif args.workers > 1 or args.shard_size:
+            from utils.sharded_embedding import embed_sharded, SHARD_SIZE
+            embed_sharded(summaries, doc_ids, args.index_type, args.embedding_storage, args.workers,
+                          args.shard_size or SHARD_SIZE, keep_shards=args.keep_shards)
+        else:
+            embed_and_save(summaries, doc_ids, args.index_type, args.embedding_storage)
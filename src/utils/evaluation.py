@@ -1,12 +1,29 @@
 import os
-import mlflow
+import time
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import datetime
 
-# Configure MLflow
-mlflow.set_tracking_uri("http://127.0.0.1:5000")  # Local tracking URI
-mlflow.set_experiment("MedChatGuard-RAG-LLM")
+from utils.mlflow_logger import configure_mlflow
+
+# Configure MLflow on first use, so importing a pipeline doesn't import mlflow
+@lru_cache(maxsize=None)
+def get_mlflow():
+    mlflow = configure_mlflow()
+    mlflow.set_experiment("MedChatGuard-RAG-LLM")
+    return mlflow
+
+# Adds the seconds spent in the block to timings[stage]
+@contextmanager
+def stage_timer(timings, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
 
 def log_evaluation(query, prompt, response, retrieved_chunks, model_name="flan-t5-base"):
+    mlflow = get_mlflow()
     with mlflow.start_run(run_name=f"eval_{datetime.now().strftime('%Y%m%d_%H%M%S')}"):
         # Log parameters
         mlflow.log_param("model", model_name)
@@ -1,4 +1,118 @@
+import os
 import re
+import json
+import time
+import argparse
+from functools import lru_cache
+
+import numpy as np
+
+# Rule terms by category; override the file with GUARDRAIL_RULES
+GUARDRAIL_RULES = os.getenv("GUARDRAIL_RULES", os.path.join(os.path.dirname(os.path.abspath(__file__)), "guardrail_rules.json"))
+
+# Joins the texts of a batch; no rule can match across it (\x00 is neither a word nor a space character)
+BATCH_SEPARATOR = "\n\x00\n"
+
+def _normalize_term(text):
+    return " ".join(text.lower().replace("’", "'").split())
+
+def _term_pattern(term):
+    # Any run of whitespace between words, straight or curly apostrophes
+    return r"\s+".join(re.escape(word).replace("'", "['’]") for word in term.split())
+
+
+class GuardrailEngine:
+    """
+    Compiles every rule term into a single case-insensitive, word-bounded regex.
+    Alternatives are tried longest first, so at each position only the longest
+    term matches; a term therefore also carries the categories of the shorter
+    terms it contains as whole words ("might have" counts as hedging's "might").
+    """
+
+    def __init__(self, rules):
+        self.categories = list(rules)
+        term_categories = {}
+        for category, rule in rules.items():
+            for term in rule["terms"]:
+                term_categories.setdefault(_normalize_term(term), set()).add(category)
+        for term, categories in term_categories.items():
+            for other, other_categories in term_categories.items():
+                if other != term and f" {other} " in f" {term} ":
+                    categories |= other_categories
+        self.term_categories = {
+            term: [c for c in self.categories if c in categories] for term, categories in term_categories.items()
+        }
+
+        terms = sorted(self.term_categories, key=len, reverse=True)
+        alternatives = "|".join(_term_pattern(term) for term in terms)
+        self.pattern = re.compile(rf"\b(?:{alternatives})\b", re.IGNORECASE) if terms else None
+
+    @classmethod
+    def from_file(cls, path=GUARDRAIL_RULES):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def _match(self, match, offset=0):
+        term = _normalize_term(match.group(0))
+        return {
+            "term": term,
+            "categories": self.term_categories[term],
+            "start": match.start() - offset,
+            "end": match.end() - offset,
+        }
+
+    def scan(self, text):
+        """All rule matches in `text`, each with its term, categories and character span."""
+        if self.pattern is None or not text:
+            return []
+        return [self._match(m) for m in self.pattern.finditer(text)]
+
+    def group(self, matches):
+        """{category: [matches]} for every configured category."""
+        grouped = {category: [] for category in self.categories}
+        for match in matches:
+            for category in match["categories"]:
+                grouped[category].append(match)
+        return grouped
+
+    def check(self, text):
+        return self.group(self.scan(text))
+
+    def scan_batch(self, texts):
+        """
+        Scans many texts in one pass of the compiled pattern over their
+        concatenation and maps the spans back. Returns one match list per text.
+        """
+        texts = [text or "" for text in texts]
+        results = [[] for _ in texts]
+        if self.pattern is None or not texts:
+            return results
+        starts = np.cumsum([0] + [len(text) + len(BATCH_SEPARATOR) for text in texts[:-1]])
+        found = list(self.pattern.finditer(BATCH_SEPARATOR.join(texts)))
+        owners = np.searchsorted(starts, [m.start() for m in found], side="right") - 1
+        for match, owner in zip(found, owners):
+            results[owner].append(self._match(match, int(starts[owner])))
+        return results
+
+    def flag_matrix(self, texts):
+        """Boolean array of shape (len(texts), len(categories)): which categories fire in which text."""
+        column = {category: i for i, category in enumerate(self.categories)}
+        rows, columns = [], []
+        for row, matches in enumerate(self.scan_batch(texts)):
+            for match in matches:
+                for category in match["categories"]:
+                    rows.append(row)
+                    columns.append(column[category])
+        flags = np.zeros((len(texts), len(self.categories)), dtype=bool)
+        flags[rows, columns] = True
+        return flags
+
+
+@lru_cache(maxsize=None)
+def get_guardrail_engine(path=GUARDRAIL_RULES):
+    """Process-wide engine compiled from the rules file on first use."""
+    return GuardrailEngine.from_file(path)
+
 
 # Basic format check (example: enforce bullet points or structured output)
 def enforce_format(response):
@@ -7,34 +121,68 @@ def enforce_format(response):
     return True, "Format OK"
 
 # Check for speculative language
-SPECULATIVE_PATTERNS = [
-    r"might have",
-    r"could be",
-    r"possibly",
-    r"likely has",
-    r"it seems that"
-]
+def _speculation_verdict(matches):
+    if matches:
+        return True, f"Speculative language detected: '{matches[0]['term']}'"
+    return False, "No speculation detected"
 
 def detect_speculation(response):
-    for pattern in SPECULATIVE_PATTERNS:
-        if re.search(pattern, response, re.IGNORECASE):
-            return True, f"Speculative language detected: '{pattern}'"
-    return False, "No speculation detected"
+    return _speculation_verdict(get_guardrail_engine().check(response)["speculation"])
 
 # Combined guardrail check
-def apply_guardrails(response):
+def _guardrail_result(response, matches):
     format_ok, format_msg = enforce_format(response)
-    speculative, spec_msg = detect_speculation(response)
+    speculation = get_guardrail_engine().group(matches)["speculation"]
+    speculative, spec_msg = _speculation_verdict(speculation)
 
     result = {
         "format_pass": format_ok,
         "format_msg": format_msg,
         "speculation_flag": speculative,
         "speculation_msg": spec_msg,
+        "speculation_spans": [(m["start"], m["end"]) for m in speculation],
         "safe_to_use": format_ok and not speculative
     }
     return result
 
+def apply_guardrails(response):
+    return _guardrail_result(response, get_guardrail_engine().scan(response))
+
+def apply_guardrails_batch(responses):
+    """apply_guardrails over many responses, sharing one scan of the batch."""
+    matches = get_guardrail_engine().scan_batch(responses)
+    return [_guardrail_result(response, found) for response, found in zip(responses, matches)]
+
+# Offline audit of stored responses (JSONL with a text field, or one response per line)
+def load_responses(path, field="response"):
+    responses = []
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                value = record.get(field, "")
+                line = value.get("content", "") if isinstance(value, dict) else str(value)
+            responses.append(line)
+    return responses
+
+def audit_responses(responses, batch_size=10000):
+    engine = get_guardrail_engine()
+    start = time.perf_counter()
+    flags = np.concatenate([
+        engine.flag_matrix(responses[i:i + batch_size]) for i in range(0, len(responses), batch_size)
+    ]) if responses else np.zeros((0, len(engine.categories)), dtype=bool)
+    elapsed = time.perf_counter() - start
+    return {
+        "responses": len(responses),
+        "flagged": int(flags.any(axis=1).sum()),
+        "by_category": {c: int(flags[:, i].sum()) for i, c in enumerate(engine.categories)},
+        "seconds": elapsed,
+        "responses_per_second": len(responses) / elapsed if elapsed else None,
+    }
+
 # Example usage
 def test_guardrails():
     test_response = "This patient might have early-stage hypertension."
@@ -44,4 +192,12 @@ def test_guardrails():
         print(f"{key}: {value}")
 
 if __name__ == "__main__":
-    test_guardrails()
+    parser = argparse.ArgumentParser(description="Guardrail check, or an offline audit of stored responses")
+    parser.add_argument("--audit", help="JSONL (or plain text, one response per line) file of responses")
+    parser.add_argument("--field", default="response", help="JSONL field holding the response text")
+    args = parser.parse_args()
+
+    if args.audit:
+        print(json.dumps(audit_responses(load_responses(args.audit, args.field)), indent=2))
+    else:
+        test_guardrails()
@@ -0,0 +1,238 @@
+# utils/metrics.py
+#
+# In-process metrics registry for the hot path: counters and fixed-bucket
+# histograms (one lock and a bisect per observation), stage timers, and export
+# as Prometheus text or JSON. serve_metrics() exposes both over HTTP:
+#   GET /metrics       Prometheus text exposition format
+#   GET /metrics.json  the same samples as JSON
+
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Set to false to turn every timer and counter into a no-op
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() != "false"
+# Port for the metrics endpoint started by the app (0 disables it)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+METRIC_PREFIX = "medchatguard_"
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DISTANCE_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 2.0, 3.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(pairs):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        with self._lock:
+            return [{"labels": dict(zip(self.labelnames, key)), "value": value} for key, value in self._values.items()]
+
+    def prometheus(self):
+        return [f"{self.name}{_format_labels(sample['labels'].items())} {sample['value']}"
+                for sample in sorted(self.samples(), key=lambda s: tuple(s["labels"].values()))]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=SECONDS_BUCKETS, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._series = {}  # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[slot] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        samples = []
+        for key, series in items:
+            cumulative, running = {}, 0
+            for bound, count in zip(self.buckets, series):
+                running += count
+                cumulative[str(bound)] = running
+            cumulative["+Inf"] = series[-1]
+            samples.append({"labels": dict(zip(self.labelnames, key)), "buckets": cumulative,
+                            "sum": series[-2], "count": series[-1]})
+        return samples
+
+    def prometheus(self):
+        lines = []
+        for sample in sorted(self.samples(), key=lambda s: tuple(s["labels"].values())):
+            pairs = list(sample["labels"].items())
+            for bound, count in sample["buckets"].items():
+                lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', bound)])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(pairs)} {sample['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(pairs)} {sample['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        name = METRIC_PREFIX + name
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = cls(name, *args, **kwargs)
+        return metric
+
+    def counter(self, name, help="", labelnames=()):
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def histogram(self, name, help="", buckets=SECONDS_BUCKETS, labelnames=()):
+        return self._get_or_create(Histogram, name, help, buckets, labelnames)
+
+    def to_prometheus(self):
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.prometheus())
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        return {
+            name: {"type": metric.kind, "help": metric.help, "samples": metric.samples()}
+            for name, metric in sorted(self._metrics.items())
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def reset(self):
+        """Zeroes every metric (registrations are kept, so module-level handles stay valid)."""
+        for metric in list(self._metrics.values()):
+            metric.clear()
+
+
+registry = MetricsRegistry()
+
+# Metrics shared across modules
+STAGE_SECONDS = registry.histogram(
+    "stage_seconds", "Wall time per pipeline stage (graph nodes, retrieval steps, LLM and MLflow calls)",
+    SECONDS_BUCKETS, ["stage"])
+CACHE_EVENTS = registry.counter("cache_events_total", "Cache lookups by cache and result", ["cache", "result"])
+LLM_TOKENS = registry.counter("llm_tokens_total", "LLM tokens by kind (prompt or completion)", ["kind"])
+LLM_CALLS = registry.counter("llm_calls_total", "LLM calls by outcome", ["outcome"])
+LLM_RETRIES = registry.counter("llm_retries_total", "LLM call attempts retried after a retryable error")
+RETRIEVALS = registry.counter("retrievals_total", "Retrieval requests by path", ["path"])
+RETRIEVAL_K = registry.histogram("retrieval_k", "Results returned per retrieval", COUNT_BUCKETS)
+RETRIEVAL_DISTANCE = registry.histogram(
+    "retrieval_distance", "L2 distance of the best vector hit per retrieval", DISTANCE_BUCKETS)
+
+
+@contextmanager
+def timer(stage):
+    """Observes the wall time of the block in the stage_seconds histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+def record_retrieval(results, path, best_distance=None):
+    """Counts a retrieval by path and observes its k and (when FAISS ran) the best L2 distance."""
+    RETRIEVALS.inc(path=path)
+    RETRIEVAL_K.observe(len(results))
+    if best_distance is not None:
+        RETRIEVAL_DISTANCE.observe(float(best_distance))
+
+
+def make_handler(metrics_registry):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = metrics_registry.to_prometheus(), "text/plain; version=0.0.4; charset=utf-8"
+            elif self.path == "/metrics.json":
+                body, content_type = metrics_registry.to_json(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            body = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return MetricsHandler
+
+_server = None
+_server_lock = threading.Lock()
+
+def serve_metrics(port=METRICS_PORT, host="127.0.0.1"):
+    """Starts the metrics endpoint in a daemon thread (once per process). Returns the server, or None if disabled."""
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), make_handler(registry))
+            except OSError as exc:
+                print(f"[WARN] Metrics endpoint not started on {host}:{port}: {exc}")
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics-endpoint", daemon=True).start()
+            print(f"[INFO] Metrics endpoint on http://{host}:{port}/metrics")
+    return _server
@@ -1,35 +1,241 @@
 # utils/mlflow_logger.py
+#
+# Chat-turn telemetry for MLflow, off the request path. Turns are queued and a
+# background thread writes each one as a run with a single log_batch call for its
+# params/metrics/tags and a single log_dict call for the full state. Sampling,
+# a bounded queue (new turns are dropped when it is full) and a payload size cap
+# keep a slow or unreachable tracking server from backing up the UI.
 
-import mlflow
+import os
 import json
+import time
+import queue
+import atexit
+import random
+import threading
 from datetime import datetime
 
-mlflow.set_tracking_uri("http://localhost:5000")
+from utils.metrics import registry, timer
 
-def log_rag_state_to_mlflow(state: dict, run_name: str = None):
-    if not run_name:
-        run_name = f"langgraph_rag_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+# Any MLflow tracking URI, e.g. a local file store: MLFLOW_TRACKING_URI=file:./mlruns
+MLFLOW_TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI", "http://localhost:5000")
+MLFLOW_EXPERIMENT_ID = os.getenv("MLFLOW_EXPERIMENT_ID", "0")
+
+# Fraction of turns logged, queued turns before new ones are dropped, turns per flush
+TELEMETRY_SAMPLE_RATE = float(os.getenv("TELEMETRY_SAMPLE_RATE", "1.0"))
+TELEMETRY_QUEUE_SIZE = int(os.getenv("TELEMETRY_QUEUE_SIZE", "256"))
+TELEMETRY_BATCH_SIZE = int(os.getenv("TELEMETRY_BATCH_SIZE", "32"))
+TELEMETRY_FLUSH_SECONDS = float(os.getenv("TELEMETRY_FLUSH_SECONDS", "2"))
+# Longest param value, and largest state JSON logged with log_dict (larger payloads are dropped)
+TELEMETRY_MAX_PARAM_CHARS = int(os.getenv("TELEMETRY_MAX_PARAM_CHARS", "500"))
+TELEMETRY_MAX_PAYLOAD_BYTES = int(os.getenv("TELEMETRY_MAX_PAYLOAD_BYTES", str(256 * 1024)))
+
+# MLflow accepts at most 100 params and 1000 entities in one log_batch call
+MAX_BATCH_PARAMS = 100
+MAX_BATCH_ENTITIES = 1000
+STATE_ARTIFACT = "rag_state.json"
+
+def configure_mlflow():
+    """mlflow with its global tracking URI set to the one the telemetry queue writes to."""
+    import mlflow
+    mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
+    return mlflow
+
+TELEMETRY_EVENTS = registry.counter("telemetry_events_total", "Telemetry queue events (see TelemetryQueue.counters)", ["event"])
+
+
+def _text(value):
+    return value.content if hasattr(value, "content") else value
+
+def _json_default(value):
+    return _text(value) if hasattr(value, "content") else str(value)
+
+def flatten_state(state, max_chars=TELEMETRY_MAX_PARAM_CHARS):
+    """
+    Splits a RAG state into params (strings, capped) and numeric metrics. Lists are
+    summarized by their length; their contents only go to the state artifact.
+    """
+    params, metrics = {}, {}
+
+    def add(key, value):
+        value = _text(value)
+        if isinstance(value, bool):
+            params[key] = str(value)
+        elif isinstance(value, (int, float)):
+            metrics[key] = float(value)
+        elif isinstance(value, dict):
+            for subkey, subval in value.items():
+                add(f"{key}_{subkey}", subval)
+        elif isinstance(value, (list, tuple)):
+            metrics[f"{key}_count"] = float(len(value))
+        elif value is not None:
+            params[key] = str(value)[:max_chars]
+
+    for key, value in state.items():
+        add(key, value)
+    return params, metrics
+
+
+class TelemetryQueue:
+    """
+    Bounded queue of chat turns drained by one daemon thread into MLflow.
+    submit() never blocks: turns are sampled, and dropped when the queue is full.
+    """
+
+    def __init__(self, tracking_uri=MLFLOW_TRACKING_URI, experiment_id=MLFLOW_EXPERIMENT_ID,
+                 sample_rate=TELEMETRY_SAMPLE_RATE, max_queue=TELEMETRY_QUEUE_SIZE,
+                 batch_size=TELEMETRY_BATCH_SIZE, flush_seconds=TELEMETRY_FLUSH_SECONDS,
+                 max_param_chars=TELEMETRY_MAX_PARAM_CHARS, max_payload_bytes=TELEMETRY_MAX_PAYLOAD_BYTES):
+        self.tracking_uri = tracking_uri
+        self.experiment_id = experiment_id
+        self.sample_rate = sample_rate
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.max_param_chars = max_param_chars
+        self.max_payload_bytes = max_payload_bytes
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._client = None
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.counters = {"submitted": 0, "sampled_out": 0, "dropped_turns": 0, "dropped_payloads": 0,
+                         "logged_turns": 0, "failed_turns": 0, "flushes": 0}
 
-    with mlflow.start_run(run_name=run_name):
-        # Log flattened params
-        for key, value in state.items():
-            if isinstance(value, (str, int, float, bool)):
-                mlflow.log_param(key, value)
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.counters[key] += amount
+        TELEMETRY_EVENTS.inc(amount, event=key)
 
-            elif hasattr(value, "content"):  # e.g., AIMessage
-                mlflow.log_param(key, value.content)
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._start_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="mlflow-telemetry", daemon=True)
+                    self._worker.start()
+                    atexit.register(self.close)
 
-            elif isinstance(value, dict):
-                for subkey, subval in value.items():
-                    mlflow.log_param(f"{key}_{subkey}", str(subval))
+    def submit(self, state, run_name=None):
+        """Queues a turn for logging. Returns False when it was sampled out or dropped."""
+        self._count("submitted")
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self._count("sampled_out")
+            return False
+        self._ensure_worker()
+        run_name = run_name or f"langgraph_rag_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        try:
+            self._queue.put_nowait((run_name, dict(state), int(time.time() * 1000)))
+        except queue.Full:
+            self._count("dropped_turns")
+            return False
+        return True
 
-            elif isinstance(value, list) and all(isinstance(i, dict) for i in value):
-                for i, item in enumerate(value):
-                    for subkey, subval in item.items():
-                        mlflow.log_param(f"{key}_{i}_{subkey}", str(subval))
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            batch = [item]
+            # Coalesce whatever else arrives within the flush window
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._flush(batch)
+                    self._queue.task_done()
+                    for _ in batch:
+                        self._queue.task_done()
+                    return
+                batch.append(item)
+            self._flush(batch)
+            for _ in batch:
+                self._queue.task_done()
 
+    def _get_client(self):
+        if self._client is None:
+            from mlflow.tracking import MlflowClient
+            self._client = MlflowClient(tracking_uri=self.tracking_uri)
+        return self._client
+
+    def _flush(self, batch):
+        self._count("flushes")
+        for run_name, state, timestamp in batch:
+            try:
+                with timer("mlflow_log"):
+                    self._log_turn(run_name, state, timestamp)
+            except Exception as exc:
+                self._count("failed_turns")
+                print(f"[WARN] MLflow telemetry failed for {run_name}: {exc}")
             else:
-                mlflow.log_param(key, str(value))
+                self._count("logged_turns")
+
+    def _log_turn(self, run_name, state, timestamp):
+        from mlflow.entities import Metric, Param, RunTag
+
+        client = self._get_client()
+        run = client.create_run(self.experiment_id, start_time=timestamp, run_name=run_name)
+        run_id = run.info.run_id
+
+        params, metrics = flatten_state(state, self.max_param_chars)
+        params = [Param(key, value) for key, value in params.items()]
+        metrics = [Metric(key, value, timestamp, 0) for key, value in metrics.items()]
+        tags = [RunTag("source", "medchatguard.telemetry")]
+        # Usually one call; split only when a state has more keys than log_batch accepts
+        while params or metrics or tags:
+            chunk_params, params = params[:MAX_BATCH_PARAMS], params[MAX_BATCH_PARAMS:]
+            room = MAX_BATCH_ENTITIES - len(chunk_params) - len(tags)
+            chunk_metrics, metrics = metrics[:room], metrics[room:]
+            client.log_batch(run_id, metrics=chunk_metrics, params=chunk_params, tags=tags)
+            tags = []
+
+        payload = json.loads(json.dumps(state, default=_json_default))
+        if len(json.dumps(payload).encode("utf-8")) <= self.max_payload_bytes:
+            client.log_dict(run_id, payload, STATE_ARTIFACT)
+        else:
+            self._count("dropped_payloads")
+
+        client.set_terminated(run_id, end_time=int(time.time() * 1000))
+
+    def flush(self, timeout=None):
+        """Blocks until every queued turn has been written (or `timeout` seconds pass)."""
+        if self._worker is None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
 
-        # Save entire state as JSON artifact
-        mlflow.log_dict(state, artifact_file="./log/full_rag_state.json")
+    def close(self, timeout=10.0):
+        if self._worker is None or not self._worker.is_alive():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._worker.join(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            return {**self.counters, "pending": self._queue.qsize(), "sample_rate": self.sample_rate}
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+def get_telemetry():
+    """Process-wide telemetry queue, created on first use."""
+    global _telemetry
+    if _telemetry is None:
+        with _telemetry_lock:
+            if _telemetry is None:
+                _telemetry = TelemetryQueue()
+    return _telemetry
+
+def log_rag_state_to_mlflow(state: dict, run_name: str = None):
+    """Queues the turn for background logging; returns immediately."""
+    return get_telemetry().submit(state, run_name)
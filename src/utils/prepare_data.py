@@ -1,8 +1,7 @@
 import pandas as pd
 import json
 import os
-from datasets import load_dataset
-from transformers import AutoTokenizer
+from functools import lru_cache
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -18,9 +17,13 @@ DATA_PATH = OUT_FILE
 OUTPUT_DIR = "./data/preprocessed/"
 MAX_SEQ_LENGTH = 2048
 
-# === LOAD TOKENIZER ===
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-tokenizer.pad_token = tokenizer.eos_token
+# === LOAD TOKENIZER (on first use) ===
+@lru_cache(maxsize=None)
+def get_tokenizer():
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
 
 # === FORMAT FUNCTION ===
 def formatting_func(example):
@@ -36,7 +39,7 @@ def formatting_func(example):
 
 # === TOKENIZATION FUNCTION ===
 def tokenize_func(example):
-    return tokenizer(
+    return get_tokenizer()(
         example["prompt"],
         truncation=True,
         padding="max_length",
@@ -135,6 +138,7 @@ def main():
     print(f"Saved QA-style SQuAD data to {SQUAD_FILE}")
 
     # Tokenization for instruction-style
+    from datasets import load_dataset
     print("[INFO] Loading dataset...")
     dataset = load_dataset("json", data_files=DATA_PATH)["train"]
 
@@ -0,0 +1,223 @@
+# utils/sharded_embedding.py
+#
+# Resumable, multi-process corpus build. Summaries are cut into fixed-size shards
+# that a process pool encodes; each finished shard is written to SHARD_DIR as
+#   shard_<n>.npz   float32 vectors and their patient ids
+#   shard_<n>.json  row range, worker pid, encode seconds and per-dimension max |x|
+# (the .json is written last and marks the shard done). A restarted build with the
+# same corpus, encoder and shard size skips finished shards. The FAISS index and the
+# vector store are then merged from the shards one at a time, so the full embedding
+# matrix is never held in memory.
+#   PYTHONPATH=src python -m utils.embedding --workers 4 --shard-size 20000
+
+import os
+import glob
+import json
+import time
+import shutil
+import hashlib
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from core.encoder import encoder_id
+from core.vector_store import EMBEDDING_STORAGE, write_vector_chunks
+from utils.embedding import (
+    OUTPUT_DIR, MODEL_NAME, INDEX_TYPE, FAISS_INDEX_FILE, VECTOR_STORE,
+    create_faiss_index, write_faiss_index, save_metadata, write_manifest, content_hash, load_encoder,
+)
+
+SHARD_DIR = os.path.join(OUTPUT_DIR, "shards")
+SHARD_SIZE = int(os.getenv("EMBED_SHARD_SIZE", "10000"))
+# Encoder processes; each gets an equal share of the CPU threads
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+ENCODE_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+PLAN_FILE = "plan.json"
+
+
+def _shard_path(shard_dir, shard):
+    return os.path.join(shard_dir, f"shard_{shard:06d}")
+
+def corpus_fingerprint(summaries, doc_ids):
+    digest = hashlib.sha256()
+    for pid, summary in zip(doc_ids, summaries):
+        digest.update(f"{pid}\0{content_hash(summary)}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def prepare_shard_dir(shard_dir, plan):
+    """Keeps finished shards only if they were built from the same plan; returns the finished shard numbers."""
+    plan_path = os.path.join(shard_dir, PLAN_FILE)
+    if os.path.exists(plan_path):
+        with open(plan_path) as f:
+            if json.load(f) == plan:
+                done = sorted(int(os.path.basename(p)[6:12]) for p in glob.glob(os.path.join(shard_dir, "shard_*.json")))
+                return [shard for shard in done if os.path.exists(_shard_path(shard_dir, shard) + ".npz")]
+        print("[INFO] Corpus, encoder or shard size changed since the last run, discarding its shards...")
+        shutil.rmtree(shard_dir)
+    os.makedirs(shard_dir, exist_ok=True)
+    with open(plan_path, "w") as f:
+        json.dump(plan, f)
+    return []
+
+# === WORKER PROCESSES ===
+
+_encoder = None
+
+def _init_worker(threads):
+    global _encoder
+    # One share of the cores per worker, so workers do not oversubscribe the CPU
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _encoder = load_encoder()
+
+def encode_shard(shard, start, summaries, doc_ids, shard_dir, batch_size=ENCODE_BATCH_SIZE):
+    began = time.perf_counter()
+    vectors = np.asarray(_encoder.encode(summaries, batch_size=batch_size), dtype="float32")
+    seconds = time.perf_counter() - began
+
+    path = _shard_path(shard_dir, shard)
+    with open(path + ".npz.tmp", "wb") as f:
+        np.savez(f, vectors=vectors, ids=np.asarray(doc_ids, dtype="S"))
+    os.replace(path + ".npz.tmp", path + ".npz")
+    info = {
+        "shard": shard,
+        "start": start,
+        "count": len(summaries),
+        "worker": os.getpid(),
+        "seconds": seconds,
+        "max_abs": np.abs(vectors).max(axis=0).tolist() if len(vectors) else None,
+    }
+    with open(path + ".json.tmp", "w") as f:
+        json.dump(info, f)
+    os.replace(path + ".json.tmp", path + ".json")
+    return info
+
+# === BUILD ===
+
+def load_shard(shard_dir, shard):
+    with np.load(_shard_path(shard_dir, shard) + ".npz") as data:
+        return data["vectors"], data["ids"]
+
+def shard_info(shard_dir, shard):
+    with open(_shard_path(shard_dir, shard) + ".json") as f:
+        return json.load(f)
+
+def worker_report(infos, wall_seconds):
+    """Docs per second of encode time for each worker, plus the whole build's wall-clock rate."""
+    per_worker = defaultdict(lambda: {"shards": 0, "docs": 0, "seconds": 0.0})
+    for info in infos:
+        stats = per_worker[info["worker"]]
+        stats["shards"] += 1
+        stats["docs"] += info["count"]
+        stats["seconds"] += info["seconds"]
+    for stats in per_worker.values():
+        stats["docs_per_second"] = stats["docs"] / stats["seconds"] if stats["seconds"] else 0.0
+    docs = sum(info["count"] for info in infos)
+    return {
+        "workers": dict(per_worker),
+        "docs": docs,
+        "wall_seconds": wall_seconds,
+        "docs_per_second": docs / wall_seconds if wall_seconds else 0.0,
+    }
+
+def sample_from_shards(shard_dir, shards, size, seed=42):
+    """`size` training vectors drawn uniformly across shards, reading one shard at a time."""
+    rng = np.random.default_rng(seed)
+    counts = np.asarray([shard_info(shard_dir, s)["count"] for s in shards])
+    picks = np.sort(rng.choice(counts.sum(), size, replace=False))
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    sample = []
+    for i, shard in enumerate(shards):
+        rows = picks[(picks >= offsets[i]) & (picks < offsets[i + 1])] - offsets[i]
+        if len(rows):
+            sample.append(load_shard(shard_dir, shard)[0][rows])
+    return np.concatenate(sample)
+
+def merge_shards(shard_dir, shards, doc_ids, index_type, storage):
+    """
+    Builds the FAISS index and the vector store from finished shards, in row order.
+    Each shard's patient ids must match doc_ids at its rows (a resumed build could
+    otherwise mix in shards of another corpus).
+    """
+    num_docs = len(doc_ids)
+    dim = load_shard(shard_dir, shards[0])[0].shape[1]
+    index = create_faiss_index(index_type, dim, num_docs, lambda size: sample_from_shards(shard_dir, shards, size))
+    for shard in shards:
+        vectors, ids = load_shard(shard_dir, shard)
+        start = shard_info(shard_dir, shard)["start"]
+        expected = [str(pid) for pid in doc_ids[start:start + len(vectors)]]
+        if len(ids) != len(vectors) or [pid.decode("utf-8") for pid in ids] != expected:
+            raise ValueError(f"Shard {shard} does not match the corpus at rows {start}-{start + len(vectors)}; "
+                             f"delete {shard_dir} and rebuild")
+        index.add_with_ids(np.ascontiguousarray(vectors), np.arange(start, start + len(vectors), dtype="int64"))
+    write_faiss_index(index)
+
+    max_abs = np.max([shard_info(shard_dir, s)["max_abs"] for s in shards], axis=0) if storage == "int8" else None
+    meta = write_vector_chunks(VECTOR_STORE, (load_shard(shard_dir, s)[0] for s in shards),
+                               num_docs, dim, storage, encoder_id(MODEL_NAME), max_abs)
+    print(f"[DONE] {meta['count']} vectors saved to {VECTOR_STORE}.npy ({storage})")
+
+def embed_sharded(summaries, doc_ids, index_type=INDEX_TYPE, storage=EMBEDDING_STORAGE, workers=EMBED_WORKERS,
+                  shard_size=SHARD_SIZE, shard_dir=SHARD_DIR, keep_shards=False):
+    """
+    Full build in shards across `workers` processes, resuming from the shards a previous
+    interrupted run finished. Returns the per-worker throughput report.
+    """
+    if not summaries:
+        raise ValueError("No summaries to embed")
+    shard_size = max(1, shard_size)
+    num_shards = (len(summaries) + shard_size - 1) // shard_size
+    plan = {"encoder": encoder_id(MODEL_NAME), "shard_size": shard_size, "num_docs": len(summaries),
+            "corpus": corpus_fingerprint(summaries, doc_ids)}
+    done = set(prepare_shard_dir(shard_dir, plan))
+    pending = [shard for shard in range(num_shards) if shard not in done]
+    if done:
+        print(f"[INFO] Resuming: {len(done)}/{num_shards} shards already encoded")
+
+    infos = []
+    start = time.perf_counter()
+    if pending:
+        workers = max(1, min(workers, len(pending)))
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        print(f"[INFO] Encoding {len(pending)} shards of up to {shard_size} summaries with {workers} workers...")
+        # spawn: forked workers would inherit torch/faiss thread pools in an undefined state
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(threads,)) as pool:
+            queued, running = list(pending), set()
+            while queued or running:
+                # Two shards in flight per worker: enough to keep them busy without copying the whole corpus
+                while queued and len(running) < 2 * workers:
+                    shard = queued.pop(0)
+                    lo, hi = shard * shard_size, min(len(summaries), (shard + 1) * shard_size)
+                    running.add(pool.submit(encode_shard, shard, lo, summaries[lo:hi], doc_ids[lo:hi], shard_dir))
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    info = future.result()
+                    infos.append(info)
+                    rate = info["count"] / info["seconds"] if info["seconds"] else 0.0
+                    print(f"[INFO] Shard {info['shard'] + 1}/{num_shards} done by worker {info['worker']}: {rate:.0f} docs/s")
+    report = worker_report(infos, time.perf_counter() - start)
+    for pid, stats in report["workers"].items():
+        print(f"[INFO] Worker {pid}: {stats['shards']} shards, {stats['docs']} docs, {stats['docs_per_second']:.0f} docs/s")
+    print(f"[INFO] Encoded {report['docs']} docs in {report['wall_seconds']:.1f}s ({report['docs_per_second']:.0f} docs/s overall)")
+
+    print(f"[INFO] Merging {num_shards} shards into a {index_type} index...")
+    merge_shards(shard_dir, list(range(num_shards)), doc_ids, index_type, storage)
+    save_metadata(summaries, doc_ids)
+    write_manifest(
+        {pid: row for row, pid in enumerate(doc_ids)},
+        {pid: content_hash(summary) for pid, summary in zip(doc_ids, summaries)},
+        index_type,
+        len(doc_ids),
+        storage,
+    )
+    if not keep_shards:
+        shutil.rmtree(shard_dir)
+    print(f"[DONE] FAISS index saved to {FAISS_INDEX_FILE}")
+    return report
@@ -0,0 +1,30 @@
+# tests/test_answer_cache.py
+#
+# A cached answer is tied to the summaries it was generated from: the same patient
+# ids with a re-embedded (changed) summary must miss.
+
+import numpy as np
+
+from agents.answer_cache import SemanticAnswerCache
+
+QUERY = np.asarray([1.0, 0.0, 0.0], dtype="float32")
+STATE = {"response": "Lisinopril 10 mg daily.", "prompt": "...", "guardrails": {}, "validation": {}}
+
+
+def chunks(summary):
+    return [{"patient_id": "p1", "summary": summary}, {"patient_id": "p2", "summary": "asthma, albuterol"}]
+
+
+def test_same_records_and_summaries_hit():
+    cache = SemanticAnswerCache(threshold=0.9, max_size=8, ttl_seconds=0)
+    cache.store(QUERY, chunks("hypertension, lisinopril 10 mg"), STATE)
+    payload, similarity = cache.lookup(QUERY, chunks("hypertension, lisinopril 10 mg"))
+    assert payload["response"] == STATE["response"]
+    assert similarity > 0.99
+
+
+def test_changed_summary_misses():
+    cache = SemanticAnswerCache(threshold=0.9, max_size=8, ttl_seconds=0)
+    cache.store(QUERY, chunks("hypertension, lisinopril 10 mg"), STATE)
+    assert cache.lookup(QUERY, chunks("hypertension, lisinopril 20 mg")) is None
+    assert cache.stats()["misses"] == 1
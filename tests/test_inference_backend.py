@@ -0,0 +1,12 @@
+# tests/test_inference_backend.py
+#
+# Quantized ONNX graphs must carry the default file names optimum looks for.
+
+from core.inference_backend import restore_graph_names
+
+
+def test_quantized_graphs_get_the_fp32_names(tmp_path):
+    for name in ("encoder_model_quantized.onnx", "decoder_model_merged_quantized.onnx", "config.json"):
+        (tmp_path / name).write_bytes(b"")
+    restore_graph_names(str(tmp_path))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["config.json", "decoder_model_merged.onnx", "encoder_model.onnx"]
@@ -0,0 +1,33 @@
+# tests/test_lexical.py
+#
+# Only name-shaped terms may route a query to the rare-term shortcut; a rare
+# number (an age, a dose, a year) must leave it to vector or hybrid search.
+
+from core.lexical import BM25Index, is_identifier_term
+
+SUMMARIES = [
+    "Sarah123 Lopez, age 47, hypertension treated with lisinopril 10 mg since 2015",
+    "John456 Smith, age 62, type 2 diabetes on metformin 500 mg since 2009",
+    "Maria789 Chen, age 35, asthma with albuterol inhaler since 2018",
+    "Ahmed321 Khan, age 58, hypertension and hyperlipidemia on atorvastatin 20 mg since 2012",
+]
+
+
+def test_numbers_are_not_identifier_terms():
+    assert not is_identifier_term("47")
+    assert not is_identifier_term("2015")
+    assert not is_identifier_term("mg")
+    assert is_identifier_term("lisinopril")
+    assert is_identifier_term("sarah")
+
+
+def test_rare_numbers_do_not_trigger_the_shortcut():
+    index = BM25Index.from_texts(SUMMARIES)
+    assert index.rare_term_rows("patients aged 47", max_df=1) is None
+    assert index.rare_term_rows("dose of 500 in 2009", max_df=1) is None
+
+
+def test_rare_names_trigger_the_shortcut():
+    index = BM25Index.from_texts(SUMMARIES)
+    assert list(index.rare_term_rows("what is Sarah taking", max_df=1)) == [0]
+    assert list(index.rare_term_rows("who takes metformin 500", max_df=1)) == [1]
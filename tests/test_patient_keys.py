@@ -0,0 +1,40 @@
+# tests/test_patient_keys.py
+#
+# Synthea gives same-name patients different numeric suffixes; a query that spells
+# the suffixes out must resolve to that one patient.
+
+from core.patient_keys import PatientKeyIndex, build_patient_keys
+
+IDS = ["b6c6f3a1-0000-4000-8000-000000000001", "b6c6f3a1-0000-4000-8000-000000000002",
+       "b6c6f3a1-0000-4000-8000-000000000003"]
+SUMMARIES = [
+    "Patient: John123 Smith456, Age: 61. Conditions: hypertension.",
+    "Patient: John789 Smith012, Age: 34. Conditions: asthma.",
+    "Patient: Sarah55 Ann77 Lopez99, Age: 47. Conditions: diabetes.",
+]
+
+
+def index():
+    return PatientKeyIndex(build_patient_keys(IDS, SUMMARIES))
+
+
+def test_full_name_with_suffixes_resolves_one_patient():
+    assert index().resolve("What conditions does John123 Smith456 have?") == [0]
+    assert index().resolve("medications for john789 smith012") == [1]
+
+
+def test_name_without_suffixes_falls_back_to_every_match():
+    assert sorted(index().resolve("What conditions does John Smith have?")) == [0, 1]
+
+
+def test_first_last_and_id_lookups():
+    assert index().resolve("sarah55 lopez99 labs") == [2]
+    assert index().resolve("Sarah Lopez") == [2]
+    assert index().resolve(f"summary for {IDS[1].upper()}") == [1]
+    assert index().resolve("patients with hypertension") is None
+
+
+def test_key_files_without_exact_names_still_load():
+    keys = build_patient_keys(IDS, SUMMARIES)
+    del keys["exact_names"]
+    assert sorted(PatientKeyIndex(keys).resolve("John123 Smith456")) == [0, 1]
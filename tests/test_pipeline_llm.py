@@ -0,0 +1,72 @@
+# tests/test_pipeline_llm.py
+#
+# generate_batch must hand the causal model one padded batch, not one prompt at a time.
+# Runs against a tiny randomly initialised GPT-2 saved to a temp dir, so no download.
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+tokenizers = pytest.importorskip("tokenizers")
+pytest.importorskip("langchain_huggingface")
+pipeline_llm = pytest.importorskip("core.pipeline_llm")
+
+WORDS = "what is the patient age dose fever cough history of".split()
+
+
+def save_tiny_model(path):
+    vocab = {"<eos>": 0, "<unk>": 1, **{word: i + 2 for i, word in enumerate(WORDS)}}
+    backend = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=backend, eos_token="<eos>", unk_token="<unk>")
+    tokenizer.save_pretrained(path)
+
+    config = transformers.GPT2Config(vocab_size=len(vocab), n_positions=64, n_embd=16, n_layer=2, n_head=2,
+                                     bos_token_id=0, eos_token_id=0)
+    transformers.GPT2LMHeadModel(config).save_pretrained(path)
+
+
+@pytest.fixture
+def tiny_pipeline(tmp_path, monkeypatch):
+    save_tiny_model(tmp_path)
+    monkeypatch.setattr(pipeline_llm, "model_path", str(tmp_path))
+    pipeline_llm.load_pipeline.cache_clear()
+    yield pipeline_llm.load_pipeline()
+    pipeline_llm.load_pipeline.cache_clear()
+
+
+def spy_on_generate(llm, monkeypatch):
+    """input_ids of every generate call the model receives."""
+    model = llm.pipeline.model
+    original = model.generate
+    calls = []
+
+    def spy(*args, **kwargs):
+        calls.append(kwargs["input_ids"])
+        # The pipeline asks for max_length=2048; a couple of tokens is enough here
+        kwargs.pop("max_length", None)
+        return original(*args, **{**kwargs, "max_new_tokens": 2})
+
+    monkeypatch.setattr(model, "generate", spy)
+    return calls
+
+
+def test_generate_batch_is_one_padded_generate_call(tiny_pipeline, monkeypatch):
+    calls = spy_on_generate(tiny_pipeline, monkeypatch)
+    prompts = ["what is the patient age", "fever", "history of cough dose"]
+    responses = pipeline_llm.generate_batch(prompts)
+
+    assert len(calls) == 1
+    assert calls[0].shape[0] == len(prompts) > 1
+    assert len(responses) == len(prompts)
+    assert all(isinstance(response, str) for response in responses)
+
+
+def test_generate_batch_splits_by_batch_size_without_touching_the_shared_pipeline(tiny_pipeline, monkeypatch):
+    calls = spy_on_generate(tiny_pipeline, monkeypatch)
+    batch_size = tiny_pipeline.batch_size
+    responses = pipeline_llm.generate_batch(["what is the patient age", "fever", "history of cough dose"], batch_size=2)
+
+    assert [ids.shape[0] for ids in calls] == [2, 1]
+    assert len(responses) == 3
+    assert tiny_pipeline.batch_size == batch_size
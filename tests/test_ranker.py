@@ -0,0 +1,58 @@
+# tests/test_ranker.py
+#
+# The distance-margin skip must fire for hybrid (RRF-fused) results, the default
+# retrieval mode, and not only for pure vector results.
+
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+ranker = pytest.importorskip("agents.ranker")
+from core.lexical import BM25Index
+from core.retrieval import Retriever, RetrievalState
+
+
+def chunk(score, source, distance=None):
+    return {"patient_id": "p", "summary": "", "score": score, "source": source, "distance": distance}
+
+
+def test_vector_results_skip_on_decisive_margin():
+    chunks = [chunk(0.2, "vector", 0.2), chunk(0.9, "vector", 0.9)]
+    assert ranker.distance_margin_is_decisive(chunks, margin=0.5)
+    assert not ranker.distance_margin_is_decisive(chunks, margin=0.8)
+
+
+def test_vector_results_without_distance_field_use_score():
+    chunks = [{"score": 0.2, "source": "vector"}, {"score": 0.9, "source": "vector"}]
+    assert ranker.distance_margin_is_decisive(chunks, margin=0.5)
+
+
+def test_hybrid_results_skip_on_decisive_margin():
+    # RRF scores are higher-is-better and nearly tied; the margin is judged on distances
+    chunks = [chunk(0.0328, "hybrid", 0.2), chunk(0.0323, "hybrid", 0.9), chunk(0.0161, "hybrid", None)]
+    assert ranker.distance_margin_is_decisive(chunks, margin=0.5)
+
+
+def test_hybrid_results_keep_reranking_when_top_is_not_nearest():
+    chunks = [chunk(0.0328, "hybrid", None), chunk(0.0323, "hybrid", 0.2), chunk(0.0318, "hybrid", 0.9)]
+    assert not ranker.distance_margin_is_decisive(chunks, margin=0.5)
+    chunks = [chunk(0.0328, "hybrid", 0.6), chunk(0.0323, "hybrid", 0.2)]
+    assert not ranker.distance_margin_is_decisive(chunks, margin=0.1)
+
+
+def test_lexical_and_lookup_results_never_skip():
+    assert not ranker.distance_margin_is_decisive([chunk(7.1, "lexical"), chunk(2.0, "lexical")], margin=0.1)
+    assert not ranker.distance_margin_is_decisive([chunk(0.0, "patient_lookup"), chunk(0.0, "patient_lookup")], margin=0.1)
+
+
+def test_fused_results_carry_vector_distances():
+    summaries = ["fever and cough", "hypertension on lisinopril", "type 2 diabetes", "asthma inhaler"]
+    state = RetrievalState(model=None, index=None, doc_ids=[f"p{i}" for i in range(len(summaries))],
+                           summaries=summaries, lexical=BM25Index.from_texts(summaries),
+                           patient_keys=None, vectors=None)
+
+    results = Retriever()._fuse(state, "lisinopril", np.asarray([0.3, 0.7, 1.1]), np.asarray([2, 0, 3]), k=4)
+    distances = {r["row"]: r["distance"] for r in results}
+    assert distances[2] == pytest.approx(0.3)
+    assert distances[0] == pytest.approx(0.7)
+    assert distances[1] is None  # found by BM25 only
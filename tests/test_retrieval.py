@@ -0,0 +1,81 @@
+# tests/test_retrieval.py
+#
+# Retriever.reload swaps the whole loaded state at once: queries running during a
+# reload must neither fail nor mix rows of two different loads.
+
+import hashlib
+import threading
+
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+from core.lexical import BM25Index
+from core.retrieval import Retriever, RetrievalState
+
+DIM = 16
+NUM_DOCS = 50
+
+
+class HashEncoder:
+    def encode(self, texts, batch_size=64, **kwargs):
+        seeds = [int(hashlib.md5(text.encode()).hexdigest()[:8], 16) for text in texts]
+        return np.stack([np.random.default_rng(seed).standard_normal(DIM) for seed in seeds]).astype("float32")
+
+
+def build_state(generation, model):
+    summaries = [f"generation{generation} record {i} hypertension" for i in range(NUM_DOCS)]
+    index = faiss.IndexFlatL2(DIM)
+    index.add(model.encode(summaries))
+    return RetrievalState(model, index, [f"g{generation}-p{i}" for i in range(NUM_DOCS)], summaries,
+                          BM25Index.from_texts(summaries), None, None)
+
+
+@pytest.fixture
+def retriever(monkeypatch):
+    generations = iter(range(1_000_000))
+    monkeypatch.setattr(Retriever, "_read_state",
+                        lambda self, model=None: build_state(next(generations), model or HashEncoder()))
+    return Retriever(mode="hybrid")
+
+
+def test_search_during_reload_sees_one_consistent_snapshot(retriever):
+    errors, stop = [], threading.Event()
+
+    def query():
+        try:
+            while not stop.is_set():
+                for results in [retriever.search("blood pressure", k=5)] + retriever.search_batch(["a", "b"], k=5):
+                    assert len(results) == 5
+                    generations = {r["patient_id"].split("-")[0] for r in results}
+                    generations |= {"g" + r["summary"].split()[0][len("generation"):] for r in results}
+                    assert len(generations) == 1
+        except Exception as exc:  # surfaced in the main thread below
+            errors.append(exc)
+            stop.set()
+
+    threads = [threading.Thread(target=query) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for _ in range(50):
+        retriever.reload()
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors[0]
+
+
+def test_reload_keeps_the_encoder(retriever):
+    model = retriever.load().model
+    retriever.reload()
+    assert retriever.model is model
+    assert retriever.summaries[0].startswith("generation1 ")
+
+
+def test_reload_notifies_listeners(retriever):
+    calls = []
+    retriever.add_reload_listener(lambda: calls.append(retriever.summaries[0]))
+    retriever.load()
+    assert calls == []
+    retriever.reload()
+    assert calls == [retriever.summaries[0]]